@@ -1,11 +1,18 @@
-from django.contrib import admin
-from .models import (
-     Category, Product,  Order,
-    OrderItem, Rating, Comment,  
-        )
-admin.site.register(Category)
-admin.site.register(Product)
-admin.site.register(Order)
-admin.site.register(OrderItem)
-admin.site.register(Rating)
-admin.site.register(Comment)
+from django.contrib import admin
+from .models import (
+     Category, Product,  Order,
+    OrderItem, Rating, Comment,  Job, OutboundEmail, StockReservation,
+    StockMovement, StockSnapshot, IdempotencyKey,
+        )
+admin.site.register(Category)
+admin.site.register(Product)
+admin.site.register(Order)
+admin.site.register(OrderItem)
+admin.site.register(Rating)
+admin.site.register(Comment)
+admin.site.register(Job)
+admin.site.register(OutboundEmail)
+admin.site.register(StockReservation)
+admin.site.register(StockMovement)
+admin.site.register(StockSnapshot)
+admin.site.register(IdempotencyKey)
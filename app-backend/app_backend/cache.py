@@ -0,0 +1,123 @@
+import hashlib
+import time
+import uuid
+from contextlib import contextmanager
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+
+CATALOG_VERSION_KEY = 'catalog:version'
+
+
+def _new_version():
+    # Seed from the clock so a version key that was evicted never comes back
+    # with a value that old cache entries were stored under.
+    return int(time.time() * 1000)
+
+
+def get_catalog_version():
+    version = cache.get(CATALOG_VERSION_KEY)
+    if version is None:
+        cache.add(CATALOG_VERSION_KEY, _new_version(), timeout=None)
+        version = cache.get(CATALOG_VERSION_KEY)
+    return version
+
+
+def bump_catalog_version():
+    """
+    Invalidate every cached catalog response at once. Old entries are never
+    read again and simply expire.
+    """
+    try:
+        cache.incr(CATALOG_VERSION_KEY)
+    except ValueError:
+        cache.set(CATALOG_VERSION_KEY, _new_version(), timeout=None)
+
+
+def catalog_cache_key(request, version=None):
+    if version is None:
+        version = get_catalog_version()
+    variant = '|'.join([
+        request.get_host(),
+        request.path,
+        '&'.join(f'{k}={v}' for k, v in sorted(request.GET.items())),
+        request.META.get('HTTP_ACCEPT', ''),
+    ])
+    digest = hashlib.md5(variant.encode()).hexdigest()
+    return f'catalog:v{version}:{digest}'
+
+
+def cached_for_catalog(name, compute):
+    """
+    Return compute() cached under the current catalog version, so the value
+    is recomputed after any catalog change.
+    """
+    digest = hashlib.md5(name.encode()).hexdigest()
+    key = f'catalog:v{get_catalog_version()}:value:{digest}'
+    return cache.get_or_set(key, compute, getattr(settings, 'CATALOG_CACHE_TIMEOUT', 300))
+
+
+def cache_catalog_response(view):
+    """
+    Cache the rendered response of a catalog GET view under the current
+    catalog version. Apply it above @api_view so the cached bytes are the
+    final rendered output.
+    """
+    @wraps(view)
+    def wrapped(request, *args, **kwargs):
+        if request.method != 'GET':
+            return view(request, *args, **kwargs)
+
+        key = catalog_cache_key(request)
+        cached = cache.get(key)
+        if cached is not None:
+            content, headers = cached
+            response = HttpResponse(content)
+            for name, value in headers.items():
+                response[name] = value
+            return response
+
+        response = view(request, *args, **kwargs)
+        if response.status_code == 200 and not response.streaming:
+            if hasattr(response, 'render'):
+                response.render()
+            timeout = getattr(settings, 'CATALOG_CACHE_TIMEOUT', 300)
+            cache.set(key, (response.content, dict(response.headers)), timeout)
+        return response
+
+    return wrapped
+
+
+class LockTimeout(Exception):
+    pass
+
+
+@contextmanager
+def single_flight(name, timeout=60, wait=30, poll_interval=0.05):
+    """
+    Hold the lock called name, so only one caller at a time runs the block.
+    Other callers wait up to wait seconds, then get LockTimeout. The lock
+    lives in the cache and expires after timeout seconds in case its holder
+    dies. It only excludes callers that share the cache: with the default
+    LocMemCache that is the threads of one process, so separate workers can
+    each hold it at once. Configure a shared backend such as Redis or
+    FileBasedCache to make it span processes.
+
+    Callers should re-check inside the block whether the work is still
+    needed: whoever held the lock before them has usually just done it.
+    """
+    key = f'lock:{name}'
+    token = uuid.uuid4().hex
+    deadline = time.monotonic() + wait
+    while not cache.add(key, token, timeout):
+        if time.monotonic() >= deadline:
+            raise LockTimeout(name)
+        time.sleep(poll_interval)
+    try:
+        yield
+    finally:
+        # Don't release a lock that expired and was taken by someone else
+        if cache.get(key) == token:
+            cache.delete(key)
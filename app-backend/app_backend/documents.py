@@ -0,0 +1,129 @@
+"""
+Materialized product read model.
+
+Each product's ProductSerializer output is rendered to JSON once and stored
+in ProductDocument, so the catalog endpoints can answer by concatenating
+stored bytes instead of serializing field by field.
+"""
+import json
+
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+from .models import Product, ProductDocument
+from .serializers import ProductSerializer
+
+# image and image_url are absolute and depend on the host of the request, so
+# documents are rendered against a placeholder origin that is swapped in on
+# the way out. Only JSON string values that start with it are rewritten; a
+# '":"' can't occur inside an encoded string.
+ORIGIN_PLACEHOLDER = 'http://product-document.invalid'
+VALUE_PREFIX = b'":"'
+
+
+class PrerenderedResponse(Response):
+    """
+    A DRF Response whose JSON body is already rendered. .data is decoded
+    lazily for code (and tests) that inspect it.
+    """
+    def __init__(self, content, **kwargs):
+        self.prerendered = content
+        super().__init__(**kwargs)
+
+    @property
+    def data(self):
+        return json.loads(self.prerendered)
+
+    @data.setter
+    def data(self, value):
+        # Response.__init__ assigns data; the body is self.prerendered
+        pass
+
+    @property
+    def rendered_content(self):
+        self['Content-Type'] = 'application/json'
+        return self.prerendered
+
+
+class _DocumentRequest:
+    def build_absolute_uri(self, location):
+        return ORIGIN_PLACEHOLDER + location
+
+
+def render_product_document(product):
+    context = {'request': _DocumentRequest()}
+    renderer = JSONRenderer()
+    return ProductDocument(
+        product=product,
+        full=renderer.render(ProductSerializer(product, context=context).data),
+        summary=renderer.render(
+            ProductSerializer(product, fields=ProductSerializer.SUMMARY_FIELDS, context=context).data
+        ),
+    )
+
+
+def build_product_documents(product_ids):
+    """Render and store documents for the given products. Returns {product_id: document}."""
+    documents = [
+        render_product_document(product)
+        for product in Product.objects.catalog().filter(id__in=product_ids)
+    ]
+    ProductDocument.objects.bulk_create(
+        documents,
+        update_conflicts=True,
+        unique_fields=['product'],
+        update_fields=['full', 'summary', 'built_at'],
+    )
+    return {document.product_id: document for document in documents}
+
+
+def invalidate_product_documents(product_ids):
+    """
+    Drop the documents of changed products right away, so nothing reads them
+    again, and rebuild them once the surrounding transaction has committed.
+    """
+    product_ids = sorted({pk for pk in product_ids if pk is not None})
+    if not product_ids:
+        return
+    ProductDocument.objects.filter(product_id__in=product_ids).delete()
+    # robust: the change is already committed, and a document that fails to
+    # build here is built on its next read instead
+    transaction.on_commit(lambda: build_product_documents(product_ids), robust=True)
+
+
+def _stored_body(product, kind):
+    try:
+        return bytes(getattr(product.document, kind))
+    except ProductDocument.DoesNotExist:
+        return None
+
+
+def _with_origin(request, body):
+    origin = request.build_absolute_uri('/')[:-1].encode()
+    return body.replace(VALUE_PREFIX + ORIGIN_PLACEHOLDER.encode(), VALUE_PREFIX + origin)
+
+
+def render_documents(request, products, kind):
+    """
+    Return the JSON array of the given products' documents. Products should
+    come from Product.objects.with_document(kind); missing documents are
+    built on the spot.
+    """
+    bodies = {product.pk: _stored_body(product, kind) for product in products}
+    missing = [pk for pk, body in bodies.items() if body is None]
+    if missing:
+        for pk, document in build_product_documents(missing).items():
+            bodies[pk] = bytes(getattr(document, kind))
+    parts = [bodies[product.pk] for product in products if bodies.get(product.pk) is not None]
+    return _with_origin(request, b'[' + b','.join(parts) + b']')
+
+
+def render_document(request, product, kind):
+    body = _stored_body(product, kind)
+    if body is None:
+        document = build_product_documents([product.pk]).get(product.pk)
+        if document is None:
+            raise Product.DoesNotExist
+        body = bytes(getattr(document, kind))
+    return _with_origin(request, body)
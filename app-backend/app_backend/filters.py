@@ -0,0 +1,156 @@
+from decimal import Decimal, InvalidOperation
+
+from django.db.models import Count, Q
+
+from .models import Product
+
+TRUE_VALUES = {'true', '1', 'yes'}
+FALSE_VALUES = {'false', '0', 'no'}
+
+
+def parse_bool(name, value):
+    value = value.lower()
+    if value in TRUE_VALUES:
+        return True
+    if value in FALSE_VALUES:
+        return False
+    raise ValueError(f"'{name}' must be true or false")
+
+
+def parse_price(name, value):
+    try:
+        price = Decimal(value)
+    except InvalidOperation:
+        raise ValueError(f"'{name}' must be a number")
+    # NaN can't be compared, and neither it nor Infinity is a price
+    if not price.is_finite():
+        raise ValueError(f"'{name}' must be a number")
+    if price < 0:
+        raise ValueError(f"'{name}' must not be negative")
+    return price
+
+
+class ProductFilters:
+    """
+    Catalog filters parsed from query params, plus facet counts for them.
+
+    Query params:
+        category: category id, or several comma separated
+        min_price / max_price: inclusive price range
+        in_stock: true or false (quantity_in_stock > 0)
+        warranty: true or false
+
+    Each facet is counted with every filter applied except its own, so the
+    counts say how many products picking that value would return.
+    """
+    DIMENSIONS = ['category', 'price', 'availability', 'warranty']
+
+    # (min, max) price buckets for the price facet; max is exclusive
+    PRICE_BUCKETS = [
+        (Decimal('0'), Decimal('100')),
+        (Decimal('100'), Decimal('500')),
+        (Decimal('500'), Decimal('1000')),
+        (Decimal('1000'), None),
+    ]
+
+    def __init__(self, params):
+        self.categories = None
+        self.min_price = None
+        self.max_price = None
+        self.in_stock = None
+        self.warranty = None
+
+        if params.get('category'):
+            try:
+                self.categories = sorted({int(pk) for pk in params['category'].split(',') if pk})
+                # Larger ids overflow the database's integer columns
+                if any(not 0 <= pk < 2 ** 63 for pk in self.categories):
+                    raise ValueError
+            except ValueError:
+                raise ValueError("'category' must be a category id or a comma separated list of ids")
+        if params.get('min_price'):
+            self.min_price = parse_price('min_price', params['min_price'])
+        if params.get('max_price'):
+            self.max_price = parse_price('max_price', params['max_price'])
+        if params.get('in_stock'):
+            self.in_stock = parse_bool('in_stock', params['in_stock'])
+        if params.get('warranty'):
+            self.warranty = parse_bool('warranty', params['warranty'])
+
+    def q(self, exclude=None):
+        """The filters as a Q object, leaving out the dimension named by exclude."""
+        q = Q()
+        if self.categories and exclude != 'category':
+            q &= Q(category_id__in=self.categories)
+        if exclude != 'price':
+            if self.min_price is not None:
+                q &= Q(price__gte=self.min_price)
+            if self.max_price is not None:
+                q &= Q(price__lte=self.max_price)
+        if self.in_stock is not None and exclude != 'availability':
+            q &= Q(quantity_in_stock__gt=0) if self.in_stock else Q(quantity_in_stock=0)
+        if self.warranty is not None and exclude != 'warranty':
+            q &= Q(warranty_status=self.warranty)
+        return q
+
+    def apply(self, queryset):
+        return queryset.filter(self.q())
+
+    def cache_key(self):
+        return (
+            f"c={','.join(map(str, self.categories or []))}"
+            f"&min={self.min_price}&max={self.max_price}"
+            f"&stock={self.in_stock}&warranty={self.warranty}"
+        )
+
+    def facet_counts(self):
+        """One GROUP BY (or conditional aggregate) query per dimension."""
+        products = Product.objects.all()
+
+        categories = (
+            products.filter(self.q(exclude='category'))
+            .values('category_id', 'category__name')
+            .annotate(count=Count('id'))
+            .order_by('category__name')
+        )
+
+        price_aggregates = {}
+        for index, (low, high) in enumerate(self.PRICE_BUCKETS):
+            bucket = Q(price__gte=low)
+            if high is not None:
+                bucket &= Q(price__lt=high)
+            price_aggregates[f'bucket_{index}'] = Count('id', filter=bucket)
+        prices = products.filter(self.q(exclude='price')).aggregate(**price_aggregates)
+
+        availability = products.filter(self.q(exclude='availability')).aggregate(
+            in_stock=Count('id', filter=Q(quantity_in_stock__gt=0)),
+            out_of_stock=Count('id', filter=Q(quantity_in_stock=0)),
+        )
+
+        warranty = {
+            row['warranty_status']: row['count']
+            for row in products.filter(self.q(exclude='warranty'))
+            .values('warranty_status')
+            .annotate(count=Count('id'))
+            .order_by()
+        }
+
+        return {
+            'category': [
+                {'id': row['category_id'], 'name': row['category__name'], 'count': row['count']}
+                for row in categories
+            ],
+            'price': [
+                {
+                    'min': str(low),
+                    'max': str(high) if high is not None else None,
+                    'count': prices[f'bucket_{index}'],
+                }
+                for index, (low, high) in enumerate(self.PRICE_BUCKETS)
+            ],
+            'availability': availability,
+            'warranty': {
+                'true': warranty.get(True, 0),
+                'false': warranty.get(False, 0),
+            },
+        }
@@ -0,0 +1,162 @@
+"""
+Idempotency-Key support for order endpoints.
+
+A client that sends an Idempotency-Key header can retry the request as often
+as it likes: the first request runs, later ones get its response replayed,
+marked with an Idempotent-Replayed header. The response is stored in the same
+transaction as whatever the view wrote, so either both committed or neither
+did, and a retry never runs the request twice.
+
+A key reused with a different request gets 422; a retry that arrives while
+the first request is still running gets 409 and should try again shortly.
+Server errors (5xx) and responses that ask the client to try again, such
+as create_order's 409 when stock was sold mid-checkout, aren't stored, so
+the request can be retried for real.
+Keys expire after IDEMPOTENCY_KEY_TTL and are purged by the
+purge_idempotency_keys management command.
+"""
+import hashlib
+import json
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.http import HttpResponse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+from .models import IdempotencyKey
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+# Client errors that say "try again" rather than "this request is wrong"
+RETRYABLE_STATUSES = {408, 409, 425, 429}
+
+
+def request_fingerprint(request):
+    data = request.data
+    if hasattr(data, 'lists'):
+        data = dict(data.lists())
+    payload = json.dumps(
+        [request.method, request.path, data], sort_keys=True, separators=(',', ':'), default=str,
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _claim(key, fingerprint):
+    """
+    Store key as in progress. Returns None if this request now owns it,
+    otherwise the existing row. Expired keys, and claims whose request died
+    without committing a response, are taken over.
+    """
+    now = timezone.now()
+    lock_timeout = timedelta(seconds=getattr(settings, 'IDEMPOTENCY_LOCK_TIMEOUT', 60))
+    ttl = timedelta(seconds=getattr(settings, 'IDEMPOTENCY_KEY_TTL', 24 * 60 * 60))
+    claim = {
+        'fingerprint': fingerprint,
+        'status_code': None,
+        'response_body': '',
+        'locked_until': now + lock_timeout,
+        'expires_at': now + ttl,
+    }
+    try:
+        with transaction.atomic():
+            IdempotencyKey.objects.create(key=key, **claim)
+        return None
+    except IntegrityError:
+        pass
+
+    reusable = Q(expires_at__lte=now) | Q(status_code__isnull=True, locked_until__lte=now)
+    # Conditional, so of two retries taking over the same key only one wins
+    if IdempotencyKey.objects.filter(reusable, key=key).update(**claim):
+        return None
+    return IdempotencyKey.objects.filter(key=key).first()
+
+
+def _replay(record, fingerprint):
+    if record is None or record.status_code is None:
+        response = Response(
+            {'error': f'A request with this {HEADER} is still being processed'},
+            status=status.HTTP_409_CONFLICT
+        )
+        response['Retry-After'] = '1'
+        return response
+    if record.fingerprint != fingerprint:
+        return Response(
+            {'error': f'This {HEADER} was already used for a different request'},
+            status=status.HTTP_422_UNPROCESSABLE_ENTITY
+        )
+    response = HttpResponse(record.response_body, status=record.status_code, content_type='application/json')
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def is_final(response):
+    """Whether response is the request's answer for good, and so replayed to retries."""
+    return response.status_code < 500 and response.status_code not in RETRYABLE_STATUSES
+
+
+def _release(key):
+    IdempotencyKey.objects.filter(key=key, status_code__isnull=True).delete()
+
+
+def idempotent(view):
+    """
+    Make a function view replay its response to requests that repeat an
+    Idempotency-Key. Apply it below @api_view and @permission_classes.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if key is None:
+            return view(request, *args, **kwargs)
+        if not key or len(key) > MAX_KEY_LENGTH:
+            return Response(
+                {'error': f'{HEADER} must be 1 to {MAX_KEY_LENGTH} characters'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        fingerprint = request_fingerprint(request)
+        existing = _claim(key, fingerprint)
+        if existing is not None:
+            return _replay(existing, fingerprint)
+
+        try:
+            with transaction.atomic():
+                response = view(request, *args, **kwargs)
+                if not is_final(response):
+                    transaction.set_rollback(True)
+                else:
+                    if isinstance(response, Response):
+                        body = JSONRenderer().render(response.data)
+                    else:
+                        body = response.content
+                    IdempotencyKey.objects.filter(key=key).update(
+                        status_code=response.status_code,
+                        response_body=body.decode(),
+                        locked_until=None,
+                    )
+        except Exception:
+            _release(key)
+            raise
+        if not is_final(response):
+            _release(key)
+        return response
+    return wrapper
+
+
+def purge_expired_keys(batch_size=1000):
+    """Delete expired keys, batch_size at a time. Returns how many."""
+    purged = 0
+    while True:
+        ids = list(
+            IdempotencyKey.objects.filter(expires_at__lte=timezone.now())
+            .values_list('id', flat=True)[:batch_size]
+        )
+        if not ids:
+            return purged
+        purged += IdempotencyKey.objects.filter(id__in=ids).delete()[0]
@@ -0,0 +1,101 @@
+"""
+Resized WebP derivatives of product images.
+
+Every product image gets one WebP per entry of IMAGE_VARIANTS, no wider than
+the given width. Derivatives are named after a hash of the source file's
+content, so they never change once written, are shared by products that use
+the same picture, and are only generated once.
+"""
+import hashlib
+import logging
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+# variant name -> maximum width in pixels, smallest first
+IMAGE_VARIANTS = {
+    'thumbnail': 200,
+    'card': 480,
+    'detail': 1200,
+}
+WEBP_QUALITY = 80
+VARIANT_DIR = 'derived'
+
+
+def content_digest(name):
+    digest = hashlib.sha256()
+    with default_storage.open(name, 'rb') as source:
+        for chunk in iter(lambda: source.read(64 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:20]
+
+
+def variant_name(digest, variant):
+    return f'{VARIANT_DIR}/{digest}-{variant}.webp'
+
+
+def _resized(image, width):
+    if image.width <= width:
+        return image
+    height = max(1, round(image.height * width / image.width))
+    return image.resize((width, height), Image.LANCZOS)
+
+
+def generate_image_variants(name):
+    """
+    Write the WebP derivatives of the stored image name and return
+    {variant: {'name': ..., 'width': ...}}. Derivatives that already exist
+    are not regenerated. Returns an empty dict if the image can't be read.
+    """
+    try:
+        digest = content_digest(name)
+        with default_storage.open(name, 'rb') as source:
+            image = Image.open(source)
+            image = ImageOps.exif_transpose(image)
+            image.load()
+    except (OSError, Image.DecompressionBombError):
+        logger.warning("Could not read product image %s", name, exc_info=True)
+        return {}
+
+    image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+    variants = {}
+    for variant, width in IMAGE_VARIANTS.items():
+        resized = _resized(image, width)
+        target = variant_name(digest, variant)
+        if not default_storage.exists(target):
+            buffer = BytesIO()
+            resized.save(buffer, 'WEBP', quality=WEBP_QUALITY, method=4)
+            default_storage.save(target, ContentFile(buffer.getvalue()))
+        variants[variant] = {'name': target, 'width': resized.width}
+    return variants
+
+
+def refresh_image_variants(product_id):
+    """Generate the derivatives of a product's current image and store them on it."""
+    from .models import Product
+
+    product = Product.objects.filter(pk=product_id).first()
+    if product is None:
+        return
+    source = product.image.name if product.image else ''
+    variants = generate_image_variants(source) if source else {}
+    product.image_variants = {'source': source, 'variants': variants}
+    product.save(update_fields=['image_variants', 'updated_at'])
+
+
+def variant_urls(product):
+    """
+    The derivatives of product's current image as {variant: (url, width)},
+    or an empty dict if they haven't been generated yet.
+    """
+    stored = product.image_variants or {}
+    if not product.image or stored.get('source') != product.image.name:
+        return {}
+    return {
+        variant: (default_storage.url(info['name']), info['width'])
+        for variant, info in stored.get('variants', {}).items()
+    }
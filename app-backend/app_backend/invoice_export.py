@@ -0,0 +1,130 @@
+"""
+Bulk invoice export.
+
+Invoices for a set of orders are rendered and written to a ZIP archive one
+at a time, so neither the view nor the management command ever holds more
+than a few PDFs in memory. Invoices whose stored PDF is still current (see
+invoices.ensure_invoice) are read instead of rendered. The view renders in
+the request's own process; only the export_invoices command, which runs
+outside the web server, renders in a process pool.
+"""
+import multiprocessing
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+
+from django.core.files.storage import default_storage
+from django.db import connection, connections
+
+from .invoices import generate_invoice_pdf, invoice_content_hash, invoice_items, is_invoice_current
+from .models import Order
+
+
+def parse_export_filters(params):
+    """
+    Turn from/to (YYYY-MM-DD, inclusive) and status (comma separated)
+    params into Order filter kwargs. Raises ValueError on bad input.
+    """
+    filters = {}
+    for param, lookup in (('from', 'created_at__date__gte'), ('to', 'created_at__date__lte')):
+        if params.get(param):
+            try:
+                filters[lookup] = date.fromisoformat(params[param])
+            except ValueError:
+                raise ValueError(f"'{param}' must be a date in YYYY-MM-DD format")
+    if params.get('status'):
+        statuses = [value for value in params['status'].split(',') if value]
+        valid = dict(Order.STATUS_CHOICES)
+        unknown = [value for value in statuses if value not in valid]
+        if unknown:
+            raise ValueError(f"Unknown status: {', '.join(unknown)}. Choose from: {', '.join(valid)}")
+        filters['status__in'] = statuses
+    return filters
+
+
+def export_order_ids(filters):
+    return list(Order.objects.filter(**filters).order_by('id').values_list('id', flat=True))
+
+
+def render_invoice(order_id):
+    """Return (filename, pdf bytes) for one order. Runs in pool workers."""
+    order = Order.objects.select_related('user').get(pk=order_id)
+    items = invoice_items(order)
+    name = order.invoice_pdf.name
+    if is_invoice_current(name, order.invoice_hash, invoice_content_hash(order, items)):
+        with default_storage.open(name, 'rb') as f:
+            content = f.read()
+    else:
+        content = generate_invoice_pdf(order, items).getvalue()
+    return f'invoice_order_{order.id}.pdf', content
+
+
+def _render_in_worker(order_id):
+    try:
+        return render_invoice(order_id)
+    finally:
+        connection.close()
+
+
+def iter_invoices(order_ids, workers=1):
+    """
+    Yield (filename, pdf bytes) for order_ids in order. With workers > 1
+    they are rendered in a process pool with at most 2 * workers in flight.
+    """
+    if workers <= 1:
+        for order_id in order_ids:
+            yield render_invoice(order_id)
+        return
+
+    # Forked workers must not share this process's database connections
+    connections.close_all()
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork'))
+    try:
+        pending = deque()
+        order_ids = iter(order_ids)
+        for order_id in order_ids:
+            pending.append(pool.submit(_render_in_worker, order_id))
+            if len(pending) >= workers * 2:
+                break
+        while pending:
+            result = pending.popleft().result()
+            next_id = next(order_ids, None)
+            if next_id is not None:
+                pending.append(pool.submit(_render_in_worker, next_id))
+            yield result
+    finally:
+        pool.shutdown(cancel_futures=True)
+
+
+class _ChunkWriter:
+    """Write-only file object that collects what zipfile writes until taken."""
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def stream_invoice_zip(invoices):
+    """Yield a ZIP archive of (filename, content) pairs, one file at a time."""
+    writer = _ChunkWriter()
+    with zipfile.ZipFile(writer, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for filename, content in invoices:
+            archive.writestr(filename, content)
+            yield writer.take()
+    yield writer.take()
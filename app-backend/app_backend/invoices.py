@@ -0,0 +1,260 @@
+"""
+Invoice PDFs.
+
+An order's invoice is rendered once per version of its billable content:
+ensure_invoice() hashes everything the PDF shows and only renders when that
+hash differs from the one the stored file was rendered from, e.g. after a
+refund or cancellation. Concurrent requests for the same order are
+single-flighted through the cache (see cache.single_flight), so a burst of
+downloads renders it once per process, or once overall with a cache
+backend the processes share.
+
+The superseded PDF is deleted once the new one is stored. Invoice emails
+still waiting in the outbox look the order's PDF up when they are sent,
+so they attach the current file rather than the deleted one.
+"""
+import hashlib
+import json
+from decimal import Decimal
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from reportlab.lib.rl_accel import fp_str
+from reportlab.pdfgen import canvas
+
+from .cache import LockTimeout, single_flight
+from .models import Order
+from .outbox import queue_email
+
+# Bump when the PDF layout changes, so stored invoices are rendered again
+INVOICE_LAYOUT_VERSION = 1
+
+
+class InvoiceBusy(Exception):
+    """Another request has been rendering this invoice for too long."""
+
+
+def invoice_items(order):
+    return list(order.items.select_related('product').order_by('id'))
+
+
+def invoice_content_hash(order, items):
+    """Hash of everything generate_invoice_pdf draws for order."""
+    user = order.user
+    content = {
+        'layout': INVOICE_LAYOUT_VERSION,
+        'order': [order.id, order.created_at.date().isoformat(), order.status, str(order.total_price)],
+        'user': [user.first_name, user.last_name, user.username, user.email],
+        'items': [
+            [item.product.title, item.quantity, str(item.price_at_purchase)]
+            for item in items
+        ],
+    }
+    encoded = json.dumps(content, separators=(',', ':'), sort_keys=True).encode()
+    return hashlib.sha256(encoded).hexdigest()
+
+
+def is_invoice_current(name, invoice_hash, digest):
+    return bool(name) and invoice_hash == digest and default_storage.exists(name)
+
+
+def ensure_invoice(order):
+    """
+    Make sure order.invoice_pdf holds an invoice for the order's current
+    content and return its storage name. Raises InvoiceBusy if another
+    render of the same order doesn't finish in time.
+    """
+    items = invoice_items(order)
+    digest = invoice_content_hash(order, items)
+    if is_invoice_current(order.invoice_pdf.name, order.invoice_hash, digest):
+        return order.invoice_pdf.name
+
+    try:
+        with single_flight(f'invoice:{order.pk}', timeout=120, wait=60):
+            # Whoever held the lock before us has probably rendered it
+            stored = Order.objects.values('invoice_pdf', 'invoice_hash').get(pk=order.pk)
+            if is_invoice_current(stored['invoice_pdf'], stored['invoice_hash'], digest):
+                name = stored['invoice_pdf']
+            else:
+                pdf = generate_invoice_pdf(order, items)
+                name = default_storage.save(
+                    f'invoices/invoice_order_{order.id}_{digest[:16]}.pdf',
+                    ContentFile(pdf.getvalue()),
+                )
+                # Only touch the invoice columns, the status may be changing
+                Order.objects.filter(pk=order.pk).update(invoice_pdf=name, invoice_hash=digest)
+                previous = stored['invoice_pdf']
+                if previous and previous != name:
+                    default_storage.delete(previous)
+    except LockTimeout:
+        raise InvoiceBusy(f"Invoice for order {order.pk} is still being generated")
+
+    order.invoice_pdf.name = name
+    order.invoice_hash = digest
+    return name
+
+
+def send_invoice_email(order):
+    """Queue the order's stored invoice PDF to be emailed to the customer."""
+    if not order.user.email:
+        return None
+    return queue_email(
+        subject=f"Invoice for Order #{order.id}",
+        body="Please find your invoice attached.",
+        to=[order.user.email],
+        attachments=[(order.invoice_pdf.name, f"invoice_order_{order.id}.pdf", "application/pdf", order.id)],
+    )
+
+
+PAGE_SIZE = (595, 842)  # A4
+ROW_HEIGHT = 20
+FIRST_ROW_Y = 600
+CONTINUATION_ROW_Y = 770
+MIN_ROW_Y = 100
+COLUMN_X = (50, 300, 370, 450)
+INVOICE_FONTS = ('Helvetica', 'Helvetica-Bold')
+
+
+def _text_code(p, runs):
+    """PDF operators drawing (font, size, x, y, text) runs as one text object."""
+    t = p.beginText()
+    for font, size, x, y, text in runs:
+        t.setFont(font, size)
+        t.setTextOrigin(x, y)
+        t.textOut(text)
+    return t.getCode()
+
+
+def _line_code(x1, y1, x2, y2):
+    # Same operators as canvas.line()
+    return f'n {fp_str(x1, y1)} m {fp_str(x2, y2)} l S'
+
+
+def _table_header_code(p, y):
+    headings = ('Item', 'Quantity', 'Unit Price', 'Total')
+    return ' '.join([
+        _text_code(p, [('Helvetica-Bold', 10, x, y, text) for x, text in zip(COLUMN_X, headings)]),
+        _line_code(50, y - 10, 550, y - 10),
+    ])
+
+
+class InvoiceTemplate:
+    """
+    The parts of an invoice that are the same for every order, as ready made
+    PDF content stream operators. Built once per process and copied into
+    each invoice with addLiteral() instead of being drawn call by call.
+    """
+    def __init__(self, p):
+        self.first_page = ' '.join([
+            _text_code(p, [
+                ('Helvetica-Bold', 16, 50, 800, "CS308 Store"),
+                ('Helvetica', 10, 50, 780, "Invoice"),
+                ('Helvetica-Bold', 12, 50, 730, "Bill To:"),
+            ]),
+            _table_header_code(p, 630),
+        ])
+        self.continuation_page = _table_header_code(p, 800)
+        # Drawn translated to the y of the last line item
+        self.totals = ' '.join([
+            _line_code(50, -10, 550, -10),
+            _text_code(p, [
+                ('Helvetica', 10, 350, -30, "Subtotal:"),
+                ('Helvetica', 10, 350, -50, "Tax (8%):"),
+                ('Helvetica', 10, 350, -70, "Shipping:"),
+            ]),
+            _line_code(350, -80, 550, -80),
+            _text_code(p, [('Helvetica-Bold', 12, 350, -100, "Total:")]),
+        ])
+        self.footer = _text_code(p, [
+            ('Helvetica', 8, 50, 50, "Thank you for your purchase!"),
+            ('Helvetica', 8, 50, 35, "If you have any questions, please contact customer support."),
+        ])
+
+
+_templates = {}
+
+
+def _invoice_template(p):
+    # The operators refer to fonts by the names p's document gives them
+    # (/F1, /F2, ...). Registering the fonts in a fixed order makes the names
+    # the same in every invoice, and keying on them keeps that honest.
+    fonts = tuple(p._doc.getInternalFontName(font) for font in INVOICE_FONTS)
+    template = _templates.get(fonts)
+    if template is None:
+        template = _templates[fonts] = InvoiceTemplate(p)
+    return template
+
+
+def _draw_rows(p, top, rows):
+    """Draw rows of cell strings downwards from top, one text object per column."""
+    if not rows:
+        return
+    for column, x in enumerate(COLUMN_X):
+        t = p.beginText(x, top)
+        t.setFont('Helvetica', 10, ROW_HEIGHT)
+        for row in rows:
+            t.textLine(row[column])
+        p.drawText(t)
+
+
+def generate_invoice_pdf(order, items=None):
+    if items is None:
+        items = invoice_items(order)
+    buffer = BytesIO()
+    p = canvas.Canvas(buffer, pagesize=PAGE_SIZE)
+    template = _invoice_template(p)
+    user = order.user
+
+    p.addLiteral(template.first_page)
+    p.addLiteral(_text_code(p, [
+        ('Helvetica-Bold', 12, 400, 800, f"Invoice #{order.id}"),
+        ('Helvetica', 10, 400, 780, f"Date: {order.created_at.strftime('%Y-%m-%d')}"),
+        ('Helvetica', 10, 400, 765, f"Order Status: {order.get_status_display()}"),
+        ('Helvetica', 10, 50, 715, f"{user.first_name} {user.last_name}"),
+        ('Helvetica', 10, 50, 700, f"Username: {user.username}"),
+        ('Helvetica', 10, 50, 685, f"Email: {user.email}"),
+    ]))
+
+    # Line items, starting a new page when we run out of space
+    top = FIRST_ROW_Y
+    rows = []
+    total = 0
+    for item in items:
+        if top - ROW_HEIGHT * len(rows) < MIN_ROW_Y:
+            _draw_rows(p, top, rows)
+            p.showPage()
+            p.addLiteral(template.continuation_page)
+            top = CONTINUATION_ROW_Y
+            rows = []
+
+        item_total = item.price_at_purchase * item.quantity
+        total += item_total
+        rows.append((
+            item.product.title,
+            str(item.quantity),
+            f"${item.price_at_purchase:.2f}",
+            f"${item_total:.2f}",
+        ))
+    _draw_rows(p, top, rows)
+    y = top - ROW_HEIGHT * len(rows)
+
+    # Tax is 8%, shipping a fixed amount
+    tax = total * Decimal('0.08')
+    shipping = Decimal('5.99')
+    p.saveState()
+    p.translate(0, y)
+    p.addLiteral(template.totals)
+    p.restoreState()
+    p.addLiteral(_text_code(p, [
+        ('Helvetica', 10, 450, y - 30, f"${total:.2f}"),
+        ('Helvetica', 10, 450, y - 50, f"${tax:.2f}"),
+        ('Helvetica', 10, 450, y - 70, f"${shipping:.2f}"),
+        ('Helvetica-Bold', 12, 450, y - 100, f"${order.total_price:.2f}"),
+    ]))
+
+    p.addLiteral(template.footer)
+    p.showPage()
+    p.save()
+    buffer.seek(0)
+    return buffer
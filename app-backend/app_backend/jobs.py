@@ -0,0 +1,135 @@
+"""
+Database-backed background jobs.
+
+Work that doesn't have to finish before a response is sent (rendering and
+emailing invoices, ...) is stored as a Job row with enqueue() and executed by
+the run_jobs management command. Because the row is written through the
+normal database connection, a job enqueued inside a transaction only
+becomes visible to workers once that transaction commits, and is dropped
+with it on rollback.
+
+Tasks are plain functions registered with @task under a name; the job's
+payload is passed to them as keyword arguments. A task that raises is
+retried with exponential backoff until max_attempts, then left as failed.
+"""
+import logging
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.utils import timezone
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+TASKS = {}
+
+
+class PermanentJobError(Exception):
+    """Raise from a task to fail the job right away instead of retrying it."""
+
+
+def task(name, max_attempts=3):
+    """Register the decorated function as the task called name."""
+    def register(func):
+        TASKS[name] = (func, max_attempts)
+        return func
+    return register
+
+
+def enqueue(name, payload=None, run_at=None):
+    if name not in TASKS:
+        raise ValueError(f"Unknown task '{name}'")
+    return Job.objects.create(
+        task=name,
+        payload=payload or {},
+        max_attempts=TASKS[name][1],
+        run_at=run_at or timezone.now(),
+    )
+
+
+def retry_delay(attempts):
+    base = getattr(settings, 'JOB_RETRY_DELAY', 30)
+    return timedelta(seconds=base * 2 ** (attempts - 1))
+
+
+def claim_jobs(worker, limit):
+    """
+    Mark up to limit due pending jobs as running for worker and return them.
+    The conditional UPDATE means two workers never claim the same job.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        ids = list(
+            Job.objects.select_for_update(skip_locked=True)
+            .filter(status='pending', run_at__lte=now)
+            .order_by('run_at', 'id')
+            .values_list('id', flat=True)[:limit]
+        )
+        if not ids:
+            return []
+        Job.objects.filter(id__in=ids, status='pending').update(
+            status='running', locked_by=worker, locked_at=now,
+        )
+    return list(
+        Job.objects.filter(id__in=ids, status='running', locked_by=worker, locked_at=now)
+        .order_by('run_at', 'id')
+    )
+
+
+def release_stale_jobs():
+    """
+    Put jobs whose worker died mid-run back in the queue. A job counts as
+    stale once it has been running for JOB_LOCK_TIMEOUT seconds.
+    """
+    timeout = getattr(settings, 'JOB_LOCK_TIMEOUT', 600)
+    cutoff = timezone.now() - timedelta(seconds=timeout)
+    return Job.objects.filter(status='running', locked_at__lt=cutoff).update(
+        status='pending', locked_by='', locked_at=None,
+    )
+
+
+def run_job(job):
+    """Run a claimed job and record the outcome. Returns True on success."""
+    job.attempts += 1
+    try:
+        if job.task not in TASKS:
+            raise PermanentJobError(f"Unknown task '{job.task}'")
+        func, _ = TASKS[job.task]
+        func(**job.payload)
+    except Exception as e:
+        job.last_error = traceback.format_exc()
+        if isinstance(e, PermanentJobError) or job.attempts >= job.max_attempts:
+            logger.error("Job %s failed for good: %s", job, e)
+            job.status = 'failed'
+            job.finished_at = timezone.now()
+        else:
+            logger.warning("Job %s failed, retrying: %s", job, e)
+            job.status = 'pending'
+            job.run_at = timezone.now() + retry_delay(job.attempts)
+        succeeded = False
+    else:
+        job.status = 'done'
+        job.finished_at = timezone.now()
+        job.last_error = ''
+        succeeded = True
+    job.locked_by = ''
+    job.locked_at = None
+    job.save(update_fields=[
+        'status', 'attempts', 'run_at', 'locked_by', 'locked_at', 'last_error', 'finished_at',
+    ])
+    return succeeded
+
+
+def run_job_in_pool(job_id):
+    """
+    Run one claimed job from a pool thread or process, which has its own
+    database connection; it is closed again afterwards.
+    """
+    close_old_connections()
+    try:
+        return run_job(Job.objects.get(pk=job_id))
+    finally:
+        connection.close()
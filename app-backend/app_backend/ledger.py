@@ -0,0 +1,123 @@
+"""
+Stock movement ledger.
+
+Every change to Product.quantity_in_stock is also appended as a
+StockMovement row in the same transaction: sales and refunds through
+record_movements(), hand edits through the record_stock_adjustment receiver.
+quantity_in_stock stays the counter checkout checks against, since its
+conditional UPDATE is what stops overselling; the ledger is the history
+behind it.
+
+compact_stock_ledger folds movements into StockSnapshot rows, so a
+product's stock as of any time is its last snapshot before then plus a
+short, indexed range of movements, and reconcile() can check the counter
+against the ledger.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import F, OuterRef, Q, Subquery, Sum
+from django.utils import timezone
+
+from .models import Product, StockMovement, StockSnapshot
+
+
+def record_movements(changes, reason, order=None):
+    """Append {product_id: change} as movements, with a single insert."""
+    now = timezone.now()
+    return StockMovement.objects.bulk_create([
+        StockMovement(product_id=product_id, change=change, reason=reason, order=order, created_at=now)
+        for product_id, change in changes.items()
+        if change
+    ])
+
+
+def _latest_snapshot(field, before=None):
+    snapshots = StockSnapshot.objects.filter(product=OuterRef('pk'))
+    if before is not None:
+        snapshots = snapshots.filter(taken_at__lte=before)
+    return Subquery(snapshots.order_by('-taken_at').values(field)[:1])
+
+
+def _with_ledger(products, before=None):
+    """Annotate products with their last snapshot (before `before`) and the movements since."""
+    products = products.annotate(
+        snapshot_quantity=_latest_snapshot('quantity', before),
+        snapshot_taken_at=_latest_snapshot('taken_at', before),
+    )
+    since = Q(stock_movements__created_at__gt=F('snapshot_taken_at')) | Q(snapshot_taken_at__isnull=True)
+    if before is not None:
+        since &= Q(stock_movements__created_at__lte=before)
+    return products.annotate(tail=Sum('stock_movements__change', filter=since, default=0))
+
+
+def stock_as_of(product_id, when):
+    """
+    The product's stock as of when: its last snapshot up to then plus the
+    movements after it. Without an earlier snapshot it is worked back from
+    the current stock instead.
+    """
+    product = _with_ledger(Product.objects.filter(pk=product_id), before=when).values(
+        'quantity_in_stock', 'snapshot_quantity', 'tail',
+    ).get()
+    if product['snapshot_quantity'] is not None:
+        return product['snapshot_quantity'] + product['tail']
+    later = (
+        StockMovement.objects.filter(product_id=product_id, created_at__gt=when)
+        .aggregate(total=Sum('change', default=0))['total']
+    )
+    return product['quantity_in_stock'] - later
+
+
+def compaction_cutoff():
+    # Leave recent movements alone: a transaction still in flight may commit
+    # a movement stamped just before now
+    return timezone.now() - timedelta(seconds=getattr(settings, 'STOCK_SNAPSHOT_LAG', 60))
+
+
+def compact(cutoff=None, batch_size=500):
+    """
+    Write a snapshot as of cutoff for every product that has moved since its
+    last one. A product without snapshots gets a first one worked back from
+    its current stock, which covers stock from before the ledger existed.
+    Returns the number of snapshots written.
+    """
+    cutoff = cutoff or compaction_cutoff()
+    moved = Q(stock_movements__created_at__gt=F('snapshot_taken_at'), stock_movements__created_at__lte=cutoff)
+    products = _with_ledger(Product.objects.all(), before=cutoff).annotate(
+        moves=Sum('stock_movements__change', filter=moved),
+        later=Sum('stock_movements__change', filter=Q(stock_movements__created_at__gt=cutoff), default=0),
+    ).filter(
+        Q(snapshot_taken_at__isnull=True) | Q(moves__isnull=False)
+    ).values_list('id', 'quantity_in_stock', 'snapshot_quantity', 'tail', 'later')
+
+    written = 0
+    batch = []
+    for product_id, in_stock, snapshot_quantity, tail, later in products.iterator(chunk_size=batch_size):
+        if snapshot_quantity is None:
+            quantity = in_stock - later
+        else:
+            quantity = snapshot_quantity + tail
+        batch.append(StockSnapshot(product_id=product_id, quantity=quantity, taken_at=cutoff))
+        if len(batch) >= batch_size:
+            written += len(StockSnapshot.objects.bulk_create(batch))
+            batch = []
+    if batch:
+        written += len(StockSnapshot.objects.bulk_create(batch))
+    return written
+
+
+def reconcile():
+    """
+    Products whose quantity_in_stock doesn't match their ledger, as
+    (product_id, quantity_in_stock, ledger quantity). Products without a
+    snapshot yet have nothing to check against and are skipped.
+    """
+    products = _with_ledger(Product.objects.all()).filter(snapshot_taken_at__isnull=False)
+    return [
+        (product_id, in_stock, snapshot_quantity + tail)
+        for product_id, in_stock, snapshot_quantity, tail in products.values_list(
+            'id', 'quantity_in_stock', 'snapshot_quantity', 'tail',
+        )
+        if in_stock != snapshot_quantity + tail
+    ]
@@ -0,0 +1,63 @@
+import time
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from app_backend.invoices import generate_invoice_pdf
+from app_backend.models import Order, OrderItem, Product
+
+
+class Command(BaseCommand):
+    help = "Measure how many invoice PDFs per second this machine renders."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--items',
+            type=int,
+            nargs='+',
+            default=[1, 10, 200],
+            help='Line items per invoice, one run each (default: 1 10 200)',
+        )
+        parser.add_argument(
+            '--duration',
+            type=float,
+            default=3.0,
+            help='Seconds to render for in each run (default: 3)',
+        )
+
+    def handle(self, *args, **options):
+        # Unsaved objects: only rendering is measured, not the database
+        user = User(username='benchmark', first_name='Bench', last_name='Mark', email='bench@example.com')
+        for count in options['items']:
+            order = Order(
+                id=1,
+                user=user,
+                status='delivered',
+                total_price=Decimal('19.98') * count,
+                created_at=timezone.now(),
+            )
+            items = [
+                OrderItem(
+                    order=order,
+                    product=Product(title=f"Benchmark Product {i}"),
+                    quantity=2,
+                    price_at_purchase=Decimal('9.99'),
+                )
+                for i in range(count)
+            ]
+            size = len(generate_invoice_pdf(order, items).getvalue())
+
+            rendered = 0
+            start = time.perf_counter()
+            while True:
+                generate_invoice_pdf(order, items)
+                rendered += 1
+                elapsed = time.perf_counter() - start
+                if elapsed >= options['duration']:
+                    break
+            self.stdout.write(
+                f"{count:>5} items: {rendered / elapsed:8.1f} invoices/s "
+                f"({elapsed / rendered * 1000:.2f} ms each, {size / 1024:.1f} KB)"
+            )
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+
+from app_backend.ledger import compact, reconcile
+
+
+class Command(BaseCommand):
+    help = "Fold stock movements into per-product snapshots, optionally checking stock against the ledger."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Snapshots written per insert (default: 500)',
+        )
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Afterwards, list products whose stock does not match the ledger',
+        )
+
+    def handle(self, *args, **options):
+        written = compact(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Wrote {written} stock snapshots."))
+
+        if options['check']:
+            mismatches = reconcile()
+            for product_id, in_stock, ledger in mismatches:
+                self.stdout.write(self.style.WARNING(
+                    f"Product {product_id}: quantity_in_stock is {in_stock}, the ledger says {ledger}"
+                ))
+            if not mismatches:
+                self.stdout.write("Stock matches the ledger.")
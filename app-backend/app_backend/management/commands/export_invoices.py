@@ -0,0 +1,38 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from app_backend.invoice_export import (
+    export_order_ids, iter_invoices, parse_export_filters, stream_invoice_zip,
+)
+
+
+class Command(BaseCommand):
+    help = "Render the invoices of every matching order into one ZIP archive."
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help='Path of the ZIP file to write')
+        parser.add_argument('--from', dest='from', help='First order date, YYYY-MM-DD')
+        parser.add_argument('--to', dest='to', help='Last order date, YYYY-MM-DD')
+        parser.add_argument('--status', help='Comma separated order statuses')
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=os.cpu_count() or 1,
+            help='Processes rendering invoices (default: CPU count)',
+        )
+
+    def handle(self, *args, **options):
+        try:
+            filters = parse_export_filters(options)
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        order_ids = export_order_ids(filters)
+        with open(options['output'], 'wb') as f:
+            for chunk in stream_invoice_zip(iter_invoices(order_ids, workers=options['workers'])):
+                f.write(chunk)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Exported {len(order_ids)} invoices to {options['output']}."
+        ))
@@ -0,0 +1,69 @@
+import os
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from app_backend.cache import bump_catalog_version
+from app_backend.documents import invalidate_product_documents
+from app_backend.images import generate_image_variants
+from app_backend.models import Product
+
+
+class Command(BaseCommand):
+    help = "Generate the resized WebP derivatives of product images that don't have them yet."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=os.cpu_count() or 1,
+            help='Number of worker processes resizing images (default: CPU count)',
+        )
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='Regenerate every product, not only those with missing or stale variants',
+        )
+
+    def handle(self, *args, **options):
+        # Products sharing a picture are resized once
+        products_by_image = defaultdict(list)
+        for product in Product.objects.only('id', 'image', 'image_variants'):
+            source = product.image.name if product.image else ''
+            if options['all'] or (product.image_variants or {}).get('source') != source:
+                products_by_image[source].append(product)
+
+        if not products_by_image:
+            self.stdout.write("All product images already have variants.")
+            return
+
+        sources = [source for source in products_by_image if source]
+        # Workers only read and write media files; the database is only
+        # touched here, in the parent process.
+        with ProcessPoolExecutor(max_workers=max(1, options['workers'])) as pool:
+            results = dict(zip(sources, pool.map(generate_image_variants, sources)))
+        results[''] = {}
+
+        now = timezone.now()
+        changed = []
+        for source, products in products_by_image.items():
+            for product in products:
+                product.image_variants = {'source': source, 'variants': results[source]}
+                product.updated_at = now
+                changed.append(product)
+
+        with transaction.atomic():
+            Product.objects.bulk_update(changed, ['image_variants', 'updated_at'], batch_size=500)
+            # bulk_update sends no signals
+            invalidate_product_documents([product.pk for product in changed])
+            bump_catalog_version()
+            transaction.on_commit(bump_catalog_version)
+
+        failed = sum(1 for source in sources if not results[source])
+        self.stdout.write(self.style.SUCCESS(
+            f"Generated variants for {len(sources) - failed} images "
+            f"({len(changed)} products, {failed} unreadable)."
+        ))
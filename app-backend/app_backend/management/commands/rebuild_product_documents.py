@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+
+from app_backend.documents import build_product_documents
+from app_backend.models import Product
+
+
+class Command(BaseCommand):
+    help = "Re-render the stored ProductDocument JSON for every product."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=500,
+            help='Number of products to render per batch (default: 500)',
+        )
+
+    def handle(self, *args, **options):
+        chunk_size = max(1, options['chunk_size'])
+        last_id = 0
+        built = 0
+
+        while True:
+            ids = list(
+                Product.objects.filter(id__gt=last_id)
+                .order_by('id')
+                .values_list('id', flat=True)[:chunk_size]
+            )
+            if not ids:
+                break
+            last_id = ids[-1]
+            built += len(build_product_documents(ids))
+
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {built} product documents."))
@@ -0,0 +1,76 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from app_backend.models import Product, Rating, refresh_product_caches
+
+
+class Command(BaseCommand):
+    help = "Recompute the denormalized rating summary columns on Product from the Rating table."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=500,
+            help='Number of products to rebuild per transaction (default: 500)',
+        )
+
+    def handle(self, *args, **options):
+        chunk_size = max(1, options['chunk_size'])
+        last_id = 0
+        rebuilt = 0
+        drifted = 0
+
+        while True:
+            ids = list(
+                Product.objects.filter(id__gt=last_id)
+                .order_by('id')
+                .values_list('id', flat=True)[:chunk_size]
+            )
+            if not ids:
+                break
+            last_id = ids[-1]
+
+            with transaction.atomic():
+                products = Product.objects.select_for_update().filter(id__in=ids).only(
+                    'id', 'updated_at', *Product.RATING_SUMMARY_FIELDS
+                )
+                counts = {}
+                rows = (
+                    Rating.objects.filter(product_id__in=ids)
+                    .values('product_id', 'score')
+                    .annotate(n=Count('id'))
+                )
+                for row in rows:
+                    counts.setdefault(row['product_id'], {})[row['score']] = row['n']
+
+                changed = []
+                for product in products:
+                    histogram = counts.get(product.id, {})
+                    expected = {
+                        f'rating_{score}_count': histogram.get(score, 0)
+                        for score in range(1, 6)
+                    }
+                    expected['rating_count'] = sum(histogram.values())
+                    expected['rating_sum'] = sum(score * n for score, n in histogram.items())
+                    if any(getattr(product, field) != value for field, value in expected.items()):
+                        for field, value in expected.items():
+                            setattr(product, field, value)
+                        product.updated_at = timezone.now()
+                        changed.append(product)
+
+                if changed:
+                    Product.objects.bulk_update(
+                        changed, Product.RATING_SUMMARY_FIELDS + ['updated_at']
+                    )
+                    # bulk_update sends no signals
+                    refresh_product_caches([product.pk for product in changed])
+
+            rebuilt += len(ids)
+            drifted += len(changed)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt rating summary for {rebuilt} products ({drifted} corrected)."
+        ))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from app_backend.search import fts_enabled, rebuild_search_index
+
+
+class Command(BaseCommand):
+    help = "Drop and rebuild the SQLite FTS5 product search index."
+
+    def handle(self, *args, **options):
+        if not fts_enabled():
+            self.stdout.write("Full-text index is only used with SQLite; nothing to do.")
+            return
+        rebuild_search_index()
+        self.stdout.write(self.style.SUCCESS("Rebuilt product search index."))
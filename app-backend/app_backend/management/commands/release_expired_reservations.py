@@ -0,0 +1,45 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from app_backend.reservations import release_expired_holds
+
+
+class Command(BaseCommand):
+    help = "Release expired checkout stock holds in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=None,
+            help='Holds released per transaction (default: RESERVATION_SWEEP_BATCH)',
+        )
+        parser.add_argument(
+            '--poll-interval',
+            type=float,
+            default=30.0,
+            help='Seconds to wait when nothing has expired (default: 30)',
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Exit once nothing has expired instead of polling',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size'] or getattr(settings, 'RESERVATION_SWEEP_BATCH', 500)
+        released = 0
+        try:
+            while True:
+                count = release_expired_holds(batch_size)
+                released += count
+                if count < batch_size:
+                    if options['once']:
+                        break
+                    time.sleep(options['poll_interval'])
+        except KeyboardInterrupt:
+            pass
+
+        self.stdout.write(self.style.SUCCESS(f"Released {released} expired holds."))
@@ -0,0 +1,83 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from app_backend import tasks  # noqa: F401  registers the tasks
+from app_backend.jobs import claim_jobs, release_stale_jobs, run_job, run_job_in_pool
+
+
+class Command(BaseCommand):
+    help = "Run queued background jobs (invoice rendering, emails, ...)."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=4,
+            help='Jobs run in parallel; 1 runs them in this process (default: 4)',
+        )
+        parser.add_argument(
+            '--processes',
+            action='store_true',
+            help='Use a process pool instead of a thread pool, for CPU bound jobs',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=None,
+            help='Jobs claimed at a time (default: 2 per worker)',
+        )
+        parser.add_argument(
+            '--poll-interval',
+            type=float,
+            default=2.0,
+            help='Seconds to wait when the queue is empty (default: 2)',
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Exit once no job is due instead of polling',
+        )
+
+    def handle(self, *args, **options):
+        workers = max(1, options['workers'])
+        batch_size = options['batch_size'] or workers * 2
+        worker_id = f"{os.uname().nodename}:{os.getpid()}"
+
+        pool = None
+        if workers > 1:
+            executor = ProcessPoolExecutor if options['processes'] else ThreadPoolExecutor
+            pool = executor(max_workers=workers)
+
+        succeeded = failed = 0
+        try:
+            while True:
+                release_stale_jobs()
+                jobs = claim_jobs(worker_id, batch_size)
+                if not jobs:
+                    if options['once']:
+                        break
+                    time.sleep(options['poll_interval'])
+                    continue
+
+                if pool is None:
+                    results = [run_job(job) for job in jobs]
+                else:
+                    if options['processes']:
+                        # Forked workers must not share this process's connections
+                        connections.close_all()
+                    results = list(pool.map(run_job_in_pool, [job.pk for job in jobs]))
+                succeeded += results.count(True)
+                failed += results.count(False)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Ran {succeeded + failed} jobs: {succeeded} succeeded, {failed} failed."
+        ))
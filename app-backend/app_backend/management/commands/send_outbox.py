@@ -0,0 +1,48 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from app_backend.outbox import OutboxSender
+
+
+class Command(BaseCommand):
+    help = "Send queued outbox emails in batches over one reused mail connection."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=None,
+            help='Messages claimed at a time (default: OUTBOX_BATCH_SIZE)',
+        )
+        parser.add_argument(
+            '--poll-interval',
+            type=float,
+            default=5.0,
+            help='Seconds to wait when the outbox is empty (default: 5)',
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Exit once nothing is due instead of polling',
+        )
+
+    def handle(self, *args, **options):
+        sender = OutboxSender(batch_size=options['batch_size'])
+        sent = failed = 0
+        try:
+            while True:
+                batch_sent, batch_failed = sender.drain()
+                sent += batch_sent
+                failed += batch_failed
+                if options['once']:
+                    break
+                # Don't hold an idle connection open while waiting for mail
+                sender.close()
+                time.sleep(options['poll_interval'])
+        except KeyboardInterrupt:
+            pass
+        finally:
+            sender.close()
+
+        self.stdout.write(self.style.SUCCESS(f"Sent {sent} emails, {failed} failed."))
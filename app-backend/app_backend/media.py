@@ -0,0 +1,156 @@
+"""
+Serving files from MEDIA_ROOT.
+
+With MEDIA_SERVE_MODE set to 'x-accel-redirect' (nginx) or 'x-sendfile'
+(Apache, lighttpd) the view only decides whether and how a file is served
+and hands the transfer to the front proxy, so no worker copies file bytes.
+In 'direct' mode Django sends the file itself, through FileResponse (which
+lets the WSGI server use sendfile) or, for Range requests, in slices.
+
+Either way responses carry an ETag and Last-Modified taken from the file's
+stat, so unchanged files answer 304 without being opened.
+"""
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+SERVE_MODES = ('direct', 'x-accel-redirect', 'x-sendfile')
+
+# Names that change whenever the content does, e.g. the content-hashed image
+# derivatives written by images.generate_image_variants
+HASHED_NAME_RE = re.compile(r'(^|/)[0-9a-f]{20}-[\w-]+\.\w+$')
+
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+PUBLIC_CACHE_CONTROL = 'public, max-age=3600'
+PRIVATE_CACHE_CONTROL = 'private, no-cache'
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+RANGE_CHUNK_SIZE = 64 * 1024
+
+
+def serve_mode():
+    mode = getattr(settings, 'MEDIA_SERVE_MODE', 'direct')
+    if mode not in SERVE_MODES:
+        raise ValueError(f"MEDIA_SERVE_MODE must be one of: {', '.join(SERVE_MODES)}")
+    return mode
+
+
+def stat_etag(stat):
+    return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+
+def parse_range(header, size):
+    """
+    Return (start, end) inclusive for a single 'bytes=' range, None to send
+    the whole file, or raise ValueError if the range can't be satisfied.
+    Multiple ranges are answered with the whole file.
+    """
+    match = RANGE_RE.match(header.strip())
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            raise ValueError
+        return max(0, size - length), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise ValueError
+    return start, end
+
+
+def _read_range(path, start, length):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(RANGE_CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def serve_file(request, name, cache_control=None, attachment_name=None, content_type=None):
+    """
+    Respond with the file name (relative to MEDIA_ROOT). cache_control
+    defaults to immutable for content-hashed names and a short public max-age
+    otherwise; pass PRIVATE_CACHE_CONTROL for per-user files.
+    """
+    try:
+        path = safe_join(settings.MEDIA_ROOT, name)
+        stat = os.stat(path)
+    except (SuspiciousFileOperation, OSError):
+        raise Http404("File not found")
+    if not os.path.isfile(path):
+        raise Http404("File not found")
+
+    if cache_control is None:
+        cache_control = IMMUTABLE_CACHE_CONTROL if HASHED_NAME_RE.search(name) else PUBLIC_CACHE_CONTROL
+    etag = stat_etag(stat)
+    validators = {
+        'ETag': etag,
+        'Last-Modified': http_date(stat.st_mtime),
+        'Cache-Control': cache_control,
+    }
+
+    def with_validators(response):
+        for header, value in validators.items():
+            response[header] = value
+        return response
+
+    not_modified = get_conditional_response(request, etag=etag, last_modified=int(stat.st_mtime))
+    if not_modified is not None:
+        return with_validators(not_modified)
+
+    if content_type is None:
+        content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+
+    mode = serve_mode()
+    if mode != 'direct':
+        response = HttpResponse(content_type=content_type)
+        if mode == 'x-accel-redirect':
+            prefix = getattr(settings, 'MEDIA_ACCEL_PREFIX', '/protected-media/')
+            response['X-Accel-Redirect'] = prefix.rstrip('/') + '/' + quote(name.replace(os.sep, '/'))
+        else:
+            response['X-Sendfile'] = path
+    else:
+        response = None
+        range_header = request.META.get('HTTP_RANGE')
+        if_range = request.META.get('HTTP_IF_RANGE')
+        # A stale If-Range means the client's partial copy is outdated: send it all
+        if range_header and (not if_range or if_range == etag):
+            try:
+                byte_range = parse_range(range_header, stat.st_size)
+            except ValueError:
+                response = HttpResponse(status=416)
+                response['Content-Range'] = f'bytes */{stat.st_size}'
+                return with_validators(response)
+            if byte_range is not None:
+                start, end = byte_range
+                response = StreamingHttpResponse(
+                    _read_range(path, start, end - start + 1),
+                    status=206,
+                    content_type=content_type,
+                )
+                response['Content-Range'] = f'bytes {start}-{end}/{stat.st_size}'
+                response['Content-Length'] = str(end - start + 1)
+        if response is None:
+            response = FileResponse(open(path, 'rb'), content_type=content_type)
+        response['Accept-Ranges'] = 'bytes'
+
+    if attachment_name:
+        response['Content-Disposition'] = f'attachment; filename="{attachment_name}"'
+    return with_validators(response)
@@ -1,20 +1,123 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Case, F, Q, When
 from django.contrib.auth.models import User
 from django.core.validators import MinValueValidator, MaxValueValidator
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete, pre_delete
 from django.dispatch import receiver
+from django.utils import timezone
 from django.core.exceptions import ValidationError
 from decimal import Decimal
+from .cache import bump_catalog_version
 
 
 
 class Category(models.Model):
     name = models.CharField(max_length=100)
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return self.name
 
 
+class ProductQuerySet(models.QuerySet):
+    def catalog(self, columns=None):
+        """
+        Products with everything ProductSerializer reads joined in, so
+        serializing a page of them is a single query. Pass columns to load
+        only those (see ProductSerializer.columns_for).
+        """
+        if columns is None:
+            return self.select_related('category')
+        columns = ['id', *columns]
+        if 'category' in columns:
+            return self.select_related('category').only(*columns)
+        return self.only(*columns)
+
+    def with_document(self, kind, columns=()):
+        """
+        Load only the pre-rendered ProductDocument body of the given kind
+        ('full' or 'summary') plus any extra product columns.
+        """
+        return self.select_related('document').only('id', *columns, f'document__{kind}')
+
+    def take_stock(self, quantities, held=None):
+        """
+        Subtract {product_id: quantity} from quantity_in_stock in a single
+        UPDATE that only touches products with enough stock left. held is
+        {product_id: quantity} of the buyer's own reservations, which are
+        released by the same UPDATE and count as available to them; everyone
+        else's stay untouched. Returns the number of products updated; fewer
+        than len(quantities) means one ran short and the caller should roll
+        back. Sends no signals, see refresh_product_caches.
+        """
+        if not quantities:
+            return 0
+        held = held or {}
+        enough = Q()
+        for product_id, quantity in quantities.items():
+            enough |= Q(
+                id=product_id,
+                quantity_in_stock__gte=F('reserved_quantity') - held.get(product_id, 0) + quantity,
+            )
+        changes = {
+            'quantity_in_stock': _adjusted(
+                'quantity_in_stock', {product_id: -quantity for product_id, quantity in quantities.items()}
+            ),
+            'updated_at': timezone.now(),
+        }
+        if held:
+            changes['reserved_quantity'] = _adjusted(
+                'reserved_quantity', {product_id: -quantity for product_id, quantity in held.items()}
+            )
+        return self.filter(enough).update(**changes)
+
+    def restock(self, quantities):
+        """
+        Add {product_id: quantity} back to quantity_in_stock in a single
+        UPDATE. The increments happen in the database, so concurrent
+        restocks and sales of the same product can't overwrite each other.
+        Sends no signals, see refresh_product_caches.
+        """
+        if not quantities:
+            return 0
+        return self.filter(id__in=list(quantities)).update(
+            quantity_in_stock=_adjusted('quantity_in_stock', quantities),
+            updated_at=timezone.now(),
+        )
+
+    def reserve(self, quantities):
+        """
+        Add {product_id: quantity} to reserved_quantity in a single UPDATE
+        that only touches products with that much unreserved stock. Returns
+        the number of products updated, like take_stock.
+        """
+        if not quantities:
+            return 0
+        enough = Q()
+        for product_id, quantity in quantities.items():
+            enough |= Q(id=product_id, quantity_in_stock__gte=F('reserved_quantity') + quantity)
+        return self.filter(enough).update(reserved_quantity=_adjusted('reserved_quantity', quantities))
+
+    def release(self, quantities):
+        """Take {product_id: quantity} of released holds off reserved_quantity."""
+        if not quantities:
+            return 0
+        return self.filter(id__in=list(quantities)).update(
+            reserved_quantity=_adjusted(
+                'reserved_quantity', {product_id: -quantity for product_id, quantity in quantities.items()}
+            ),
+        )
+
+
+def _adjusted(column, deltas):
+    """An expression adding deltas[product_id] to column, for use in update()."""
+    return Case(
+        *[When(id=product_id, then=F(column) + delta) for product_id, delta in deltas.items()],
+        default=F(column),
+        output_field=models.PositiveIntegerField(),
+    )
+
+
 class Product(models.Model):
     id = models.AutoField(primary_key=True)
     title = models.CharField(max_length=255)
@@ -22,17 +125,59 @@ class Product(models.Model):
     serial_number = models.CharField(max_length=255, unique=True)
     description = models.TextField()
     quantity_in_stock = models.PositiveIntegerField(default=0)
+    # Sum of the product's StockReservation holds, kept up to date by
+    # ProductQuerySet.reserve/release/take_stock
+    reserved_quantity = models.PositiveIntegerField(default=0)
     price = models.DecimalField(max_digits=10, decimal_places=2)
     cost = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
     warranty_status = models.BooleanField(default=False)
     distributor_info = models.TextField(help_text="Information about the distributor")
     category = models.ForeignKey(Category, on_delete=models.SET_NULL, null=True, blank=True)
     image = models.ImageField(upload_to='', default='1_org_zoom.jpg.webp', blank=True)
-    
+    # Resized WebP derivatives of image, see images.generate_image_variants:
+    # {'source': image name, 'variants': {variant: {'name': ..., 'width': ...}}}
+    image_variants = models.JSONField(default=dict, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    # Rating summary, maintained by the Rating signal handlers below and
+    # rebuilt by the rebuild_rating_summary management command.
+    rating_sum = models.PositiveIntegerField(default=0)
+    rating_count = models.PositiveIntegerField(default=0)
+    rating_1_count = models.PositiveIntegerField(default=0)
+    rating_2_count = models.PositiveIntegerField(default=0)
+    rating_3_count = models.PositiveIntegerField(default=0)
+    rating_4_count = models.PositiveIntegerField(default=0)
+    rating_5_count = models.PositiveIntegerField(default=0)
+
+    RATING_SUMMARY_FIELDS = [
+        'rating_sum', 'rating_count',
+        'rating_1_count', 'rating_2_count', 'rating_3_count',
+        'rating_4_count', 'rating_5_count',
+    ]
+
+    objects = ProductQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Keyset pagination on (sort_key, id), see pagination.KeysetPagination
+            models.Index(fields=['price', 'id'], name='product_price_id_idx'),
+            models.Index(fields=['title', 'id'], name='product_title_id_idx'),
+            # Catalog filters and facet counts, see filters.ProductFilters
+            models.Index(fields=['category', 'price', 'id'], name='product_category_price_idx'),
+            models.Index(fields=['warranty_status', 'quantity_in_stock'], name='product_warranty_stock_idx'),
+            models.Index(fields=['quantity_in_stock', 'price'], name='product_stock_price_idx'),
+        ]
 
     def __str__(self):
         return f"{self.title} ({self.model})"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # The stock level as loaded, see record_stock_adjustment
+        instance._stored_stock = instance.__dict__.get('quantity_in_stock')
+        return instance
+
     def save(self, *args, **kwargs):
         if self.cost is None and self.price is not None:
             self.cost = self.price * Decimal('0.5')
@@ -40,16 +185,30 @@ class Product(models.Model):
 
     @property
     def avg_rating(self):
-        ratings = Rating.objects.filter(product=self)
-        if ratings:
-            total_score = sum(rating.score for rating in ratings)
-            return total_score / ratings.count()
+        if self.rating_count:
+            return self.rating_sum / self.rating_count
         return 0
 
+    @property
+    def total_ratings(self):
+        return self.rating_count
+
+    @property
+    def rating_distribution(self):
+        return {
+            score: getattr(self, f'rating_{score}_count')
+            for score in range(1, 6)
+        }
+
     @property
     def is_available(self):
         return self.quantity_in_stock > 0
 
+    @property
+    def available_quantity(self):
+        """Stock not held by a checkout in progress."""
+        return max(0, self.quantity_in_stock - self.reserved_quantity)
+
 class Order(models.Model):
     STATUS_CHOICES = [
         ('processing', 'Processing'),
@@ -62,8 +221,18 @@ class Order(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='processing')
+    # Set by bulk status transitions, see order_status.transition_orders
+    status_changed_at = models.DateTimeField(null=True, blank=True)
     total_price = models.DecimalField(max_digits=10, decimal_places=2, default=0.0)
     invoice_pdf = models.FileField(upload_to='invoices/', null=True, blank=True)
+    # Content hash invoice_pdf was rendered from, see invoices.ensure_invoice
+    invoice_hash = models.CharField(max_length=64, blank=True)
+
+    class Meta:
+        indexes = [
+            # Order history pages, see pagination.OrderHistoryPagination
+            models.Index(fields=['user', '-created_at', '-id'], name='order_user_history_idx'),
+        ]
 
     def __str__(self):
         return f"Order #{self.pk} by {self.user.username}"
@@ -92,12 +261,54 @@ class Rating(models.Model):
     def __str__(self):
         return f"{self.user.username} rated {self.product.title} {self.score}/5"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember what the product summary currently counts for this row
+        instance._counted = (instance.__dict__.get('product_id'), instance.__dict__.get('score'))
+        return instance
+
+
+def _apply_rating_delta(product_id, score, sign):
+    Product.objects.filter(pk=product_id).update(**{
+        'rating_sum': F('rating_sum') + sign * score,
+        'rating_count': F('rating_count') + sign,
+        f'rating_{score}_count': F(f'rating_{score}_count') + sign,
+        'updated_at': timezone.now(),
+    })
+
+
+def _refresh_cached_product(rating):
+    if Rating.product.is_cached(rating):
+        rating.product.refresh_from_db(fields=Product.RATING_SUMMARY_FIELDS)
+
+
+@receiver(post_save, sender=Rating)
+def update_rating_summary_on_save(sender, instance, created, **kwargs):
+    counted = getattr(instance, '_counted', None)
+    current = (instance.product_id, instance.score)
+    if counted == current:
+        return
+    if counted and counted[0] is not None and counted[1] is not None:
+        _apply_rating_delta(counted[0], counted[1], -1)
+    _apply_rating_delta(instance.product_id, instance.score, 1)
+    instance._counted = current
+    _refresh_cached_product(instance)
+
+
+@receiver(post_delete, sender=Rating)
+def update_rating_summary_on_delete(sender, instance, **kwargs):
+    counted = getattr(instance, '_counted', None) or (instance.product_id, instance.score)
+    _apply_rating_delta(counted[0], counted[1], -1)
+    instance._counted = None
+
 class Comment(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     text = models.TextField()
     approved = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         ordering = ['-created_at']
@@ -105,3 +316,290 @@ class Comment(models.Model):
     def __str__(self):
         return f"{self.user.username} commented on {self.product.title}"
 
+
+class ProductDocument(models.Model):
+    """
+    Pre-rendered ProductSerializer JSON for one product (see documents.py).
+    Rows are dropped as soon as one of their inputs changes and rebuilt
+    after the transaction commits.
+    """
+    product = models.OneToOneField(
+        Product, on_delete=models.CASCADE, primary_key=True, related_name='document'
+    )
+    full = models.BinaryField()
+    summary = models.BinaryField()
+    built_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Document for product #{self.product_id}"
+
+
+class Job(models.Model):
+    """
+    A unit of background work, run by the run_jobs management command.
+    See jobs.py for enqueueing and the task registry.
+    """
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+
+    task = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=3)
+    run_at = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Workers claim the oldest due pending jobs
+            models.Index(fields=['status', 'run_at', 'id'], name='job_status_run_at_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.task} #{self.pk} ({self.status})"
+
+
+class StockReservation(models.Model):
+    """
+    A hold on stock for a checkout in progress, see reservations.py. Holds
+    are turned into sales by create_order, or released when they expire.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='stock_reservations')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='reservations')
+    quantity = models.PositiveIntegerField()
+    expires_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # The sweeper releases the oldest expired holds first
+            models.Index(fields=['expires_at', 'id'], name='reservation_expires_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.quantity} x {self.product_id} for {self.user_id} until {self.expires_at}"
+
+
+class StockMovement(models.Model):
+    """
+    One change to a product's quantity_in_stock. Rows are only ever
+    appended, in the transaction that makes the change; see ledger.py.
+    """
+    REASON_CHOICES = [
+        ('sale', 'Sale'),
+        ('refund', 'Refund'),
+        ('adjustment', 'Adjustment'),
+    ]
+
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='stock_movements')
+    change = models.IntegerField()
+    reason = models.CharField(max_length=20, choices=REASON_CHOICES)
+    order = models.ForeignKey(Order, on_delete=models.SET_NULL, null=True, blank=True, related_name='stock_movements')
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            # Stock as of a date: the movements of one product in a time range
+            models.Index(fields=['product', 'created_at', 'id'], name='movement_product_time_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.change:+d} x {self.product_id} ({self.reason})"
+
+
+class StockSnapshot(models.Model):
+    """
+    A product's stock level as of taken_at: the sum of all its movements up
+    to then. Written by the compact_stock_ledger management command.
+    """
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='stock_snapshots')
+    quantity = models.IntegerField()
+    taken_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['product', 'taken_at'], name='snapshot_product_time_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id}: {self.quantity} as of {self.taken_at}"
+
+
+class IdempotencyKey(models.Model):
+    """
+    A request made with an Idempotency-Key header and, once it has finished,
+    the response to replay to retries of it. See idempotency.py.
+    """
+    key = models.CharField(max_length=255, unique=True)
+    # sha256 of the method, path and body the key was first used with
+    fingerprint = models.CharField(max_length=64)
+    # Empty while the request is in progress
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    response_body = models.TextField(blank=True)
+    locked_until = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['expires_at'], name='idempotency_expires_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.key} ({self.status_code or 'in progress'})"
+
+
+class OutboundEmail(models.Model):
+    """
+    An email waiting in the outbox, sent in batches by the send_outbox
+    management command (see outbox.py). Attachments are referenced by their
+    name in default storage, as {'path', 'filename', 'mimetype'}, plus
+    'invoice_order' for an order's invoice, which is looked up when sending.
+    """
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('sending', 'Sending'),
+        ('sent', 'Sent'),
+        ('dead', 'Dead'),
+    ]
+
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    from_email = models.CharField(max_length=255)
+    to = models.JSONField(default=list)
+    attachments = models.JSONField(default=list, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at', 'id'], name='email_status_next_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.subject} to {', '.join(self.to)} ({self.status})"
+
+
+def _refresh_product_documents(product_ids):
+    from .documents import invalidate_product_documents
+    invalidate_product_documents(product_ids)
+
+
+@receiver(post_save, sender=Product)
+def refresh_document_on_product_save(sender, instance, **kwargs):
+    _refresh_product_documents([instance.pk])
+
+
+@receiver(post_save, sender=Rating)
+@receiver(post_delete, sender=Rating)
+def refresh_document_on_rating_change(sender, instance, **kwargs):
+    _refresh_product_documents([instance.product_id])
+
+
+@receiver(post_save, sender=Category)
+def refresh_documents_on_category_save(sender, instance, **kwargs):
+    _refresh_product_documents(list(instance.product_set.values_list('id', flat=True)))
+
+
+@receiver(pre_delete, sender=Category)
+def remember_category_products(sender, instance, **kwargs):
+    # The products are detached with a plain UPDATE, so collect them first
+    instance._product_ids = list(instance.product_set.values_list('id', flat=True))
+
+
+@receiver(post_delete, sender=Category)
+def refresh_documents_on_category_delete(sender, instance, **kwargs):
+    _refresh_product_documents(getattr(instance, '_product_ids', []))
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=Rating)
+@receiver(post_delete, sender=Rating)
+def invalidate_catalog_cache(sender, **kwargs):
+    # Bump now so this request's own reads miss, and again after commit so a
+    # concurrent reader can't cache pre-commit data under the new version.
+    bump_catalog_version()
+    transaction.on_commit(bump_catalog_version)
+
+
+def refresh_product_caches(product_ids):
+    """
+    What the Product post_save receivers do for the catalog cache and the
+    product documents, for changes made with queryset.update() or
+    bulk_update(), which send no signals. The search index is left alone,
+    so use it for changes to columns that aren't searched.
+    """
+    invalidate_catalog_cache(sender=Product)
+    _refresh_product_documents(product_ids)
+
+
+def _reindex_products(product_ids):
+    from .search import index_products
+    index_products(product_ids)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def update_search_index_on_product_change(sender, instance, **kwargs):
+    _reindex_products([instance.pk])
+
+
+@receiver(post_save, sender=Category)
+def update_search_index_on_category_save(sender, instance, **kwargs):
+    _reindex_products(instance.product_set.values_list('id', flat=True))
+
+
+@receiver(post_delete, sender=Category)
+def update_search_index_on_category_delete(sender, instance, **kwargs):
+    _reindex_products(getattr(instance, '_product_ids', []))
+
+
+@receiver(post_save, sender=Product)
+def record_stock_adjustment(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    """
+    Record stock edited by hand (admin, product manager) in the ledger.
+    Sales and refunds change the stock with update() and record their own
+    movements, see ledger.record_movements.
+    """
+    if raw or (update_fields is not None and 'quantity_in_stock' not in update_fields):
+        return
+    if 'quantity_in_stock' in instance.get_deferred_fields():
+        return
+    stored = 0 if created else getattr(instance, '_stored_stock', None)
+    if stored is None:
+        return
+    change = instance.quantity_in_stock - stored
+    if change:
+        StockMovement.objects.create(product=instance, change=change, reason='adjustment')
+    instance._stored_stock = instance.quantity_in_stock
+
+
+def _schedule_image_variants(product_id):
+    from .images import refresh_image_variants
+    # robust: a failure must not fail the save; generate_image_variants
+    # picks up products whose variants are missing
+    transaction.on_commit(lambda: refresh_image_variants(product_id), robust=True)
+
+
+@receiver(post_save, sender=Product)
+def generate_image_variants_on_image_change(sender, instance, **kwargs):
+    source = instance.image.name if instance.image else ''
+    if (instance.image_variants or {}).get('source', None) != source:
+        _schedule_image_variants(instance.pk)
@@ -0,0 +1,94 @@
+"""
+Order status transitions for the deliveries dashboard.
+
+Orders move processing -> in_transit -> delivered; cancellations and refunds
+have their own endpoints. transition_orders() moves any number of orders
+with one conditional UPDATE, so an order whose status changed in the
+meantime is simply not matched instead of being overwritten.
+
+order_status_changed is sent once per batch, after the transaction commits,
+with the ids of the orders that moved.
+"""
+from django.db import transaction
+from django.dispatch import Signal, receiver
+from django.utils import timezone
+
+from .models import Order
+from .outbox import queue_emails
+
+# status -> statuses an order may move to it from
+TRANSITIONS = {
+    'in_transit': ('processing',),
+    'delivered': ('in_transit',),
+}
+
+# Sent with order_ids (list) and status (the new status)
+order_status_changed = Signal()
+
+
+def transition_orders(order_ids, to_status):
+    """
+    Move order_ids to to_status where the state machine allows it. Returns
+    {order_id: None on success or an error message}. Raises ValueError for
+    a status no order can be moved to.
+    """
+    allowed = TRANSITIONS.get(to_status) if isinstance(to_status, str) else None
+    if allowed is None:
+        raise ValueError(
+            f"Orders can't be moved to '{to_status}'. Choose from: {', '.join(TRANSITIONS)}"
+        )
+    order_ids = list(dict.fromkeys(order_ids))
+    now = timezone.now()
+    with transaction.atomic():
+        Order.objects.filter(id__in=order_ids, status__in=allowed).update(
+            status=to_status, status_changed_at=now,
+        )
+        # The timestamp marks the rows this UPDATE matched, see outbox.claim_batch
+        rows = list(Order.objects.filter(id__in=order_ids).values_list('id', 'status', 'status_changed_at'))
+        current = {order_id: status for order_id, status, _ in rows}
+        moved = {
+            order_id for order_id, status, changed_at in rows
+            if status == to_status and changed_at == now
+        }
+        if moved:
+            moved_ids = sorted(moved)
+            transaction.on_commit(
+                lambda: order_status_changed.send(sender=Order, order_ids=moved_ids, status=to_status),
+                robust=True,
+            )
+
+    labels = dict(Order.STATUS_CHOICES)
+    results = {}
+    for order_id in order_ids:
+        if order_id in moved:
+            results[order_id] = None
+        elif order_id not in current:
+            results[order_id] = 'Order not found'
+        else:
+            results[order_id] = (
+                f"Can't move an order that is {labels[current[order_id]].lower()} "
+                f"to {labels[to_status].lower()}"
+            )
+    return results
+
+
+STATUS_EMAILS = {
+    'in_transit': ('Your order is on its way', 'Your order #{id} has been shipped and is on its way.'),
+    'delivered': ('Your order has been delivered', 'Your order #{id} has been delivered. Enjoy!'),
+}
+
+
+@receiver(order_status_changed)
+def notify_customers_of_status_change(sender, order_ids, status, **kwargs):
+    """Queue one email per moved order, with a single insert."""
+    if status not in STATUS_EMAILS:
+        return
+    subject, body = STATUS_EMAILS[status]
+    recipients = (
+        Order.objects.filter(id__in=order_ids).exclude(user__email='')
+        .values_list('id', 'user__email')
+    )
+    queue_emails([
+        (subject, body.format(id=order_id), [email])
+        for order_id, email in recipients
+    ])
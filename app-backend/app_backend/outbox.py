@@ -0,0 +1,205 @@
+"""
+Email outbox.
+
+Views never talk to the mail server. queue_email() stores the message as an
+OutboundEmail row and the send_outbox management command drains the outbox
+in batches over one connection from Django's get_connection(), opened (and
+authenticated) once and reused for as long as there is mail to send.
+
+A message that fails is retried with exponential backoff; after
+OUTBOX_MAX_ATTEMPTS it is marked dead and left for someone to look at.
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Order, OutboundEmail
+
+logger = logging.getLogger(__name__)
+
+
+class PermanentEmailError(Exception):
+    """The message can never be sent as it is, e.g. an attachment is gone."""
+
+
+def _attachment(path, filename, mimetype, invoice_order=None):
+    attachment = {'path': path, 'filename': filename, 'mimetype': mimetype}
+    if invoice_order is not None:
+        attachment['invoice_order'] = invoice_order
+    return attachment
+
+
+def _outbound_email(subject, body, to, from_email=None, attachments=()):
+    return OutboundEmail(
+        subject=subject,
+        body=body,
+        from_email=from_email or settings.DEFAULT_FROM_EMAIL,
+        to=list(to),
+        attachments=[_attachment(*attachment) for attachment in attachments],
+    )
+
+
+def queue_email(subject, body, to, from_email=None, attachments=()):
+    """
+    Add a message to the outbox. attachments are (storage path, filename,
+    mimetype) tuples; the file is read when the message is sent. A fourth
+    element, an order id, attaches that order's invoice PDF as it is at
+    send time, since a re-rendered invoice replaces the file.
+    """
+    email = _outbound_email(subject, body, to, from_email, attachments)
+    email.save()
+    return email
+
+
+def queue_emails(messages):
+    """Add (subject, body, to) messages to the outbox with a single insert."""
+    return OutboundEmail.objects.bulk_create([
+        _outbound_email(subject, body, to) for subject, body, to in messages
+    ])
+
+
+def retry_delay(attempts):
+    base = getattr(settings, 'OUTBOX_RETRY_DELAY', 60)
+    return timedelta(seconds=base * 2 ** (attempts - 1))
+
+
+def attachment_path(attachment):
+    """Storage path to read attachment from when sending."""
+    order_id = attachment.get('invoice_order')
+    if order_id is not None:
+        current = Order.objects.filter(pk=order_id).values_list('invoice_pdf', flat=True).first()
+        if current:
+            return current
+    return attachment['path']
+
+
+def build_message(email, connection):
+    message = EmailMessage(
+        subject=email.subject,
+        body=email.body,
+        from_email=email.from_email,
+        to=email.to,
+        connection=connection,
+    )
+    for attachment in email.attachments:
+        path = attachment_path(attachment)
+        try:
+            with default_storage.open(path, 'rb') as f:
+                content = f.read()
+        except OSError:
+            if 'invoice_order' in attachment:
+                # Replaced by a render that finished after the lookup; the
+                # retry picks up the new file
+                raise
+            raise PermanentEmailError(f"Attachment {path} is missing")
+        message.attach(attachment['filename'], content, attachment['mimetype'])
+    return message
+
+
+def claim_batch(limit):
+    """Mark up to limit due pending messages as sending and return them."""
+    now = timezone.now()
+    timeout = getattr(settings, 'OUTBOX_LOCK_TIMEOUT', 600)
+    # Messages a crashed sender left behind go back in the queue
+    OutboundEmail.objects.filter(
+        status='sending', locked_at__lt=now - timedelta(seconds=timeout)
+    ).update(status='pending', locked_at=None)
+    with transaction.atomic():
+        ids = list(
+            OutboundEmail.objects.select_for_update(skip_locked=True)
+            .filter(status='pending', next_attempt_at__lte=now)
+            .order_by('next_attempt_at', 'id')
+            .values_list('id', flat=True)[:limit]
+        )
+        if not ids:
+            return []
+        OutboundEmail.objects.filter(id__in=ids, status='pending').update(
+            status='sending', locked_at=now,
+        )
+    return list(
+        OutboundEmail.objects.filter(id__in=ids, status='sending', locked_at=now)
+        .order_by('next_attempt_at', 'id')
+    )
+
+
+def _record_failure(email, error, permanent=False):
+    email.attempts += 1
+    email.last_error = f"{type(error).__name__}: {error}"
+    email.locked_at = None
+    max_attempts = getattr(settings, 'OUTBOX_MAX_ATTEMPTS', 5)
+    if permanent or email.attempts >= max_attempts:
+        logger.error("Giving up on email %s: %s", email.pk, email.last_error)
+        email.status = 'dead'
+    else:
+        email.status = 'pending'
+        email.next_attempt_at = timezone.now() + retry_delay(email.attempts)
+    email.save(update_fields=['attempts', 'last_error', 'locked_at', 'status', 'next_attempt_at'])
+
+
+class OutboxSender:
+    """
+    Sends outbox batches over a single mail connection that stays open
+    between batches. Call close() when done.
+    """
+    def __init__(self, batch_size=None):
+        self.batch_size = batch_size or getattr(settings, 'OUTBOX_BATCH_SIZE', 50)
+        self.connection = None
+
+    def _connect(self):
+        if self.connection is None:
+            self.connection = get_connection(fail_silently=False)
+            self.connection.open()
+        return self.connection
+
+    def close(self):
+        if self.connection is not None:
+            try:
+                self.connection.close()
+            except Exception:
+                logger.warning("Error closing mail connection", exc_info=True)
+            self.connection = None
+
+    def send_batch(self):
+        """Send one batch. Returns (sent, failed); (0, 0) means the outbox is empty."""
+        batch = claim_batch(self.batch_size)
+        sent = failed = 0
+        for index, email in enumerate(batch):
+            try:
+                connection = self._connect()
+            except Exception as e:
+                # The server is unreachable: nothing else in the batch can go out
+                for unsent in batch[index:]:
+                    _record_failure(unsent, e)
+                return sent, failed + len(batch) - index
+            try:
+                build_message(email, connection).send()
+            except PermanentEmailError as e:
+                _record_failure(email, e, permanent=True)
+                failed += 1
+            except Exception as e:
+                _record_failure(email, e)
+                failed += 1
+                # The connection may be broken; start a fresh one for the next message
+                self.close()
+            else:
+                email.status = 'sent'
+                email.sent_at = timezone.now()
+                email.locked_at = None
+                email.save(update_fields=['status', 'sent_at', 'locked_at'])
+                sent += 1
+        return sent, failed
+
+    def drain(self):
+        """Send batches until nothing is due. Returns (sent, failed)."""
+        sent = failed = 0
+        while True:
+            batch_sent, batch_failed = self.send_batch()
+            if not batch_sent and not batch_failed:
+                return sent, failed
+            sent += batch_sent
+            failed += batch_failed
@@ -0,0 +1,184 @@
+import base64
+import json
+import math
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.utils.urls import replace_query_param
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+class KeysetPagination:
+    """
+    Cursor pagination on (sort_key, id) for the product catalog.
+
+    Each page is a single indexed range scan, so deep pages cost the same as
+    the first one. The cursor is an opaque token that encodes the sort and the
+    last row of the previous page; it is returned in the X-Next-Cursor and
+    Link response headers so the body stays a plain list.
+    """
+    # sort name -> (field, descending)
+    SORTS = {
+        'id': ('id', False),
+        'price': ('price', False),
+        '-price': ('price', True),
+        'title': ('title', False),
+        '-title': ('title', True),
+        'newest': ('id', True),
+    }
+    default_sort = 'id'
+    cursor_param = 'cursor'
+    page_size_param = 'page_size'
+    page_size_setting = 'PRODUCT_PAGE_SIZE'
+    max_page_size_setting = 'PRODUCT_MAX_PAGE_SIZE'
+
+    def __init__(self, request):
+        self.request = request
+        self.sort = request.query_params.get('sort') or self.default_sort
+        if self.sort not in self.SORTS:
+            raise InvalidCursor(
+                f"Invalid sort '{self.sort}'. Choose one of: {', '.join(self.SORTS)}"
+            )
+        self.page_size = self.get_page_size()
+        self.next_cursor = None
+
+    @property
+    def sort_field(self):
+        return self.SORTS[self.sort][0]
+
+    def get_page_size(self):
+        default = getattr(settings, self.page_size_setting, 50)
+        maximum = getattr(settings, self.max_page_size_setting, 200)
+        try:
+            size = int(self.request.query_params.get(self.page_size_param, default))
+        except (TypeError, ValueError):
+            size = default
+        return max(1, min(size, maximum))
+
+    def encode_cursor(self, key, pk):
+        payload = json.dumps({'s': self.sort, 'k': key, 'i': pk}, separators=(',', ':'))
+        return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, token):
+        try:
+            padded = token + '=' * (-len(token) % 4)
+            payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+            sort, key, pk = payload['s'], payload['k'], int(payload['i'])
+        except (ValueError, KeyError, TypeError):
+            raise InvalidCursor('Invalid cursor')
+        # Larger ids overflow the database's integer columns
+        if not 0 <= pk < 2 ** 63:
+            raise InvalidCursor('Invalid cursor')
+        if sort != self.sort:
+            raise InvalidCursor('Cursor does not match the requested sort')
+        return key, pk
+
+    def parse_key(self, model, field, key):
+        """Convert a decoded sort key to field's type, rejecting tampered keys."""
+        if not isinstance(key, (int, str)):
+            raise InvalidCursor('Invalid cursor')
+        try:
+            return model._meta.get_field(field).to_python(key)
+        except (ValidationError, TypeError, ValueError):
+            raise InvalidCursor('Invalid cursor')
+
+    def paginate_queryset(self, queryset):
+        field, descending = self.SORTS[self.sort]
+        if field == 'id':
+            ordering = ['-id' if descending else 'id']
+        else:
+            ordering = [f'-{field}', '-id'] if descending else [field, 'id']
+        queryset = queryset.order_by(*ordering)
+
+        token = self.request.query_params.get(self.cursor_param)
+        if token:
+            key, pk = self.decode_cursor(token)
+            op = 'lt' if descending else 'gt'
+            if field == 'id':
+                queryset = queryset.filter(**{f'id__{op}': pk})
+            else:
+                key = self.parse_key(queryset.model, field, key)
+                queryset = queryset.filter(
+                    Q(**{f'{field}__{op}': key}) | Q(**{field: key, f'id__{op}': pk})
+                )
+
+        rows = list(queryset[:self.page_size + 1])
+        if len(rows) > self.page_size:
+            rows = rows[:self.page_size]
+            last = rows[-1]
+            key = getattr(last, field)
+            self.next_cursor = self.encode_cursor(
+                key if isinstance(key, (int, str)) else str(key), last.pk
+            )
+        return rows
+
+    def get_next_link(self):
+        if not self.next_cursor:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_param, self.next_cursor)
+
+    def add_headers(self, response):
+        if self.next_cursor:
+            response['X-Next-Cursor'] = self.next_cursor
+            response['Link'] = f'<{self.get_next_link()}>; rel="next"'
+        return response
+
+
+class SearchPagination(KeysetPagination):
+    """
+    Keyset pagination on (bm25 score, id) for full-text search results.
+    Results are always ordered by relevance.
+    """
+    SORTS = {'relevance': ('score', False)}
+    default_sort = 'relevance'
+
+    def __init__(self, request):
+        self.request = request
+        self.sort = self.default_sort
+        self.page_size = self.get_page_size()
+        self.next_cursor = None
+
+    def paginate_search(self, search):
+        """
+        search(after, limit) returns (product_id, score) pairs ordered by
+        (score, id). Returns the product ids of the requested page.
+        """
+        after = None
+        token = self.request.query_params.get(self.cursor_param)
+        if token:
+            score, pk = self.decode_cursor(token)
+            try:
+                after = (float(score), pk)
+            except (TypeError, ValueError):
+                raise InvalidCursor('Invalid cursor')
+            if not math.isfinite(after[0]):
+                raise InvalidCursor('Invalid cursor')
+
+        rows = search(after=after, limit=self.page_size + 1)
+        if len(rows) > self.page_size:
+            rows = rows[:self.page_size]
+            pk, score = rows[-1]
+            self.next_cursor = self.encode_cursor(score, pk)
+        return [pk for pk, _ in rows]
+
+
+class OrderHistoryPagination(KeysetPagination):
+    """
+    Keyset pagination on (created_at, id) for a customer's orders, newest
+    first.
+    """
+    SORTS = {'newest': ('created_at', True)}
+    default_sort = 'newest'
+    page_size_setting = 'ORDER_HISTORY_PAGE_SIZE'
+    max_page_size_setting = 'ORDER_HISTORY_MAX_PAGE_SIZE'
+
+    def __init__(self, request):
+        self.request = request
+        self.sort = self.default_sort
+        self.page_size = self.get_page_size()
+        self.next_cursor = None
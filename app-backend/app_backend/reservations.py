@@ -0,0 +1,132 @@
+"""
+Time-limited stock reservations.
+
+When a cart enters checkout, hold_stock() puts a hold on every line for
+RESERVATION_TTL seconds. Holds are StockReservation rows; the sum of a
+product's holds is kept in Product.reserved_quantity, updated in the same
+transaction as the rows, so available stock is quantity_in_stock -
+reserved_quantity without summing anything on read.
+
+create_order turns the buyer's holds into the sale with claim_holds(): what
+they hold is theirs even if the product has since sold out to everyone
+else. Holds nobody converts are released in batches by the
+release_expired_reservations management command.
+"""
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Product, StockReservation
+
+
+class InsufficientStock(Exception):
+    """Not enough unreserved stock to hold what was asked for."""
+
+
+def reservation_ttl():
+    return timedelta(seconds=getattr(settings, 'RESERVATION_TTL', 600))
+
+
+class _Contended(Exception):
+    pass
+
+
+def _delete(rows):
+    """
+    Delete (id, product_id, quantity) hold rows and return the ones this
+    call deleted. A concurrent release (the expiry sweep racing a checkout,
+    say) may have deleted some of them since they were read, and only the
+    caller that deleted a hold may give its stock back.
+    """
+    ids = [row[0] for row in rows]
+    try:
+        # One DELETE when nobody else got to any of them, the usual case
+        with transaction.atomic():
+            if StockReservation.objects.filter(id__in=ids).delete()[0] != len(ids):
+                raise _Contended
+        return rows
+    except _Contended:
+        return [row for row in rows if StockReservation.objects.filter(id=row[0]).delete()[0]]
+
+
+def _totals(rows):
+    totals = Counter()
+    for _, product_id, quantity in rows:
+        totals[product_id] += quantity
+    return dict(totals)
+
+
+def _release(rows):
+    """Delete (id, product_id, quantity) hold rows and give their stock back."""
+    if not rows:
+        return 0
+    deleted = _delete(rows)
+    Product.objects.release(_totals(deleted))
+    return len(deleted)
+
+
+def release_user_holds(user, product_ids=None):
+    """Release user's holds, or only those on product_ids. Returns how many."""
+    with transaction.atomic():
+        holds = StockReservation.objects.select_for_update().filter(user=user)
+        if product_ids is not None:
+            holds = holds.filter(product_id__in=product_ids)
+        return _release(list(holds.values_list('id', 'product_id', 'quantity')))
+
+
+def hold_stock(user, quantities):
+    """
+    Replace user's holds with holds on {product_id: quantity}, all or
+    nothing. Returns when they expire. Raises InsufficientStock naming the
+    products that don't have enough unreserved stock.
+    """
+    expires_at = timezone.now() + reservation_ttl()
+    with transaction.atomic():
+        release_user_holds(user)
+        if Product.objects.reserve(quantities) != len(quantities):
+            short = [
+                f"{product['title']} (available: {max(0, product['quantity_in_stock'] - product['reserved_quantity'])})"
+                for product in Product.objects.filter(id__in=list(quantities))
+                .values('id', 'title', 'quantity_in_stock', 'reserved_quantity')
+                # reserve() changed nothing, so the shortfall is still visible
+                if product['quantity_in_stock'] - product['reserved_quantity'] < quantities[product['id']]
+            ]
+            transaction.set_rollback(True)
+            raise InsufficientStock(f"Not enough stock to reserve: {', '.join(short) or 'unknown product'}")
+        StockReservation.objects.bulk_create([
+            StockReservation(user=user, product_id=product_id, quantity=quantity, expires_at=expires_at)
+            for product_id, quantity in quantities.items()
+        ])
+    return expires_at
+
+
+def claim_holds(user, product_ids):
+    """
+    Remove user's holds on product_ids and return them as {product_id:
+    quantity}, for take_stock(quantities, held=...) to release in the same
+    UPDATE that takes the stock. Call it inside the order's transaction.
+    Holds that expired but haven't been swept yet still count.
+    """
+    holds = list(
+        StockReservation.objects.select_for_update()
+        .filter(user=user, product_id__in=product_ids)
+        .values_list('id', 'product_id', 'quantity')
+    )
+    if not holds:
+        return {}
+    return _totals(_delete(holds))
+
+
+def release_expired_holds(limit):
+    """Release up to limit expired holds, oldest first. Returns how many."""
+    with transaction.atomic():
+        expired = list(
+            StockReservation.objects.select_for_update(skip_locked=True)
+            .filter(expires_at__lte=timezone.now())
+            .order_by('expires_at', 'id')
+            .values_list('id', 'product_id', 'quantity')[:limit]
+        )
+        return _release(expired)
@@ -0,0 +1,151 @@
+"""
+Full-text product search.
+
+On SQLite the catalog is indexed in an FTS5 virtual table (title, model,
+description and category name) that is kept in sync by the Product and
+Category signal receivers in models.py and ranked with bm25. Other database
+backends fall back to a case-insensitive substring match.
+"""
+import re
+
+from django.db import connection
+from django.db.models import Q
+
+from .models import Category, Product
+
+SEARCH_TABLE = 'app_backend_product_search'
+
+# bm25 column weights: title, model, description, category
+BM25_WEIGHTS = (10.0, 5.0, 1.0, 3.0)
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def fts_enabled():
+    return connection.vendor == 'sqlite'
+
+
+def _index_exists(cursor):
+    cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [SEARCH_TABLE]
+    )
+    return cursor.fetchone() is not None
+
+
+def _insert_sql(where=''):
+    return (
+        f"INSERT INTO {SEARCH_TABLE} (rowid, title, model, description, category) "
+        f"SELECT p.id, p.title, p.model, p.description, COALESCE(c.name, '') "
+        f"FROM {Product._meta.db_table} p "
+        f"LEFT JOIN {Category._meta.db_table} c ON c.id = p.category_id {where}"
+    )
+
+
+def ensure_search_index(cursor):
+    """Create and fill the FTS5 table the first time it is needed."""
+    if _index_exists(cursor):
+        return
+    cursor.execute(
+        f"CREATE VIRTUAL TABLE {SEARCH_TABLE} USING fts5("
+        f"title, model, description, category, "
+        f"tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+    )
+    cursor.execute(_insert_sql())
+
+
+def rebuild_search_index():
+    if not fts_enabled():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"DROP TABLE IF EXISTS {SEARCH_TABLE}")
+        ensure_search_index(cursor)
+
+
+def index_products(product_ids):
+    """Re-index the given products; ids that no longer exist are removed."""
+    product_ids = sorted({int(pk) for pk in product_ids if pk is not None})
+    if not product_ids or not fts_enabled():
+        return
+    placeholders = ', '.join(['%s'] * len(product_ids))
+    with connection.cursor() as cursor:
+        if not _index_exists(cursor):
+            # Built from the current table contents, which include this change
+            ensure_search_index(cursor)
+            return
+        cursor.execute(
+            f"DELETE FROM {SEARCH_TABLE} WHERE rowid IN ({placeholders})", product_ids
+        )
+        cursor.execute(_insert_sql(f"WHERE p.id IN ({placeholders})"), product_ids)
+
+
+def match_expression(query):
+    """
+    Turn free text into an FTS5 query: every word must match, as a prefix.
+    Words are quoted so FTS5 operators in user input are treated as text.
+    """
+    tokens = TOKEN_RE.findall(query)
+    return ' '.join(f'"{token}"*' for token in tokens)
+
+
+def search_product_ids(query, after=None, limit=20, products=None):
+    """
+    Return up to limit (product_id, score) pairs for query, best match first.
+    after is the (score, product_id) of the last row of the previous page.
+    products, a Product queryset, restricts the results to its rows.
+    """
+    if not fts_enabled():
+        return _search_products_fallback(query, after, limit, products)
+    if products is None:
+        return _ranked_matches(query, after, limit)
+
+    # Walk the ranking a batch at a time and keep the rows products allows,
+    # until the page is full or the matches run out
+    rows = []
+    while len(rows) < limit:
+        batch = _ranked_matches(query, after, limit)
+        allowed = set(products.filter(id__in=[pk for pk, _ in batch]).values_list('id', flat=True))
+        rows += [row for row in batch if row[0] in allowed]
+        if len(batch) < limit:
+            break
+        pk, score = batch[-1]
+        after = (score, pk)
+    return rows[:limit]
+
+
+def _ranked_matches(query, after, limit):
+
+    expression = match_expression(query)
+    if not expression:
+        return []
+    weights = ', '.join(str(w) for w in BM25_WEIGHTS)
+    sql = (
+        f"SELECT id, score FROM ("
+        f"SELECT rowid AS id, bm25({SEARCH_TABLE}, {weights}) AS score "
+        f"FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s)"
+    )
+    params = [expression]
+    if after is not None:
+        sql += " WHERE score > %s OR (score = %s AND id > %s)"
+        params += [after[0], after[0], after[1]]
+    sql += " ORDER BY score, id LIMIT %s"
+    params.append(limit)
+
+    with connection.cursor() as cursor:
+        ensure_search_index(cursor)
+        cursor.execute(sql, params)
+        return [(row[0], row[1]) for row in cursor.fetchall()]
+
+
+def _search_products_fallback(query, after, limit, products=None):
+    products = Product.objects.all() if products is None else products
+    for token in TOKEN_RE.findall(query):
+        products = products.filter(
+            Q(title__icontains=token)
+            | Q(model__icontains=token)
+            | Q(description__icontains=token)
+            | Q(category__name__icontains=token)
+        )
+    if after is not None:
+        products = products.filter(id__gt=after[1])
+    ids = products.order_by('id').values_list('id', flat=True)[:limit]
+    return [(pk, 0.0) for pk in ids]
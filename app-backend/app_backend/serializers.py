@@ -5,6 +5,9 @@ from .models import (
     Rating, Comment,   )
 from django.contrib.auth.models import User
 from decimal import Decimal
+from urllib.parse import urlencode, urljoin
+from django.urls import reverse
+from .images import variant_urls
 
 
 
@@ -47,16 +50,40 @@ class UserUpdateSerializer(serializers.ModelSerializer):
 
 
 class ProductSerializer(serializers.ModelSerializer):
+    """
+    Pass fields=[...] to render only a subset of the fields. SUMMARY_FIELDS
+    is the compact representation used by default on list endpoints.
+    """
+    SUMMARY_FIELDS = [
+        'id', 'title', 'price', 'stock', 'is_available', 'category',
+        'rating', 'total_ratings', 'image_url', 'images',
+    ]
+
+    # Model columns each serializer field reads, used to narrow the query
+    # with .only() when a subset of fields is requested.
+    FIELD_COLUMNS = {
+        'stock': ['quantity_in_stock'],
+        'is_available': ['quantity_in_stock'],
+        'category': ['category', 'category__name'],
+        'category_id': [],
+        'rating': ['rating_sum', 'rating_count'],
+        'total_ratings': ['rating_count'],
+        'rating_distribution': [
+            'rating_1_count', 'rating_2_count', 'rating_3_count',
+            'rating_4_count', 'rating_5_count',
+        ],
+        'image_url': ['image'],
+        'images': ['image', 'image_variants'],
+    }
+
     category = CategorySerializer(read_only=True)
     is_available = serializers.BooleanField(read_only=True)
     stock = serializers.IntegerField(source='quantity_in_stock', read_only=True)
     rating = serializers.FloatField(source='avg_rating', read_only=True)
-    total_ratings = serializers.SerializerMethodField(read_only=True)
+    total_ratings = serializers.IntegerField(read_only=True)
+    rating_distribution = serializers.DictField(child=serializers.IntegerField(), read_only=True)
     image_url = serializers.SerializerMethodField(read_only=True)
     
-    def get_total_ratings(self, obj):
-        return Rating.objects.filter(product=obj).count()
-    
     def get_image_url(self, obj):
         if obj.image:
             request = self.context.get('request')
@@ -64,6 +91,19 @@ class ProductSerializer(serializers.ModelSerializer):
                 return request.build_absolute_uri(obj.image.url)
             return obj.image.url
         return None
+
+    images = serializers.SerializerMethodField(read_only=True)
+
+    def get_images(self, obj):
+        """Resized WebP copies of the image as {variant: {url, width}}, smallest first."""
+        request = self.context.get('request')
+        images = {}
+        for variant, (url, width) in variant_urls(obj).items():
+            images[variant] = {
+                'url': request.build_absolute_uri(url) if request else url,
+                'width': width,
+            }
+        return images or None
     
     category_id = serializers.PrimaryKeyRelatedField(
         queryset=Category.objects.all(),
@@ -84,8 +124,43 @@ class ProductSerializer(serializers.ModelSerializer):
             'id', 'title', 'model', 'serial_number', 'description',
             'quantity_in_stock', 'stock', 'price', 'cost', 'warranty_status',
             'distributor_info', 'category', 'category_id',
-            'is_available', 'rating', 'total_ratings', 'image', 'image_url'
+            'is_available', 'rating', 'total_ratings', 'rating_distribution',
+            'image', 'image_url', 'images'
         ]
+
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+    @classmethod
+    def parse_fields(cls, value, default=None):
+        """
+        Turn a ?fields= query value into a list of serializer fields.
+        'all' selects the full representation; an empty value gives default.
+        Raises ValueError on unknown field names.
+        """
+        if not value:
+            return default
+        if value == 'all':
+            return None
+        fields = [name.strip() for name in value.split(',') if name.strip()]
+        unknown = [name for name in fields if name not in cls.Meta.fields]
+        if unknown:
+            raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+        if 'id' not in fields:
+            fields.insert(0, 'id')
+        return fields
+
+    @classmethod
+    def columns_for(cls, fields):
+        columns = []
+        for name in fields:
+            for column in cls.FIELD_COLUMNS.get(name, [name]):
+                if column not in columns:
+                    columns.append(column)
+        return columns
     
     def create(self, validated_data):
         # Calculate cost field if price is provided and cost is not
@@ -106,15 +181,95 @@ class OrderItemSerializer(serializers.ModelSerializer):
         fields = ['id', 'product', 'quantity', 'price_at_purchase']
 
 
+class InvoiceLinkField(serializers.Field):
+    """
+    Where the order's invoice downloads from, None until one is generated.
+    Invoice files aren't served from media, so this is download_invoice.
+    """
+    def __init__(self, **kwargs):
+        kwargs.update(source='*', read_only=True)
+        super().__init__(**kwargs)
+
+    def to_representation(self, order):
+        if not order.invoice_pdf:
+            return None
+        url = '%s?%s' % (
+            reverse('api_download_invoice', args=[order.pk]),
+            urlencode({'user': order.user_id}),
+        )
+        request = self.context.get('request')
+        if request is None:
+            return url
+        base = self.context.setdefault('absolute_base', request.build_absolute_uri('/'))
+        return urljoin(base, url)
+
+
 class OrderSerializer(serializers.ModelSerializer):
     items = OrderItemSerializer(many=True, read_only=True)
     status = serializers.CharField(read_only=True)
-    invoice_pdf = serializers.FileField(read_only=True)
+    invoice_pdf = InvoiceLinkField()
+
+    class Meta:
+        model = Order
+        fields = ['id', 'created_at', 'status', 'total_price', 'items', 'invoice_pdf']
+
+
+class ProductSnapshotSerializer(serializers.ModelSerializer):
+    """
+    The product as an order line shows it. Reads only COLUMNS of the product
+    row: no ratings, stock or category.
+    """
+    COLUMNS = ['id', 'title', 'image', 'image_variants']
+
+    image = serializers.SerializerMethodField(read_only=True)
+
+    class Meta:
+        model = Product
+        fields = ['id', 'title', 'image']
+
+    def get_image(self, obj):
+        """The thumbnail if it has been generated, otherwise the original image."""
+        variants = variant_urls(obj)
+        if 'thumbnail' in variants:
+            url = variants['thumbnail'][0]
+        elif obj.image:
+            url = obj.image.url
+        else:
+            return None
+        request = self.context.get('request')
+        if request is None:
+            return url
+        # Resolving the host once per response, not once per line item
+        base = self.context.setdefault('absolute_base', request.build_absolute_uri('/'))
+        return urljoin(base, url)
+
+
+class OrderLineSerializer(serializers.ModelSerializer):
+    product = ProductSnapshotSerializer(read_only=True)
+
+    class Meta:
+        model = OrderItem
+        fields = ['id', 'product', 'quantity', 'price_at_purchase']
+
+
+class OrderHistorySerializer(serializers.ModelSerializer):
+    """
+    Orders for the history list. Line items, with a product snapshot, are
+    only rendered with include_items=True.
+    """
+    items = OrderLineSerializer(many=True, read_only=True)
+    status = serializers.CharField(read_only=True)
+    invoice_pdf = InvoiceLinkField()
 
     class Meta:
         model = Order
         fields = ['id', 'created_at', 'status', 'total_price', 'items', 'invoice_pdf']
 
+    def __init__(self, *args, include_items=False, **kwargs):
+        super().__init__(*args, **kwargs)
+        if not include_items:
+            self.fields.pop('items')
+
 
 class RatingSerializer(serializers.ModelSerializer):
     user_details = UserSerializer(source='user', read_only=True)
@@ -0,0 +1,61 @@
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from rest_framework.renderers import JSONRenderer
+
+
+def wants_stream(request):
+    return request.query_params.get('stream', '').lower() in ('1', 'true', 'yes')
+
+
+def stream_chunk_size():
+    return getattr(settings, 'STREAM_CHUNK_SIZE', 500)
+
+
+def serializer_chunk_renderer(serializer_class, **kwargs):
+    """render_chunk for stream_json_array that runs serializer_class over each chunk."""
+    renderer = JSONRenderer()
+
+    def render_chunk(objects):
+        return renderer.render(serializer_class(objects, many=True, **kwargs).data)
+
+    return render_chunk
+
+
+def stream_json_array(queryset, render_chunk, chunk_size=None):
+    """
+    Yield the JSON array of every row in queryset without holding them all.
+
+    Rows are read with .iterator() and handed to render_chunk(list) in
+    batches of chunk_size; render_chunk returns the JSON array for that batch.
+    """
+    chunk_size = chunk_size or stream_chunk_size()
+    yield b'['
+    first = True
+    batch = []
+
+    def flush():
+        body = render_chunk(batch)[1:-1]
+        if not body:
+            return b''
+        return body if first else b',' + body
+
+    for obj in queryset.iterator(chunk_size=chunk_size):
+        batch.append(obj)
+        if len(batch) >= chunk_size:
+            part = flush()
+            if part:
+                first = False
+                yield part
+            batch = []
+    if batch:
+        part = flush()
+        if part:
+            yield part
+    yield b']'
+
+
+def streaming_json_response(queryset, render_chunk, chunk_size=None):
+    return StreamingHttpResponse(
+        stream_json_array(queryset, render_chunk, chunk_size),
+        content_type='application/json',
+    )
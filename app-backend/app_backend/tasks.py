@@ -0,0 +1,30 @@
+"""
+Background tasks, run by the run_jobs management command (see jobs.py).
+"""
+from .invoices import ensure_invoice, send_invoice_email
+from .jobs import PermanentJobError, enqueue, task
+from .models import Order
+
+
+def _get_order(order_id):
+    try:
+        return Order.objects.select_related('user').get(pk=order_id)
+    except Order.DoesNotExist:
+        raise PermanentJobError(f"Order {order_id} no longer exists")
+
+
+@task('invoices.generate')
+def generate_invoice(order_id):
+    """Render the order's invoice PDF, store it and queue it for emailing."""
+    order = _get_order(order_id)
+    # Shares the stored PDF with download_invoice
+    ensure_invoice(order)
+    send_invoice_email(order)
+
+
+def enqueue_invoice(order):
+    """
+    Queue rendering and emailing order's invoice. Call it inside the
+    transaction that creates the order: workers see the job once it commits.
+    """
+    return enqueue('invoices.generate', {'order_id': order.id})
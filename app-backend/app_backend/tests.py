@@ -1,7 +1,19 @@
-from django.test import TestCase, Client
+from django.test import TestCase, TransactionTestCase, Client, override_settings
 from django.urls import reverse
 from django.contrib.auth.models import User
-from .models import Product, Category, Order, OrderItem, Rating, Comment
+from .models import (
+    Product, Category, Order, OrderItem, Rating, Comment, ProductDocument, ProductQuerySet, Job,
+    OutboundEmail, StockReservation, StockMovement, StockSnapshot, IdempotencyKey, refresh_product_caches,
+)
+from .outbox import queue_email
+from .invoices import InvoiceTemplate, ensure_invoice, generate_invoice_pdf, send_invoice_email
+from .order_status import order_status_changed
+from .ledger import compact, reconcile, stock_as_of
+from . import reservations
+from .cache import LockTimeout, single_flight
+from .jobs import TASKS, enqueue
+from .tasks import enqueue_invoice
+from .filters import ProductFilters
 from .serializers import (
     CategorySerializer,
     ProductSerializer,
@@ -14,8 +26,32 @@ from .serializers import (
     UserUpdateSerializer
 )
 from decimal import Decimal
-from rest_framework.test import APITestCase
+from rest_framework.test import APIClient, APITestCase
 from rest_framework import status
+from django.core.management import call_command
+from django.core.cache import cache
+from django.core import mail
+from django.core.mail.backends import locmem
+from django.utils import timezone
+from datetime import datetime, timedelta
+from django.db import connection
+from django.db.models import Sum
+from django.test.utils import CaptureQueriesContext
+from io import BytesIO, StringIO
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from PIL import Image
+import base64
+import os
+import re
+import shutil
+import smtplib
+import threading
+import time
+import zipfile
+import tempfile
+from unittest import mock
 import json
 # python manage.py test app_backend.tests.SerializerTest
 # python manage.py test app_backend.tests
@@ -196,6 +232,2064 @@ class ProductAPITest(APITestCase):
         self.assertEqual(len(response.data), 1)
         self.assertEqual(response.data[0]['category']['id'], self.category.id)
 
+class ProductRatingSummaryTest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='testuser',
+            password='testpass123'
+        )
+        self.category = Category.objects.create(name="Test Category")
+        for i in range(5):
+            product = Product.objects.create(
+                title=f"Product {i}",
+                model="Test Model",
+                serial_number=f"SUMMARY{i}",
+                description="Test Description",
+                quantity_in_stock=10,
+                price=Decimal('10.00'),
+                category=self.category
+            )
+            Rating.objects.create(user=self.user, product=product, score=4)
+
+    def test_product_list_query_count(self):
+        """Test the product list does not query ratings once per product"""
+        self.client.get('/api/products/all/')
+        cache.clear()
+        # Two aggregate queries for the ETag/Last-Modified validators, one for the page
+        with self.assertNumQueries(3):
+            response = self.client.get('/api/products/all/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 5)
+        self.assertEqual(response.data[0]['rating'], 4.0)
+        self.assertEqual(response.data[0]['total_ratings'], 1)
+
+    def test_rating_summary_tracks_updates_and_deletes(self):
+        """Test summary columns follow rating create, update and delete"""
+        product = Product.objects.get(serial_number="SUMMARY0")
+        other = User.objects.create_user(username='other', password='testpass123')
+        Rating.objects.create(user=other, product=product, score=2)
+        product.refresh_from_db()
+        self.assertEqual(product.total_ratings, 2)
+        self.assertEqual(product.avg_rating, 3.0)
+
+        rating = Rating.objects.get(user=other, product=product)
+        rating.score = 5
+        rating.save()
+        product.refresh_from_db()
+        self.assertEqual(product.rating_sum, 9)
+        self.assertEqual(product.rating_distribution, {1: 0, 2: 0, 3: 0, 4: 1, 5: 1})
+
+        rating.delete()
+        product.refresh_from_db()
+        self.assertEqual(product.total_ratings, 1)
+        self.assertEqual(product.avg_rating, 4.0)
+
+    def test_rebuild_rating_summary_command(self):
+        """Test the rebuild command repairs drifted summary columns"""
+        Product.objects.update(rating_sum=0, rating_count=0, rating_4_count=0)
+        call_command('rebuild_rating_summary', chunk_size=2, stdout=StringIO())
+        for product in Product.objects.all():
+            self.assertEqual(product.total_ratings, 1)
+            self.assertEqual(product.rating_4_count, 1)
+            self.assertEqual(product.avg_rating, 4.0)
+
+    def test_rebuild_rating_summary_refreshes_api(self):
+        """Test the product API serves the rebuilt summary, not cached drifted values"""
+        with self.captureOnCommitCallbacks():
+            Product.objects.update(rating_sum=0, rating_count=0, rating_4_count=0)
+            refresh_product_caches(Product.objects.values_list('id', flat=True))
+        products = json.loads(self.client.get('/api/products/all/').content)
+        self.assertEqual(products[0]['total_ratings'], 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('rebuild_rating_summary', stdout=StringIO())
+        products = json.loads(self.client.get('/api/products/all/').content)
+        self.assertEqual(products[0]['total_ratings'], 1)
+        self.assertEqual(products[0]['rating'], 4.0)
+
+class ProductPaginationTest(APITestCase):
+    def setUp(self):
+        self.category = Category.objects.create(name="Test Category")
+        for i, price in enumerate(['30.00', '10.00', '20.00', '10.00', '50.00']):
+            Product.objects.create(
+                title=f"Product {i}",
+                model="Test Model",
+                serial_number=f"PAGE{i}",
+                description="Test Description",
+                quantity_in_stock=10,
+                price=Decimal(price),
+                category=self.category
+            )
+
+    def fetch_all(self, sort):
+        seen = []
+        url = f'/api/products/all/?sort={sort}&page_size=2'
+        while True:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertLessEqual(len(response.data), 2)
+            seen.extend(response.data)
+            cursor = response.get('X-Next-Cursor')
+            if not cursor:
+                return seen
+            url = f'/api/products/all/?sort={sort}&page_size=2&cursor={cursor}'
+
+    def test_price_sort_pages(self):
+        """Test walking price-sorted pages with ties returns every product once"""
+        products = self.fetch_all('price')
+        self.assertEqual(len(products), 5)
+        self.assertEqual(len({p['id'] for p in products}), 5)
+        prices = [Decimal(p['price']) for p in products]
+        self.assertEqual(prices, sorted(prices))
+
+    def test_newest_sort_pages(self):
+        """Test newest sort returns the most recently added product first"""
+        products = self.fetch_all('newest')
+        ids = [p['id'] for p in products]
+        self.assertEqual(ids, sorted(ids, reverse=True))
+
+    def test_page_size_is_capped(self):
+        """Test page_size cannot exceed the configured maximum"""
+        with self.settings(PRODUCT_MAX_PAGE_SIZE=3):
+            response = self.client.get('/api/products/all/?page_size=1000')
+        self.assertEqual(len(response.data), 3)
+        self.assertIn('rel="next"', response['Link'])
+
+    def test_invalid_cursor(self):
+        """Test a malformed cursor is rejected"""
+        response = self.client.get('/api/products/all/?cursor=not-a-cursor')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_tampered_cursor(self):
+        """Test a well-formed cursor with a bad sort key or id is rejected"""
+        def cursor(payload):
+            return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+
+        for sort, payload in [
+            ('price', {'s': 'price', 'k': 'abc', 'i': 1}),
+            ('price', {'s': 'price', 'k': 'NaN', 'i': 1}),
+            ('price', {'s': 'price', 'k': ['10.00'], 'i': 1}),
+            ('price', {'s': 'price', 'k': '10.00', 'i': 10 ** 30}),
+            ('id', {'s': 'id', 'k': 1, 'i': -(10 ** 30)}),
+        ]:
+            response = self.client.get(f'/api/products/all/?sort={sort}&cursor={cursor(payload)}')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, payload)
+
+class ProductFieldsTest(APITestCase):
+    def setUp(self):
+        self.category = Category.objects.create(name="Test Category")
+        self.product = Product.objects.create(
+            title="Test Product",
+            model="Test Model",
+            serial_number="TEST123",
+            description="Test Description",
+            quantity_in_stock=10,
+            price=Decimal('99.99'),
+            category=self.category
+        )
+
+    def test_list_defaults_to_summary(self):
+        """Test the product list uses the compact summary representation"""
+        response = self.client.get('/api/products/all/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(set(response.data[0]), set(ProductSerializer.SUMMARY_FIELDS))
+        self.assertEqual(response.data[0]['category']['name'], "Test Category")
+
+    def test_list_sparse_fields(self):
+        """Test ?fields= trims the output and the selected columns"""
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/products/all/?fields=title,stock')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data[0], {'id': self.product.id, 'title': "Test Product", 'stock': 10})
+        self.assertNotIn('description', queries[-1]['sql'])
+
+    def test_list_summary_with_description(self):
+        """Test the storefront's summary-plus-description field list"""
+        fields = ProductSerializer.SUMMARY_FIELDS + ['description']
+        response = self.client.get(f"/api/products/all/?fields={','.join(fields)}")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(set(response.data[0]), set(fields))
+        self.assertEqual(response.data[0]['description'], "Test Description")
+
+    def test_list_all_fields(self):
+        """Test ?fields=all returns the full representation"""
+        response = self.client.get('/api/products/all/?fields=all')
+        self.assertEqual(response.data[0]['description'], "Test Description")
+
+    def test_unknown_field(self):
+        """Test unknown field names are rejected"""
+        response = self.client.get('/api/products/all/?fields=title,secret')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_detail_sparse_fields(self):
+        """Test the detail view honours ?fields="""
+        response = self.client.get(f'/api/products/{self.product.id}/?fields=price')
+        self.assertEqual(response.data, {'id': self.product.id, 'price': "99.99"})
+
+class CatalogCacheTest(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(name="Test Category")
+        self.product = Product.objects.create(
+            title="Test Product",
+            model="Test Model",
+            serial_number="TEST123",
+            description="Test Description",
+            quantity_in_stock=10,
+            price=Decimal('99.99'),
+            category=self.category
+        )
+
+    def test_repeated_reads_are_served_from_cache(self):
+        """Test a second identical catalog read does not touch the database"""
+        first = self.client.get('/api/products/all/')
+        with self.assertNumQueries(0):
+            second = self.client.get('/api/products/all/')
+        self.assertEqual(second.status_code, status.HTTP_200_OK)
+        self.assertEqual(first.content, second.content)
+
+    def test_product_change_invalidates(self):
+        """Test saving a product invalidates cached product responses"""
+        self.client.get(f'/api/products/{self.product.id}/')
+        self.product.title = "Renamed Product"
+        self.product.save()
+        response = self.client.get(f'/api/products/{self.product.id}/')
+        self.assertEqual(json.loads(response.content)['title'], "Renamed Product")
+
+    def test_category_delete_invalidates(self):
+        """Test deleting a category invalidates the cached category list"""
+        self.client.get('/api/categories/')
+        self.category.delete()
+        response = self.client.get('/api/categories/')
+        self.assertEqual(json.loads(response.content), [])
+
+class ConditionalGetTest(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            username='testuser',
+            password='testpass123'
+        )
+        self.category = Category.objects.create(name="Test Category")
+        self.product = Product.objects.create(
+            title="Test Product",
+            model="Test Model",
+            serial_number="TEST123",
+            description="Test Description",
+            quantity_in_stock=10,
+            price=Decimal('99.99'),
+            category=self.category
+        )
+
+    def test_if_none_match_returns_304(self):
+        """Test a matching ETag is answered with 304 and no body"""
+        response = self.client.get('/api/products/all/')
+        etag = response['ETag']
+        self.assertTrue(etag.startswith('"'))
+        self.assertIn('Last-Modified', response)
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/products/all/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response.content, b'')
+
+    def test_if_modified_since_returns_304(self):
+        """Test If-Modified-Since at the Last-Modified time is answered with 304"""
+        response = self.client.get('/api/categories/')
+        response = self.client.get(
+            '/api/categories/', HTTP_IF_MODIFIED_SINCE=response['Last-Modified']
+        )
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_etag_changes_when_product_changes(self):
+        """Test the detail ETag changes once the product is updated"""
+        url = f'/api/products/{self.product.id}/'
+        etag = self.client.get(url)['ETag']
+        self.product.price = Decimal('89.99')
+        self.product.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_comment_etag_tracks_approval(self):
+        """Test approving a comment changes the product comments ETag"""
+        comment = Comment.objects.create(user=self.user, product=self.product, text="Nice")
+        url = f'/api/products/{self.product.id}/comments/'
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(
+            self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code,
+            status.HTTP_304_NOT_MODIFIED
+        )
+        comment.approved = True
+        comment.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 1)
+
+    def test_oversized_product_id(self):
+        """Test ids too large for the database are handled by the views, not the validators"""
+        huge = 10 ** 30
+        response = self.client.get(f'/api/products/{huge}/comments/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, [])
+        response = self.client.get(f'/api/products/{huge}/')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+class ProductDocumentTest(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            username='testuser',
+            password='testpass123'
+        )
+        self.category = Category.objects.create(name="Test Category")
+        self.product = Product.objects.create(
+            title="Test Product",
+            model="Test Model",
+            serial_number="TEST123",
+            description="Test Description",
+            quantity_in_stock=10,
+            price=Decimal('99.99'),
+            category=self.category
+        )
+
+    def test_document_matches_serializer(self):
+        """Test the stored document renders the same as ProductSerializer"""
+        response = self.client.get(f'/api/products/{self.product.id}/')
+        self.assertTrue(ProductDocument.objects.filter(product=self.product).exists())
+        request = response.wsgi_request
+        expected = ProductSerializer(
+            Product.objects.get(id=self.product.id), context={'request': request}
+        ).data
+        self.assertEqual(json.loads(response.content), json.loads(json.dumps(expected)))
+        self.assertTrue(response.data['image_url'].startswith('http://testserver/'))
+
+    def test_documents_rebuilt_after_commit(self):
+        """Test changed products get their document rebuilt on commit"""
+        with self.captureOnCommitCallbacks(execute=True):
+            Rating.objects.create(user=self.user, product=self.product, score=3)
+        document = ProductDocument.objects.get(product=self.product)
+        self.assertEqual(json.loads(bytes(document.full))['total_ratings'], 1)
+
+    def test_category_rename_invalidates_documents(self):
+        """Test renaming a category refreshes its products' documents"""
+        self.client.get('/api/products/all/')
+        self.category.name = "Renamed Category"
+        self.category.save()
+        response = self.client.get('/api/products/all/')
+        self.assertEqual(response.data[0]['category']['name'], "Renamed Category")
+
+class ProductSearchTest(APITestCase):
+    def setUp(self):
+        self.phones = Category.objects.create(name="Phones")
+        self.laptops = Category.objects.create(name="Laptops")
+        self.make("iPhone 15", "A2846", "Apple smartphone", self.phones, "S1")
+        self.make("MacBook Pro", "M3", "Laptop with a great iPhone camera", self.laptops, "S2")
+        self.make("ThinkPad", "X1 Carbon", "Business laptop", self.laptops, "S3")
+
+    def make(self, title, model, description, category, serial):
+        return Product.objects.create(
+            title=title,
+            model=model,
+            serial_number=serial,
+            description=description,
+            quantity_in_stock=5,
+            price=Decimal('999.00'),
+            category=category
+        )
+
+    def test_title_match_ranks_first(self):
+        """Test bm25 ranks a title match above a description match"""
+        response = self.client.get('/api/search/?q=iphone')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([p['title'] for p in response.data], ["iPhone 15", "MacBook Pro"])
+
+    def test_prefix_and_category_match(self):
+        """Test prefix queries and matches on the category name"""
+        response = self.client.get('/api/search/?q=lapt')
+        self.assertEqual({p['title'] for p in response.data}, {"MacBook Pro", "ThinkPad"})
+
+    def test_index_follows_updates(self):
+        """Test renamed and deleted products are re-indexed"""
+        product = Product.objects.get(serial_number="S3")
+        product.title = "Zenbook"
+        product.save()
+        self.assertEqual(len(self.client.get('/api/search/?q=thinkpad').data), 0)
+        self.assertEqual(len(self.client.get('/api/search/?q=zenbook').data), 1)
+        product.delete()
+        self.assertEqual(len(self.client.get('/api/search/?q=zenbook').data), 0)
+
+    def test_search_pagination(self):
+        """Test search results page with a cursor"""
+        response = self.client.get('/api/search/?q=laptop&page_size=1')
+        self.assertEqual(len(response.data), 1)
+        cursor = response['X-Next-Cursor']
+        second = self.client.get(f'/api/search/?q=laptop&page_size=1&cursor={cursor}')
+        self.assertEqual(len(second.data), 1)
+        self.assertNotEqual(response.data[0]['id'], second.data[0]['id'])
+
+    def test_response_is_a_list_with_cursor(self):
+        """Test search answers with a plain list of products and pages through X-Next-Cursor"""
+        response = self.client.get('/api/search/?q=laptop&page_size=1')
+        self.assertIsInstance(response.data, list)
+        self.assertEqual(set(response.data[0]), set(ProductSerializer.SUMMARY_FIELDS))
+        self.assertIn('X-Next-Cursor', response)
+
+    def test_filters_apply_to_results(self):
+        """Test category and price filters narrow the ranked results"""
+        budget = self.make("Budget iPhone", "SE", "Cheap phone", self.phones, "S4")
+        Product.objects.filter(pk=budget.pk).update(price=Decimal('299.00'))
+        response = self.client.get(f'/api/search/?q=iphone&category={self.phones.id}')
+        self.assertEqual([p['title'] for p in response.data], ["iPhone 15", "Budget iPhone"])
+        response = self.client.get('/api/search/?q=iphone&max_price=500')
+        self.assertEqual([p['title'] for p in response.data], ["Budget iPhone"])
+        response = self.client.get('/api/search/?q=iphone&min_price=cheap')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_filtered_pages_are_full(self):
+        """Test pages stay full when the filter skips higher ranked matches"""
+        for i in range(4):
+            self.make(f"Laptop {i}", "L", "Laptop", self.laptops if i % 2 else self.phones, f"L{i}")
+        seen = []
+        url = f'/api/search/?q=laptop&category={self.laptops.id}&page_size=2'
+        while url:
+            response = self.client.get(url)
+            self.assertLessEqual(len(response.data), 2)
+            seen += [p['title'] for p in response.data]
+            cursor = response.get('X-Next-Cursor')
+            url = f'/api/search/?q=laptop&category={self.laptops.id}&page_size=2&cursor={cursor}' if cursor else None
+        self.assertEqual(sorted(seen), ["Laptop 1", "Laptop 3", "MacBook Pro", "ThinkPad"])
+
+    def test_query_syntax_is_escaped(self):
+        """Test FTS5 operators in the query are treated as plain words"""
+        response = self.client.get('/api/search/?q=laptop" OR NEAR(')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+class ProductFacetTest(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.phones = Category.objects.create(name="Phones")
+        self.laptops = Category.objects.create(name="Laptops")
+        self.make("Phone A", '50.00', 5, True, self.phones)
+        self.make("Phone B", '250.00', 0, False, self.phones)
+        self.make("Laptop A", '1500.00', 3, True, self.laptops)
+        self.make("Laptop B", '750.00', 2, False, self.laptops)
+
+    def make(self, title, price, stock, warranty, category):
+        return Product.objects.create(
+            title=title,
+            model="Model",
+            serial_number=title,
+            description="Description",
+            quantity_in_stock=stock,
+            price=Decimal(price),
+            warranty_status=warranty,
+            category=category
+        )
+
+    def test_combined_filters(self):
+        """Test category, price, stock and warranty filters together"""
+        response = self.client.get(
+            f'/api/products/?category={self.laptops.id}&min_price=500&in_stock=true&warranty=false'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([p['title'] for p in response.data], ["Laptop B"])
+
+    def test_facet_counts(self):
+        """Test each facet is counted with the other filters applied"""
+        response = self.client.get(f'/api/products/?category={self.phones.id}&facets=true')
+        self.assertEqual(len(response.data['results']), 2)
+        facets = response.data['facets']
+        self.assertEqual(
+            {c['name']: c['count'] for c in facets['category']},
+            {"Phones": 2, "Laptops": 2}
+        )
+        self.assertEqual([b['count'] for b in facets['price']], [1, 1, 0, 0])
+        self.assertEqual(facets['availability'], {'in_stock': 1, 'out_of_stock': 1})
+        self.assertEqual(facets['warranty'], {'true': 1, 'false': 1})
+
+    def test_facet_counts_are_cached_per_catalog_version(self):
+        """Test facet counts are reused until the catalog changes"""
+        self.client.get('/api/products/?facets=true&page_size=1')
+        with mock.patch.object(ProductFilters, 'facet_counts') as facet_counts:
+            self.client.get('/api/products/?facets=true&page_size=2')
+        facet_counts.assert_not_called()
+        self.make("Phone C", '20.00', 1, True, self.phones)
+        response = self.client.get('/api/products/?facets=true')
+        self.assertEqual(response.data['facets']['availability']['in_stock'], 4)
+
+    def test_invalid_filter(self):
+        """Test malformed filter values are rejected"""
+        response = self.client.get('/api/products/?min_price=cheap')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_out_of_range_category(self):
+        """Test category ids too large for the database are rejected"""
+        for value in [str(10 ** 30), f'{self.phones.id},-1']:
+            response = self.client.get(f'/api/products/?category={value}')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, value)
+
+    def test_non_finite_price(self):
+        """Test NaN and Infinity price bounds are rejected"""
+        for value in ['NaN', 'sNaN', 'Infinity', '-Infinity']:
+            response = self.client.get(f'/api/products/?max_price={value}')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, value)
+
+class ProductBulkLookupTest(APITestCase):
+    def setUp(self):
+        self.category = Category.objects.create(name="Test Category")
+        self.products = [
+            Product.objects.create(
+                title=f"Product {i}",
+                model="Test Model",
+                serial_number=f"BULK{i}",
+                description="Test Description",
+                quantity_in_stock=10,
+                price=Decimal('10.00'),
+                category=self.category
+            )
+            for i in range(3)
+        ]
+
+    def test_bulk_lookup_preserves_order_and_reports_missing(self):
+        """Test ?ids= returns products in request order and lists unknown ids"""
+        first, second, third = (p.id for p in self.products)
+        response = self.client.get(f'/api/products/?ids={third},999,{first}')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([p['id'] for p in response.data['results']], [third, first])
+        self.assertEqual(response.data['missing'], [999])
+
+    def test_bulk_lookup_with_fields(self):
+        """Test ?ids= honours ?fields="""
+        product = self.products[0]
+        response = self.client.get(f'/api/products/?ids={product.id}&fields=title')
+        self.assertEqual(response.data['results'], [{'id': product.id, 'title': "Product 0"}])
+
+    def test_bulk_lookup_rejects_bad_ids(self):
+        """Test malformed ids are rejected"""
+        response = self.client.get('/api/products/?ids=1,abc')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_bulk_lookup_rejects_out_of_range_ids(self):
+        """Test ids too large for the database are rejected"""
+        response = self.client.get(f'/api/products/?ids=1,{10 ** 30}')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+class StreamingResponseTest(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='streamer', password='testpass123')
+        self.category = Category.objects.create(name="Test Category")
+        self.products = [
+            Product.objects.create(
+                title=f"Product {i}",
+                model="Test Model",
+                serial_number=f"STREAM{i}",
+                description="Test Description",
+                quantity_in_stock=10,
+                price=Decimal('10.00'),
+                category=self.category
+            )
+            for i in range(5)
+        ]
+        for product in self.products:
+            Rating.objects.create(user=self.user, product=product, score=4)
+            Comment.objects.create(user=self.user, product=product, text="Nice", approved=True)
+
+    def streamed(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        return json.loads(b''.join(response.streaming_content))
+
+    @override_settings(STREAM_CHUNK_SIZE=2)
+    def test_stream_all_products(self):
+        """Test ?stream=true returns the whole catalog unpaginated"""
+        body = self.streamed('/api/products/all/?stream=true&page_size=1')
+        self.assertEqual([p['id'] for p in body], [p.id for p in self.products])
+        self.assertEqual(set(body[0]), set(ProductSerializer.SUMMARY_FIELDS))
+
+    @override_settings(STREAM_CHUNK_SIZE=2)
+    def test_stream_all_products_with_fields(self):
+        """Test streamed products honour ?fields="""
+        body = self.streamed('/api/products/all/?stream=true&fields=title')
+        self.assertEqual(body[0], {'id': self.products[0].id, 'title': "Product 0"})
+
+    @override_settings(STREAM_CHUNK_SIZE=2)
+    def test_stream_ratings_matches_plain_response(self):
+        """Test streamed ratings equal the non-streamed list"""
+        plain = self.client.get('/api/ratings/').data
+        self.assertEqual(self.streamed('/api/ratings/?stream=true'), json.loads(json.dumps(plain)))
+
+    @override_settings(STREAM_CHUNK_SIZE=2)
+    def test_stream_comments_matches_plain_response(self):
+        """Test streamed comments equal the non-streamed list"""
+        url = f'/api/comments/?product={self.products[0].id}'
+        plain = self.client.get(url).data
+        self.assertEqual(self.streamed(url + '&stream=true'), json.loads(json.dumps(plain)))
+
+    def test_stream_empty_list(self):
+        """Test streaming an empty list yields an empty JSON array"""
+        self.assertEqual(self.streamed('/api/ratings/?stream=true&user=999'), [])
+
+class ProductImageVariantTest(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.category = Category.objects.create(name="Test Category")
+
+    def upload(self, name, size=(1600, 800), color='red'):
+        buffer = BytesIO()
+        Image.new('RGB', size, color).save(buffer, 'PNG')
+        return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+
+    def make(self, serial, image):
+        with self.captureOnCommitCallbacks(execute=True):
+            product = Product.objects.create(
+                title="Test Product",
+                model="Test Model",
+                serial_number=serial,
+                description="Test Description",
+                quantity_in_stock=10,
+                price=Decimal('10.00'),
+                category=self.category,
+                image=image
+            )
+        product.refresh_from_db()
+        return product
+
+    def test_variants_generated_on_upload(self):
+        """Test uploading an image writes resized WebP variants"""
+        product = self.make("IMG1", self.upload('photo.png'))
+        variants = product.image_variants['variants']
+        self.assertEqual(product.image_variants['source'], product.image.name)
+        self.assertEqual(
+            {name: info['width'] for name, info in variants.items()},
+            {'thumbnail': 200, 'card': 480, 'detail': 1200},
+        )
+        for info in variants.values():
+            with default_storage.open(info['name'], 'rb') as f:
+                image = Image.open(f)
+                self.assertEqual(image.format, 'WEBP')
+                self.assertEqual(image.width, info['width'])
+
+    def test_small_images_are_not_upscaled(self):
+        """Test variants are never wider than the source"""
+        product = self.make("IMG1", self.upload('small.png', size=(300, 300)))
+        widths = {name: info['width'] for name, info in product.image_variants['variants'].items()}
+        self.assertEqual(widths, {'thumbnail': 200, 'card': 300, 'detail': 300})
+
+    def test_identical_images_share_variants(self):
+        """Test variant names come from the image content"""
+        first = self.make("IMG1", self.upload('a.png'))
+        second = self.make("IMG2", self.upload('b.png'))
+        other = self.make("IMG3", self.upload('c.png', color='blue'))
+        self.assertEqual(first.image_variants['variants'], second.image_variants['variants'])
+        self.assertNotEqual(first.image_variants['variants'], other.image_variants['variants'])
+
+    def test_serializer_exposes_variant_urls(self):
+        """Test the product API lists variant URLs with their widths"""
+        product = self.make("IMG1", self.upload('photo.png'))
+        response = self.client.get(f'/api/products/{product.id}/')
+        images = response.data['images']
+        self.assertEqual(list(images), ['thumbnail', 'card', 'detail'])
+        self.assertTrue(images['thumbnail']['url'].startswith('http://testserver/'))
+        self.assertTrue(images['thumbnail']['url'].endswith('-thumbnail.webp'))
+        self.assertEqual(images['card']['width'], 480)
+
+    def test_changing_image_regenerates_variants(self):
+        """Test replacing the image replaces its variants"""
+        product = self.make("IMG1", self.upload('photo.png'))
+        old = product.image_variants['variants']['card']['name']
+        product.image = self.upload('new.png', color='green')
+        with self.captureOnCommitCallbacks(execute=True):
+            product.save()
+        product.refresh_from_db()
+        self.assertEqual(product.image_variants['source'], product.image.name)
+        self.assertNotEqual(product.image_variants['variants']['card']['name'], old)
+
+    def test_unreadable_image_has_no_variants(self):
+        """Test a missing image file leaves the product without variants"""
+        with self.assertLogs('app_backend.images', level='WARNING'):
+            product = self.make("IMG1", 'missing.jpg')
+        self.assertEqual(product.image_variants, {'source': 'missing.jpg', 'variants': {}})
+        response = self.client.get(f'/api/products/{product.id}/')
+        self.assertIsNone(response.data['images'])
+
+    def test_backfill_command(self):
+        """Test generate_image_variants fills in products without variants"""
+        product = self.make("IMG1", self.upload('photo.png'))
+        twin = self.make("IMG2", product.image.name)
+        Product.objects.filter(pk__in=[product.pk, twin.pk]).update(image_variants={})
+        out = StringIO()
+        call_command('generate_image_variants', '--workers', '2', stdout=out)
+        product.refresh_from_db()
+        twin.refresh_from_db()
+        self.assertEqual(len(product.image_variants['variants']), 3)
+        self.assertEqual(product.image_variants, twin.image_variants)
+        self.assertIn("Generated variants for 1 images (2 products", out.getvalue())
+
+class MediaServingTest(APITestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root, MEDIA_SERVE_MODE='direct')
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.content = bytes(range(100))
+        self.hashed = 'derived/0123456789abcdef0123-card.webp'
+        for name in ['photo.jpg', self.hashed, 'invoices/invoice_order_1.pdf']:
+            default_storage.save(name, ContentFile(self.content))
+
+    def test_serves_file_with_validators(self):
+        """Test media files are sent with stat based validators"""
+        response = self.client.get('/media/products/photo.jpg')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=3600')
+        self.assertIn('Last-Modified', response)
+        response = self.client.get('/media/products/photo.jpg', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_hashed_names_are_immutable(self):
+        """Test content hashed files are cached forever"""
+        response = self.client.get('/media/products/' + self.hashed)
+        self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+
+    def test_range_requests(self):
+        """Test byte ranges return 206 with the requested slice"""
+        response = self.client.get('/media/products/photo.jpg', HTTP_RANGE='bytes=10-19')
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(b''.join(response.streaming_content), self.content[10:20])
+        self.assertEqual(response['Content-Range'], 'bytes 10-19/100')
+        response = self.client.get('/media/products/photo.jpg', HTTP_RANGE='bytes=-5')
+        self.assertEqual(b''.join(response.streaming_content), self.content[-5:])
+        response = self.client.get('/media/products/photo.jpg', HTTP_RANGE='bytes=500-')
+        self.assertEqual(response.status_code, status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+        self.assertEqual(response['Content-Range'], 'bytes */100')
+
+    def test_stale_if_range_sends_whole_file(self):
+        """Test a Range with an outdated If-Range gets the full file"""
+        response = self.client.get(
+            '/media/products/photo.jpg', HTTP_RANGE='bytes=10-19', HTTP_IF_RANGE='"stale"'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+
+    def test_invoices_and_traversal_are_not_public(self):
+        """Test invoices and paths outside MEDIA_ROOT are not served"""
+        for path in [
+            'invoices/invoice_order_1.pdf',
+            './invoices/invoice_order_1.pdf',
+            'x/../invoices/invoice_order_1.pdf',
+            '%2e/invoices/invoice_order_1.pdf',
+            'photo.jpg/../invoices/invoice_order_1.pdf',
+        ]:
+            self.assertEqual(
+                self.client.get('/media/products/' + path).status_code,
+                status.HTTP_404_NOT_FOUND,
+                path,
+            )
+        self.assertEqual(
+            self.client.get('/media/products/../settings.py').status_code,
+            status.HTTP_404_NOT_FOUND,
+        )
+
+    def test_proxy_handoff(self):
+        """Test proxy modes send only headers for the front proxy"""
+        with self.settings(MEDIA_SERVE_MODE='x-accel-redirect'):
+            response = self.client.get('/media/products/photo.jpg')
+        self.assertEqual(response['X-Accel-Redirect'], '/protected-media/photo.jpg')
+        self.assertEqual(response.content, b'')
+        with self.settings(MEDIA_SERVE_MODE='x-sendfile'):
+            response = self.client.get('/media/products/photo.jpg')
+        self.assertEqual(response['X-Sendfile'], os.path.join(self.media_root, 'photo.jpg'))
+        self.assertEqual(response.content, b'')
+
+    def test_download_invoice_uses_private_caching(self):
+        """Test stored invoices are served privately as attachments"""
+        user = User.objects.create_user(username='buyer', password='testpass123')
+        order = Order.objects.create(user=user)
+        response = self.client.get(f'/api/orders/{order.id}/invoice/?user={user.id}')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(b''.join(response.streaming_content).startswith(b'%PDF'))
+        self.assertEqual(response['Cache-Control'], 'private, no-cache')
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertIn('attachment', response['Content-Disposition'])
+
+class OrderCreationTest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='buyer', password='testpass123')
+        self.category = Category.objects.create(name="Test Category")
+        self.products = [
+            Product.objects.create(
+                title=f"Product {i}",
+                model="Test Model",
+                serial_number=f"ORDER{i}",
+                description="Test Description",
+                quantity_in_stock=10,
+                price=Decimal('10.00'),
+                category=self.category
+            )
+            for i in range(10)
+        ]
+
+    def order(self, items):
+        return self.client.post('/api/orders/', {
+            'user': self.user.id,
+            'delivery_address': "Test Address",
+            'order_items': [
+                {'product': product_id, 'quantity': quantity, 'price_at_purchase': "10.00"}
+                for product_id, quantity in items
+            ],
+        }, format='json')
+
+    def test_query_count_does_not_grow_with_cart_size(self):
+        """Test checkout runs the same number of queries for 1 and 10 items"""
+        with CaptureQueriesContext(connection) as one_item:
+            self.assertEqual(self.order([(self.products[0].id, 1)]).status_code, status.HTTP_201_CREATED)
+        with CaptureQueriesContext(connection) as ten_items:
+            response = self.order([(p.id, 1) for p in self.products])
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(one_item.captured_queries), len(ten_items.captured_queries))
+
+    def test_stock_and_items(self):
+        """Test lines are stored and stock is taken per product"""
+        first, second = self.products[:2]
+        response = self.order([(first.id, 2), (second.id, 3), (first.id, 1)])
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        order = Order.objects.get(id=response.data['order']['id'])
+        self.assertEqual(order.items.count(), 3)
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual(first.quantity_in_stock, 7)
+        self.assertEqual(second.quantity_in_stock, 7)
+
+    def test_checkout_updates_catalog(self):
+        """Test the catalog shows the new stock after checkout"""
+        product = self.products[0]
+        self.client.get(f'/api/products/{product.id}/')
+        self.order([(product.id, 4)])
+        response = self.client.get(f'/api/products/{product.id}/')
+        self.assertEqual(response.data['quantity_in_stock'], 6)
+
+    def test_insufficient_stock_rolls_back(self):
+        """Test an order that can't be filled changes nothing"""
+        first, second = self.products[:2]
+        response = self.order([(first.id, 2), (second.id, 11)])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('Not enough stock for Product 1', response.data['error'])
+        self.assertFalse(Order.objects.exists())
+        first.refresh_from_db()
+        self.assertEqual(first.quantity_in_stock, 10)
+
+    def test_unknown_product(self):
+        """Test an unknown product id is rejected"""
+        response = self.order([(999, 1)])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Order.objects.exists())
+
+    def test_invalid_quantity(self):
+        """Test zero or non-numeric quantities are rejected"""
+        self.assertEqual(self.order([(self.products[0].id, 0)]).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.order([(self.products[0].id, 'two')]).status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_malformed_items(self):
+        """Test order items that aren't a list of lines are rejected"""
+        for order_items in [{'product': self.products[0].id}, 'abc', 5, ['abc']]:
+            response = self.client.post('/api/orders/', {
+                'user': self.user.id,
+                'delivery_address': "Test Address",
+                'order_items': order_items,
+            }, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, order_items)
+        self.assertFalse(Order.objects.exists())
+
+    def test_out_of_range_product(self):
+        """Test product ids the database can't hold are rejected"""
+        self.assertEqual(self.order([(2 ** 63, 1)]).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.order([(-1, 1)]).status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_invalid_price(self):
+        """Test non-numeric and non-finite prices are rejected"""
+        for price in ['abc', 'NaN', 'Infinity', [1]]:
+            response = self.client.post('/api/orders/', {
+                'user': self.user.id,
+                'delivery_address': "Test Address",
+                'order_items': [{'product': self.products[0].id, 'quantity': 1, 'price_at_purchase': price}],
+            }, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, price)
+        self.assertFalse(Order.objects.exists())
+
+    def test_stock_taken_after_check_rolls_back(self):
+        """Test the conditional UPDATE catches stock sold after the check"""
+        product = self.products[0]
+        take_stock = ProductQuerySet.take_stock
+
+        def sell_out_first(queryset, quantities, held=None):
+            Product.objects.filter(pk=product.pk).update(quantity_in_stock=1)
+            return take_stock(queryset, quantities, held)
+
+        with mock.patch.object(ProductQuerySet, 'take_stock', sell_out_first):
+            response = self.order([(product.id, 5)])
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertFalse(Order.objects.exists())
+        self.assertFalse(OrderItem.objects.exists())
+        # The simulated sale ran inside the same transaction and is rolled back with it
+        product.refresh_from_db()
+        self.assertEqual(product.quantity_in_stock, 10)
+
+class ConcurrentCheckoutTest(TransactionTestCase):
+    # on_commit callbacks run here; keep image variants out of MEDIA_ROOT
+    @mock.patch('app_backend.models._schedule_image_variants')
+    def test_concurrent_checkouts_never_oversell(self, schedule_image_variants):
+        """Test parallel checkouts sell at most the available stock"""
+        stock = 5
+        category = Category.objects.create(name="Test Category")
+        product = Product.objects.create(
+            title="Last Units",
+            model="Test Model",
+            serial_number="RACE1",
+            description="Test Description",
+            quantity_in_stock=stock,
+            price=Decimal('10.00'),
+            category=category
+        )
+        users = [User.objects.create_user(username=f'racer{i}', password='x') for i in range(12)]
+        barrier = threading.Barrier(len(users))
+        results = []
+
+        def checkout(user):
+            try:
+                client = APIClient()
+                barrier.wait()
+                response = client.post('/api/orders/', {
+                    'user': user.id,
+                    'delivery_address': "Test Address",
+                    'order_items': [{'product': product.id, 'quantity': 1, 'price_at_purchase': "10.00"}],
+                }, format='json')
+                results.append(response.status_code)
+            finally:
+                connection.close()
+
+        # Captures the tracebacks of checkouts that fail on SQLite's table lock
+        with self.assertLogs('app_backend.views', 'DEBUG'):
+            threads = [threading.Thread(target=checkout, args=(user,)) for user in users]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        product.refresh_from_db()
+        sold = OrderItem.objects.filter(product=product).aggregate(total=Sum('quantity'))['total'] or 0
+        self.assertEqual(len(results), len(users))
+        # SQLite's in-memory test database fails lock waits instead of
+        # blocking, so some checkouts may error out; none may oversell.
+        self.assertIn(status.HTTP_201_CREATED, results)
+        self.assertGreaterEqual(product.quantity_in_stock, 0)
+        self.assertEqual(sold, stock - product.quantity_in_stock)
+        self.assertEqual(results.count(status.HTTP_201_CREATED), Order.objects.count())
+        self.assertLessEqual(results.count(status.HTTP_201_CREATED), stock)
+
+class JobQueueTest(APITestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.user = User.objects.create_user(username='buyer', password='testpass123')
+        self.product = Product.objects.create(
+            title="Test Product",
+            model="Test Model",
+            serial_number="JOB1",
+            description="Test Description",
+            quantity_in_stock=10,
+            price=Decimal('10.00')
+        )
+        self.calls = []
+        TASKS['test.record'] = (lambda **kwargs: self.calls.append(kwargs), 3)
+        TASKS['test.fail'] = (self.fail_task, 2)
+        self.addCleanup(TASKS.pop, 'test.record')
+        self.addCleanup(TASKS.pop, 'test.fail')
+
+    def fail_task(self, **kwargs):
+        raise RuntimeError("boom")
+
+    def run_jobs(self):
+        out = StringIO()
+        call_command('run_jobs', '--once', '--workers', '1', stdout=out)
+        return out.getvalue()
+
+    def test_create_order_queues_invoice(self):
+        """Test checkout queues the invoice instead of rendering it"""
+        with mock.patch('app_backend.invoices.generate_invoice_pdf') as render:
+            response = self.client.post('/api/orders/', {
+                'user': self.user.id,
+                'delivery_address': "Test Address",
+                'order_items': [{'product': self.product.id, 'quantity': 1, 'price_at_purchase': "10.00"}],
+            }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        render.assert_not_called()
+        job = Job.objects.get()
+        self.assertEqual(job.task, 'invoices.generate')
+        self.assertEqual(job.payload, {'order_id': response.data['order']['id']})
+
+    def test_worker_renders_and_queues_invoice_email(self):
+        """Test the worker stores the invoice PDF and queues it for emailing"""
+        self.user.email = 'buyer@example.com'
+        self.user.save()
+        order = Order.objects.create(user=self.user, status='processing', total_price=10)
+        OrderItem.objects.create(order=order, product=self.product, quantity=1, price_at_purchase=10)
+        enqueue_invoice(order)
+        output = self.run_jobs()
+        self.assertIn("Ran 1 jobs: 1 succeeded", output)
+        order.refresh_from_db()
+        self.assertTrue(order.invoice_pdf.name.startswith('invoices/invoice_order_'))
+        with order.invoice_pdf.open('rb') as f:
+            self.assertTrue(f.read().startswith(b'%PDF'))
+        email = OutboundEmail.objects.get()
+        self.assertEqual(email.to, ['buyer@example.com'])
+        self.assertEqual(email.attachments[0]['path'], order.invoice_pdf.name)
+
+    def test_failed_job_is_retried_with_backoff(self):
+        """Test a failing job is rescheduled, then marked failed"""
+        job = enqueue('test.fail')
+        self.run_jobs()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('pending', 1))
+        self.assertGreater(job.run_at, timezone.now())
+        self.assertIn("boom", job.last_error)
+
+        Job.objects.filter(pk=job.pk).update(run_at=timezone.now())
+        self.run_jobs()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('failed', 2))
+
+    def test_missing_order_fails_without_retry(self):
+        """Test a job for a deleted order fails right away"""
+        job = enqueue('invoices.generate', {'order_id': 999})
+        self.run_jobs()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('failed', 1))
+
+    def test_jobs_run_once_and_in_order(self):
+        """Test claimed jobs run once, oldest first, and future jobs wait"""
+        enqueue('test.record', {'n': 1})
+        enqueue('test.record', {'n': 2})
+        enqueue('test.record', {'n': 3}, run_at=timezone.now() + timedelta(hours=1))
+        self.run_jobs()
+        self.run_jobs()
+        self.assertEqual(self.calls, [{'n': 1}, {'n': 2}])
+
+    def test_stale_running_jobs_are_released(self):
+        """Test jobs left running by a dead worker are picked up again"""
+        job = enqueue('test.record', {'n': 1})
+        Job.objects.filter(pk=job.pk).update(
+            status='running', locked_by='dead', locked_at=timezone.now() - timedelta(hours=1)
+        )
+        self.run_jobs()
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'done')
+        self.assertEqual(self.calls, [{'n': 1}])
+
+class CountingEmailBackend(locmem.EmailBackend):
+    """locmem backend that counts connections and fails for addresses containing 'bounce'."""
+    opened = 0
+
+    def open(self):
+        CountingEmailBackend.opened += 1
+        return True
+
+    def send_messages(self, messages):
+        for message in messages:
+            if any('bounce' in address for address in message.to):
+                raise smtplib.SMTPRecipientsRefused({message.to[0]: (550, b'No such user')})
+        return super().send_messages(messages)
+
+
+@override_settings(
+    EMAIL_BACKEND='app_backend.tests.CountingEmailBackend',
+    OUTBOX_MAX_ATTEMPTS=2,
+)
+class OutboxTest(APITestCase):
+    def setUp(self):
+        CountingEmailBackend.opened = 0
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def send_outbox(self, *args):
+        out = StringIO()
+        call_command('send_outbox', '--once', *args, stdout=out)
+        return out.getvalue()
+
+    def test_batches_share_one_connection(self):
+        """Test every queued message goes out over a single connection"""
+        for i in range(5):
+            queue_email(f"Message {i}", "Body", [f'user{i}@example.com'])
+        output = self.send_outbox('--batch-size', '2')
+        self.assertIn("Sent 5 emails, 0 failed", output)
+        self.assertEqual(len(mail.outbox), 5)
+        self.assertEqual(CountingEmailBackend.opened, 1)
+        self.assertFalse(OutboundEmail.objects.exclude(status='sent').exists())
+
+    def test_attachments_are_read_from_storage(self):
+        """Test attachments are loaded from storage when sending"""
+        default_storage.save('invoices/invoice_order_1.pdf', ContentFile(b'%PDF-1.4 test'))
+        queue_email(
+            "Invoice", "Body", ['buyer@example.com'],
+            attachments=[('invoices/invoice_order_1.pdf', 'invoice.pdf', 'application/pdf')],
+        )
+        self.send_outbox()
+        self.assertEqual(mail.outbox[0].attachments, [('invoice.pdf', b'%PDF-1.4 test', 'application/pdf')])
+
+    def test_failures_are_retried_then_dead_lettered(self):
+        """Test a failing message backs off, then is marked dead"""
+        email = queue_email("Hello", "Body", ['bounce@example.com'])
+        queue_email("Hello", "Body", ['ok@example.com'])
+        self.assertIn("Sent 1 emails, 1 failed", self.send_outbox())
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts), ('pending', 1))
+        self.assertGreater(email.next_attempt_at, timezone.now())
+        self.assertIn('SMTPRecipientsRefused', email.last_error)
+
+        OutboundEmail.objects.filter(pk=email.pk).update(next_attempt_at=timezone.now())
+        with self.assertLogs('app_backend.outbox', level='ERROR'):
+            self.send_outbox()
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts), ('dead', 2))
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_missing_attachment_is_dead_lettered(self):
+        """Test a message whose attachment is gone is not retried"""
+        email = queue_email(
+            "Invoice", "Body", ['buyer@example.com'],
+            attachments=[('invoices/missing.pdf', 'invoice.pdf', 'application/pdf')],
+        )
+        with self.assertLogs('app_backend.outbox', level='ERROR'):
+            self.send_outbox()
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts), ('dead', 1))
+
+    def test_unreachable_server_defers_the_batch(self):
+        """Test a failed connection reschedules the whole batch"""
+        queue_email("Hello", "Body", ['a@example.com'])
+        queue_email("Hello", "Body", ['b@example.com'])
+        with mock.patch.object(CountingEmailBackend, 'open', side_effect=ConnectionRefusedError):
+            self.assertIn("Sent 0 emails, 2 failed", self.send_outbox())
+        self.assertEqual(
+            list(OutboundEmail.objects.values_list('status', 'attempts')),
+            [('pending', 1), ('pending', 1)],
+        )
+
+    def test_password_reset_is_queued(self):
+        """Test forgot_password queues its email instead of sending it inline"""
+        User.objects.create_user(username='forgetful', email='forgetful@example.com', password='x')
+        response = self.client.post('/api/auth/forgot-password/', {'email': 'forgetful@example.com'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(OutboundEmail.objects.get().to, ['forgetful@example.com'])
+
+class InvoiceCacheTest(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.user = User.objects.create_user(username='buyer', password='testpass123')
+        self.product = Product.objects.create(
+            title="Test Product",
+            model="Test Model",
+            serial_number="INV1",
+            description="Test Description",
+            quantity_in_stock=10,
+            price=Decimal('10.00')
+        )
+        self.order = Order.objects.create(user=self.user, status='processing', total_price=20)
+        OrderItem.objects.create(order=self.order, product=self.product, quantity=2, price_at_purchase=10)
+        render = mock.patch('app_backend.invoices.generate_invoice_pdf', wraps=generate_invoice_pdf)
+        self.render = render.start()
+        self.addCleanup(render.stop)
+
+    def download(self):
+        response = self.client.get(f'/api/orders/{self.order.id}/invoice/?user={self.user.id}')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return b''.join(response.streaming_content)
+
+    def test_invoice_rendered_once(self):
+        """Test repeated downloads reuse the stored invoice"""
+        first = self.download()
+        second = self.download()
+        self.assertEqual(first, second)
+        self.assertEqual(self.render.call_count, 1)
+        self.order.refresh_from_db()
+        self.assertIn(self.order.invoice_hash[:16], self.order.invoice_pdf.name)
+
+    def test_status_change_renders_new_invoice(self):
+        """Test a cancelled order gets a fresh invoice and the old file is removed"""
+        self.download()
+        self.order.refresh_from_db()
+        old_name = self.order.invoice_pdf.name
+        Order.objects.filter(pk=self.order.pk).update(status='cancelled')
+        self.download()
+        self.assertEqual(self.render.call_count, 2)
+        self.order.refresh_from_db()
+        self.assertNotEqual(self.order.invoice_pdf.name, old_name)
+        self.assertFalse(default_storage.exists(old_name))
+
+    def test_queued_email_attaches_current_invoice(self):
+        """Test an invoice email queued before a re-render still goes out with the new PDF"""
+        User.objects.filter(pk=self.user.pk).update(email='buyer@example.com')
+        order = Order.objects.select_related('user').get(pk=self.order.pk)
+        ensure_invoice(order)
+        old_name = order.invoice_pdf.name
+        send_invoice_email(order)
+
+        Order.objects.filter(pk=order.pk).update(status='cancelled')
+        order.refresh_from_db()
+        new_name = ensure_invoice(order)
+        self.assertFalse(default_storage.exists(old_name))
+
+        call_command('send_outbox', '--once', stdout=StringIO())
+        self.assertEqual(OutboundEmail.objects.get().status, 'sent')
+        with default_storage.open(new_name, 'rb') as f:
+            self.assertEqual(mail.outbox[0].attachments[0][1], f.read())
+
+    def test_missing_file_is_rendered_again(self):
+        """Test a stored invoice whose file is gone is rendered again"""
+        self.download()
+        self.order.refresh_from_db()
+        default_storage.delete(self.order.invoice_pdf.name)
+        self.download()
+        self.assertEqual(self.render.call_count, 2)
+
+    def test_busy_invoice_returns_503(self):
+        """Test a download gives up with 503 while another render holds the lock"""
+        with mock.patch('app_backend.invoices.single_flight', side_effect=LockTimeout('invoice')):
+            response = self.client.get(f'/api/orders/{self.order.id}/invoice/?user={self.user.id}')
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response['Retry-After'], '5')
+
+    def test_single_flight_runs_work_once(self):
+        """Test concurrent callers of single_flight do the work once"""
+        done = []
+        calls = []
+        barrier = threading.Barrier(8)
+
+        def worker():
+            barrier.wait()
+            with single_flight('test-work', wait=5, poll_interval=0.01):
+                if not done:
+                    calls.append(1)
+                    time.sleep(0.05)
+                    done.append(True)
+
+        threads = [threading.Thread(target=worker) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+
+    def test_single_flight_times_out(self):
+        """Test waiting for a held lock raises LockTimeout"""
+        with single_flight('held'):
+            with self.assertRaises(LockTimeout):
+                with single_flight('held', wait=0.05, poll_interval=0.01):
+                    pass
+
+class InvoiceRenderingTest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='buyer', password='x', first_name='Ada', last_name='Lovelace')
+        self.product = Product.objects.create(
+            title="Test Product",
+            model="Test Model",
+            serial_number="REN1",
+            description="Test Description",
+            quantity_in_stock=100,
+            price=Decimal('10.00')
+        )
+
+    def make_order(self, count):
+        order = Order.objects.create(user=self.user, status='delivered', total_price=Decimal('10.00') * count)
+        OrderItem.objects.bulk_create(
+            OrderItem(order=order, product=self.product, quantity=1, price_at_purchase=10)
+            for _ in range(count)
+        )
+        return order
+
+    def page_count(self, pdf):
+        return len(re.findall(rb'/Type /Page\b', pdf.getvalue()))
+
+    def test_line_items_paginate(self):
+        """Test long orders continue on new pages"""
+        self.assertEqual(self.page_count(generate_invoice_pdf(self.make_order(1))), 1)
+        self.assertEqual(self.page_count(generate_invoice_pdf(self.make_order(26))), 1)
+        self.assertEqual(self.page_count(generate_invoice_pdf(self.make_order(27))), 2)
+        self.assertEqual(self.page_count(generate_invoice_pdf(self.make_order(200))), 7)
+
+    def test_static_layout_built_once(self):
+        """Test every invoice reuses the cached static layout"""
+        generate_invoice_pdf(self.make_order(1))
+        with mock.patch('app_backend.invoices.InvoiceTemplate', wraps=InvoiceTemplate) as template:
+            pdf = generate_invoice_pdf(self.make_order(60))
+        template.assert_not_called()
+        self.assertTrue(pdf.getvalue().startswith(b'%PDF'))
+
+    def test_benchmark_command(self):
+        """Test benchmark_invoices reports a rate per order size"""
+        out = StringIO()
+        call_command('benchmark_invoices', '--items', '1', '10', '--duration', '0.01', stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertIn("1 items:", lines[0])
+        self.assertIn("invoices/s", lines[1])
+
+
+class InvoiceExportTest(APITestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.staff = User.objects.create_user(username='manager', password='x', is_staff=True)
+        self.buyer = User.objects.create_user(username='buyer', password='x')
+        product = Product.objects.create(
+            title="Test Product",
+            model="Test Model",
+            serial_number="EXP1",
+            description="Test Description",
+            quantity_in_stock=10,
+            price=Decimal('10.00')
+        )
+        self.orders = []
+        for day, order_status in [(1, 'delivered'), (15, 'refunded'), (28, 'delivered')]:
+            order = Order.objects.create(user=self.buyer, status=order_status, total_price=10)
+            OrderItem.objects.create(order=order, product=product, quantity=1, price_at_purchase=10)
+            Order.objects.filter(pk=order.pk).update(
+                created_at=timezone.make_aware(datetime(2025, 3, day, 12))
+            )
+            self.orders.append(order)
+        self.client.force_authenticate(user=self.staff)
+
+    def export(self, query=''):
+        response = self.client.get(f'/api/invoices/export/{query}')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        archive = zipfile.ZipFile(BytesIO(b''.join(response.streaming_content)))
+        return archive
+
+    def test_export_all(self):
+        """Test every invoice is in the archive"""
+        archive = self.export()
+        self.assertEqual(
+            archive.namelist(),
+            [f'invoice_order_{order.id}.pdf' for order in self.orders],
+        )
+        self.assertTrue(archive.read(archive.namelist()[0]).startswith(b'%PDF'))
+
+    def test_export_renders_in_process(self):
+        """Test the view doesn't fork a process pool inside the request"""
+        with mock.patch('app_backend.invoice_export.ProcessPoolExecutor') as pool:
+            archive = self.export()
+        self.assertEqual(len(archive.namelist()), 3)
+        pool.assert_not_called()
+
+    def test_export_filters(self):
+        """Test date range and status filters"""
+        archive = self.export('?from=2025-03-10&to=2025-03-31&status=delivered')
+        self.assertEqual(archive.namelist(), [f'invoice_order_{self.orders[2].id}.pdf'])
+
+    def test_export_reuses_current_invoices(self):
+        """Test stored invoices that are still current are not rendered again"""
+        ensure_invoice(Order.objects.get(pk=self.orders[0].pk))
+        with mock.patch('app_backend.invoice_export.generate_invoice_pdf', wraps=generate_invoice_pdf) as render:
+            self.export()
+        self.assertEqual(render.call_count, 2)
+
+    def test_export_requires_staff(self):
+        """Test customers can't export invoices"""
+        self.client.force_authenticate(user=self.buyer)
+        response = self.client.get('/api/invoices/export/')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_export_rejects_bad_filters(self):
+        """Test malformed dates and unknown statuses are rejected"""
+        self.assertEqual(self.client.get('/api/invoices/export/?from=March').status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get('/api/invoices/export/?status=lost').status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_export_command(self):
+        """Test export_invoices writes the archive to a file"""
+        path = os.path.join(self.media_root, 'export.zip')
+        out = StringIO()
+        call_command('export_invoices', path, '--status', 'refunded', '--workers', '1', stdout=out)
+        self.assertIn("Exported 1 invoices", out.getvalue())
+        with zipfile.ZipFile(path) as archive:
+            self.assertEqual(archive.namelist(), [f'invoice_order_{self.orders[1].id}.pdf'])
+
+class RefundOrderTest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='buyer', password='x', email='buyer@example.com')
+        self.products = [
+            Product.objects.create(
+                title=f"Product {i}",
+                model="Test Model",
+                serial_number=f"REF{i}",
+                description="Test Description",
+                quantity_in_stock=10,
+                price=Decimal('10.00')
+            )
+            for i in range(3)
+        ]
+
+    def make_order(self, lines, order_status='delivered'):
+        order = Order.objects.create(user=self.user, status=order_status, total_price=0)
+        OrderItem.objects.bulk_create(
+            OrderItem(order=order, product=product, quantity=quantity, price_at_purchase=price, discounted_price=discounted)
+            for product, quantity, price, discounted in lines
+        )
+        return order
+
+    def refund(self, order):
+        return self.client.post(f'/api/orders/{order.id}/refund/', {'user': self.user.id})
+
+    def test_refund_restocks_and_reports_amount(self):
+        """Test stock is restored and the refunded amount uses discounted prices"""
+        first, second, third = self.products
+        order = self.make_order([
+            (first, 2, Decimal('10.00'), None),
+            (second, 1, Decimal('10.00'), Decimal('7.50')),
+            (first, 3, Decimal('10.00'), None),
+            (third, 1, Decimal('4.00'), Decimal('0')),
+        ])
+        response = self.refund(order)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        order.refresh_from_db()
+        self.assertEqual(order.status, 'refunded')
+        stock = dict(Product.objects.values_list('id', 'quantity_in_stock'))
+        self.assertEqual(stock, {first.id: 15, second.id: 11, third.id: 11})
+        email = OutboundEmail.objects.get()
+        self.assertEqual(email.to, ['buyer@example.com'])
+        self.assertIn('Refunded Amount: $61.50.', email.body)
+
+    def test_refund_query_count_is_constant(self):
+        """Test refunding a large order takes as many queries as a small one"""
+        small = self.make_order([(self.products[0], 1, Decimal('10.00'), None)])
+        large = self.make_order([
+            (product, 1, Decimal('10.00'), None) for product in self.products * 5
+        ])
+        with CaptureQueriesContext(connection) as small_queries:
+            self.assertEqual(self.refund(small).status_code, status.HTTP_200_OK)
+        with CaptureQueriesContext(connection) as large_queries:
+            self.assertEqual(self.refund(large).status_code, status.HTTP_200_OK)
+        self.assertEqual(len(small_queries), len(large_queries))
+
+    def test_refund_only_once(self):
+        """Test a second refund is rejected and doesn't restock again"""
+        order = self.make_order([(self.products[0], 4, Decimal('10.00'), None)])
+        self.assertEqual(self.refund(order).status_code, status.HTTP_200_OK)
+        self.assertEqual(self.refund(order).status_code, status.HTTP_400_BAD_REQUEST)
+        self.products[0].refresh_from_db()
+        self.assertEqual(self.products[0].quantity_in_stock, 14)
+        self.assertEqual(OutboundEmail.objects.count(), 1)
+
+    def test_refund_requires_delivered_order(self):
+        """Test orders that weren't delivered can't be refunded"""
+        order = self.make_order([(self.products[0], 1, Decimal('10.00'), None)], order_status='in_transit')
+        self.assertEqual(self.refund(order).status_code, status.HTTP_400_BAD_REQUEST)
+        self.products[0].refresh_from_db()
+        self.assertEqual(self.products[0].quantity_in_stock, 10)
+
+
+@override_settings(ORDER_HISTORY_PAGE_SIZE=3)
+class OrderHistoryTest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='buyer', password='x')
+        self.product = Product.objects.create(
+            title="Test Product",
+            model="Test Model",
+            serial_number="HIS1",
+            description="Test Description",
+            quantity_in_stock=10,
+            price=Decimal('10.00')
+        )
+        # Two orders share a timestamp, so the id has to break the tie
+        self.orders = []
+        for day in (1, 2, 2, 3, 4):
+            order = Order.objects.create(user=self.user, status='delivered', total_price=10)
+            OrderItem.objects.create(order=order, product=self.product, quantity=1, price_at_purchase=10)
+            Order.objects.filter(pk=order.pk).update(
+                created_at=timezone.make_aware(datetime(2025, 3, day, 12))
+            )
+            self.orders.append(order)
+        other = User.objects.create_user(username='other', password='x')
+        Order.objects.create(user=other, total_price=10)
+
+    def history(self, query=''):
+        response = self.client.get(f'/api/orders/history/?user={self.user.id}{query}')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response
+
+    def test_history_pages_newest_first(self):
+        """Test the history is paged newest first with a cursor"""
+        first = self.history()
+        self.assertIn('X-Next-Cursor', first)
+        second = self.history(f"&cursor={first['X-Next-Cursor']}")
+        self.assertNotIn('X-Next-Cursor', second)
+        ids = [order['id'] for order in first.data + second.data]
+        expected = [order.id for order in reversed(self.orders)]
+        self.assertEqual(ids, expected)
+        self.assertEqual(len(first.data), 3)
+
+    def test_items_are_opt_in(self):
+        """Test line items are only returned with include=items"""
+        self.assertNotIn('items', self.history().data[0])
+        order = self.history('&include=items').data[0]
+        self.assertEqual(len(order['items']), 1)
+        self.assertEqual(order['items'][0]['product'], {
+            'id': self.product.id,
+            'title': "Test Product",
+            'image': f'http://testserver{self.product.image.url}',
+        })
+
+    def test_invoice_links_to_download(self):
+        """Test an order's invoice links to the download endpoint, not to media"""
+        Order.objects.filter(pk=self.orders[-1].pk).update(invoice_pdf='invoices/invoice_order_1.pdf')
+        first, second = self.history().data[:2]
+        self.assertEqual(
+            first['invoice_pdf'],
+            f'http://testserver/api/orders/{self.orders[-1].id}/invoice/?user={self.user.id}',
+        )
+        self.assertIsNone(second['invoice_pdf'])
+
+    def test_item_queries_are_constant(self):
+        """Test including items costs the same number of queries however many there are"""
+        with CaptureQueriesContext(connection) as few:
+            self.history('&include=items')
+        OrderItem.objects.bulk_create(
+            OrderItem(order=order, product=self.product, quantity=1, price_at_purchase=10)
+            for order in self.orders for _ in range(5)
+        )
+        with CaptureQueriesContext(connection) as many:
+            self.history('&include=items')
+        self.assertEqual(len(few), len(many))
+
+    def test_invalid_cursor(self):
+        """Test a malformed cursor is rejected"""
+        response = self.client.get(f'/api/orders/history/?user={self.user.id}&cursor=nope')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_tampered_cursor(self):
+        """Test a decodable cursor with a bad timestamp or id is rejected"""
+        for key, pk in [('abc', 1), (['2025-03-01'], 1), ('2025-13-45T00:00:00', 1), ('2025-03-01T12:00:00+00:00', 10 ** 30)]:
+            token = base64.urlsafe_b64encode(json.dumps({'s': 'newest', 'k': key, 'i': pk}).encode()).decode()
+            response = self.client.get(f'/api/orders/history/?user={self.user.id}&cursor={token}')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, key)
+
+    def test_cursor_round_trip(self):
+        """Test a cursor built from a real order timestamp is accepted"""
+        last = self.orders[2]
+        last.refresh_from_db()
+        token = base64.urlsafe_b64encode(
+            json.dumps({'s': 'newest', 'k': str(last.created_at), 'i': last.id}).encode()
+        ).decode()
+        ids = [order['id'] for order in self.history(f'&cursor={token}').data]
+        self.assertEqual(ids, [self.orders[1].id, self.orders[0].id])
+
+
+class OrderStatusTransitionTest(APITestCase):
+    def setUp(self):
+        self.staff = User.objects.create_user(username='manager', password='x', is_staff=True)
+        self.buyer = User.objects.create_user(username='buyer', password='x', email='buyer@example.com')
+        self.client.force_authenticate(user=self.staff)
+
+    def make_orders(self, count, order_status='processing'):
+        return [
+            Order.objects.create(user=self.buyer, status=order_status, total_price=10).id
+            for _ in range(count)
+        ]
+
+    def transition(self, order_ids, to_status):
+        return self.client.post(
+            '/api/orders/status/', {'order_ids': order_ids, 'status': to_status}, format='json'
+        )
+
+    def test_transition_reports_each_order(self):
+        """Test allowed orders move and the others are reported per id"""
+        processing = self.make_orders(2)
+        delivered = self.make_orders(1, 'delivered')
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.transition(processing + delivered + [999999], 'in_transit')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['updated'], 2)
+        results = {result['id']: result for result in response.data['results']}
+        self.assertTrue(results[processing[0]]['success'])
+        self.assertFalse(results[delivered[0]]['success'])
+        self.assertIn('delivered', results[delivered[0]]['error'])
+        self.assertEqual(results[999999]['error'], 'Order not found')
+        statuses = dict(Order.objects.values_list('id', 'status'))
+        self.assertEqual(statuses[processing[1]], 'in_transit')
+        self.assertEqual(statuses[delivered[0]], 'delivered')
+
+    def test_orders_cannot_skip_a_step(self):
+        """Test processing orders can't be marked delivered directly"""
+        order_ids = self.make_orders(1)
+        response = self.transition(order_ids, 'delivered')
+        self.assertEqual(response.data['updated'], 0)
+        self.assertEqual(Order.objects.get(pk=order_ids[0]).status, 'processing')
+
+    def test_event_sent_once_after_commit(self):
+        """Test one status change event per batch, only once the transaction commits"""
+        order_ids = self.make_orders(3)
+        handler = mock.Mock()
+        order_status_changed.connect(handler)
+        self.addCleanup(order_status_changed.disconnect, handler)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.transition(order_ids, 'in_transit')
+            handler.assert_not_called()
+        handler.assert_called_once()
+        self.assertEqual(handler.call_args.kwargs['order_ids'], order_ids)
+        self.assertEqual(handler.call_args.kwargs['status'], 'in_transit')
+        emails = OutboundEmail.objects.all()
+        self.assertEqual(len(emails), 3)
+        self.assertEqual(emails[0].to, ['buyer@example.com'])
+
+    def test_query_count_is_constant(self):
+        """Test a large batch takes as many queries as a small one"""
+        few, many = self.make_orders(2), self.make_orders(40)
+        with CaptureQueriesContext(connection) as few_queries:
+            self.transition(few, 'in_transit')
+        with CaptureQueriesContext(connection) as many_queries:
+            self.transition(many, 'in_transit')
+        self.assertEqual(len(few_queries), len(many_queries))
+
+    def test_invalid_requests(self):
+        """Test unknown statuses, bad ids and oversized batches are rejected"""
+        order_ids = self.make_orders(1)
+        self.assertEqual(self.transition(order_ids, 'cancelled').status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.transition([], 'in_transit').status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.transition(['x'], 'in_transit').status_code, status.HTTP_400_BAD_REQUEST)
+        with override_settings(ORDER_STATUS_BATCH_MAX=2):
+            self.assertEqual(self.transition([1, 2, 3], 'in_transit').status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_malformed_status(self):
+        """Test a missing or non-string status is rejected, not a server error"""
+        order_ids = self.make_orders(1)
+        for to_status in [None, ['in_transit'], {'in_transit': 1}, 1]:
+            response = self.transition(order_ids, to_status)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, to_status)
+        self.assertEqual(self.transition([10 ** 30], 'in_transit').status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Order.objects.get(pk=order_ids[0]).status, 'processing')
+
+    def test_requires_staff(self):
+        """Test customers can't change order statuses"""
+        self.client.force_authenticate(user=self.buyer)
+        response = self.transition(self.make_orders(1), 'in_transit')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class StockReservationTest(APITestCase):
+    def setUp(self):
+        self.buyer = User.objects.create_user(username='buyer', password='x')
+        self.rival = User.objects.create_user(username='rival', password='x')
+        self.products = [
+            Product.objects.create(
+                title=f"Product {i}",
+                model="Test Model",
+                serial_number=f"HOLD{i}",
+                description="Test Description",
+                quantity_in_stock=5,
+                price=Decimal('10.00')
+            )
+            for i in range(2)
+        ]
+
+    def hold(self, user, items):
+        return self.client.post('/api/reservations/', {
+            'user': user.id,
+            'items': [{'product': product.id, 'quantity': quantity} for product, quantity in items],
+        }, format='json')
+
+    def order(self, user, items):
+        return self.client.post('/api/orders/', {
+            'user': user.id,
+            'delivery_address': "Test Address",
+            'order_items': [
+                {'product': product.id, 'quantity': quantity, 'price_at_purchase': "10.00"}
+                for product, quantity in items
+            ],
+        }, format='json')
+
+    def stock(self, product):
+        product.refresh_from_db()
+        return product.quantity_in_stock, product.reserved_quantity
+
+    def test_hold_reserves_stock(self):
+        """Test a hold takes stock out of what others can reserve"""
+        first, second = self.products
+        self.assertEqual(self.hold(self.buyer, [(first, 4)]).status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.stock(first), (5, 4))
+        # All or nothing: the second product isn't held either
+        response = self.hold(self.rival, [(second, 1), (first, 2)])
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertIn("Product 0 (available: 1)", response.data['error'])
+        self.assertEqual(self.stock(second), (5, 0))
+        self.assertEqual(StockReservation.objects.filter(user=self.rival).count(), 0)
+
+    def test_new_hold_replaces_previous(self):
+        """Test holding again replaces the user's holds instead of adding to them"""
+        first, second = self.products
+        self.hold(self.buyer, [(first, 3)])
+        self.assertEqual(self.hold(self.buyer, [(first, 2), (second, 1)]).status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.stock(first), (5, 2))
+        self.assertEqual(self.stock(second), (5, 1))
+
+    def test_order_converts_holds(self):
+        """Test ordering turns the buyer's holds into the sale"""
+        first = self.products[0]
+        self.hold(self.buyer, [(first, 5)])
+        # Nobody else can buy the held stock
+        self.assertEqual(self.order(self.rival, [(first, 1)]).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.order(self.buyer, [(first, 5)]).status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.stock(first), (0, 0))
+        self.assertFalse(StockReservation.objects.exists())
+
+    def test_order_beyond_hold_uses_unreserved_stock(self):
+        """Test a buyer can order more than they held if the rest is unreserved"""
+        first = self.products[0]
+        self.hold(self.buyer, [(first, 1)])
+        self.hold(self.rival, [(first, 2)])
+        self.assertEqual(self.order(self.buyer, [(first, 4)]).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.order(self.buyer, [(first, 3)]).status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.stock(first), (2, 2))
+
+    def test_release(self):
+        """Test DELETE releases the user's holds"""
+        first = self.products[0]
+        self.hold(self.buyer, [(first, 3)])
+        response = self.client.delete(f'/api/reservations/?user={self.buyer.id}')
+        self.assertEqual(response.data, {'released': 1})
+        self.assertEqual(self.stock(first), (5, 0))
+
+    def test_sweeper_releases_expired_holds(self):
+        """Test the sweeper releases expired holds in batches and keeps live ones"""
+        first, second = self.products
+        self.hold(self.buyer, [(first, 2), (second, 1)])
+        self.hold(self.rival, [(first, 1)])
+        StockReservation.objects.filter(user=self.buyer).update(expires_at=timezone.now() - timedelta(seconds=1))
+        out = StringIO()
+        call_command('release_expired_reservations', '--once', '--batch-size', '1', stdout=out)
+        self.assertIn("Released 2 expired holds", out.getvalue())
+        self.assertEqual(self.stock(first), (5, 1))
+        self.assertEqual(self.stock(second), (5, 0))
+
+    def test_racing_releases_give_stock_back_once(self):
+        """Test a hold deleted by a concurrent release isn't given back twice"""
+        first, second = self.products
+        self.hold(self.buyer, [(first, 2), (second, 1)])
+        self.hold(self.rival, [(first, 1)])
+        StockReservation.objects.filter(user=self.buyer).update(expires_at=timezone.now() - timedelta(seconds=1))
+        delete = reservations._delete
+
+        def checkout_wins(rows):
+            # Another release takes the first hold between the sweep's read and its delete
+            StockReservation.objects.filter(user=self.buyer, product=first).delete()
+            Product.objects.release({first.id: 2})
+            return delete(rows)
+
+        with mock.patch('app_backend.reservations._delete', side_effect=checkout_wins):
+            self.assertEqual(reservations.release_expired_holds(10), 1)
+        self.assertEqual(self.stock(first), (5, 1))
+        self.assertEqual(self.stock(second), (5, 0))
+
+    def test_invalid_requests(self):
+        """Test missing users and malformed items are rejected"""
+        response = self.client.post('/api/reservations/', {'items': []}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.hold(self.buyer, []).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.hold(self.buyer, [(self.products[0], 0)]).status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_out_of_range_product(self):
+        """Test product ids that aren't positive or don't fit the id column are rejected"""
+        for product_id in [10 ** 30, 2 ** 63, 0, -1]:
+            response = self.client.post('/api/reservations/', {
+                'user': self.buyer.id,
+                'items': [{'product': product_id, 'quantity': 1}],
+            }, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, product_id)
+        self.assertFalse(StockReservation.objects.exists())
+
+    def test_out_of_range_quantity(self):
+        """Test quantities, alone or summed over lines, that don't fit the column are rejected"""
+        product = self.products[0]
+        self.assertEqual(self.hold(self.buyer, [(product, 10 ** 30)]).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(
+            self.hold(self.buyer, [(product, 2 ** 62), (product, 2 ** 62)]).status_code,
+            status.HTTP_400_BAD_REQUEST,
+        )
+        self.assertEqual(self.stock(product), (5, 0))
+
+
+class StockLedgerTest(APITestCase):
+    def setUp(self):
+        self.staff = User.objects.create_user(username='manager', password='x', is_staff=True)
+        self.buyer = User.objects.create_user(username='buyer', password='x')
+        self.product = Product.objects.create(
+            title="Test Product",
+            model="Test Model",
+            serial_number="LED1",
+            description="Test Description",
+            quantity_in_stock=10,
+            price=Decimal('10.00')
+        )
+
+    def at(self, day):
+        return timezone.make_aware(datetime(2025, 3, day, 12))
+
+    def backdate(self, day):
+        """Move every movement so far to day"""
+        StockMovement.objects.update(created_at=self.at(day))
+
+    def order(self, quantity):
+        response = self.client.post('/api/orders/', {
+            'user': self.buyer.id,
+            'delivery_address': "Test Address",
+            'order_items': [{'product': self.product.id, 'quantity': quantity, 'price_at_purchase': "10.00"}],
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return Order.objects.get(pk=response.data['order']['id'])
+
+    def movements(self):
+        return list(StockMovement.objects.order_by('id').values_list('change', 'reason'))
+
+    def test_every_change_is_recorded(self):
+        """Test creation, edits, sales and refunds each append a movement"""
+        self.product = Product.objects.get(pk=self.product.pk)
+        self.product.quantity_in_stock = 15
+        self.product.save()
+        self.product.title = "Renamed"
+        self.product.save()
+        order = self.order(4)
+        Order.objects.filter(pk=order.pk).update(status='delivered')
+        self.client.post(f'/api/orders/{order.id}/refund/', {'user': self.buyer.id})
+        self.assertEqual(self.movements(), [
+            (10, 'adjustment'), (5, 'adjustment'), (-4, 'sale'), (4, 'refund'),
+        ])
+        self.assertEqual(StockMovement.objects.get(reason='sale').order, order)
+
+    def test_stock_as_of(self):
+        """Test past stock levels from snapshots plus the movements after them"""
+        self.backdate(1)
+        self.order(3)
+        self.backdate(1)
+        self.assertEqual(compact(cutoff=self.at(2)), 1)
+        self.order(2)
+        StockMovement.objects.filter(reason='sale', created_at__gt=self.at(2)).update(created_at=self.at(5))
+        self.assertEqual(stock_as_of(self.product.id, self.at(3)), 7)
+        self.assertEqual(stock_as_of(self.product.id, self.at(6)), 5)
+        # Before the first snapshot it is worked back from the current stock
+        self.assertEqual(stock_as_of(self.product.id, self.at(1) - timedelta(hours=1)), 0)
+
+    def test_compaction_only_snapshots_moved_products(self):
+        """Test compaction skips products that haven't moved since their last snapshot"""
+        self.backdate(1)
+        self.assertEqual(compact(cutoff=self.at(2)), 1)
+        self.assertEqual(compact(cutoff=self.at(3)), 0)
+        self.order(1)
+        self.assertEqual(compact(cutoff=timezone.now() + timedelta(seconds=1)), 1)
+        latest = StockSnapshot.objects.order_by('-taken_at').first()
+        self.assertEqual(latest.quantity, 9)
+
+    def test_first_snapshot_covers_stock_from_before_the_ledger(self):
+        """Test stock that was never recorded gets a baseline snapshot"""
+        Product.objects.filter(pk=self.product.pk).update(quantity_in_stock=40)
+        StockMovement.objects.all().delete()
+        compact(cutoff=timezone.now())
+        self.assertEqual(StockSnapshot.objects.get().quantity, 40)
+        self.assertEqual(reconcile(), [])
+
+    def test_check_reports_drift(self):
+        """Test compact_stock_ledger --check lists stock that doesn't match the ledger"""
+        self.backdate(1)
+        compact(cutoff=self.at(2))
+        # Stock changed without going through the ledger
+        Product.objects.filter(pk=self.product.pk).update(quantity_in_stock=8)
+        out = StringIO()
+        call_command('compact_stock_ledger', '--check', stdout=out)
+        self.assertIn("Wrote 0 stock snapshots", out.getvalue())
+        self.assertIn(f"Product {self.product.id}: quantity_in_stock is 8, the ledger says 10", out.getvalue())
+
+    def test_stock_endpoint(self):
+        """Test staff can read stock as of a date with the movements in a range"""
+        self.backdate(1)
+        self.order(3)
+        self.client.force_authenticate(user=self.staff)
+        response = self.client.get(f'/api/products/{self.product.id}/stock/?at=2025-03-02')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['quantity'], 10)
+        self.assertEqual(response.data['quantity_in_stock'], 7)
+        response = self.client.get(f'/api/products/{self.product.id}/stock/?from=2025-03-02')
+        self.assertEqual(response.data['quantity'], 7)
+        self.assertEqual([movement['change'] for movement in response.data['movements']], [-3])
+        response = self.client.get(f'/api/products/{self.product.id}/stock/?at=yesterday')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_stock_endpoint_requires_staff(self):
+        """Test customers can't read the stock ledger"""
+        self.client.force_authenticate(user=self.buyer)
+        response = self.client.get(f'/api/products/{self.product.id}/stock/')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class IdempotencyTest(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='buyer', password='x', email='buyer@example.com')
+        self.product = Product.objects.create(
+            title="Product",
+            model="Test Model",
+            serial_number="IDEM1",
+            description="Test Description",
+            quantity_in_stock=10,
+            price=Decimal('10.00')
+        )
+
+    def order(self, key=None, quantity=2):
+        headers = {'HTTP_IDEMPOTENCY_KEY': key} if key is not None else {}
+        return self.client.post('/api/orders/', {
+            'user': self.user.id,
+            'delivery_address': "Test Address",
+            'order_items': [{'product': self.product.id, 'quantity': quantity, 'price_at_purchase': "10.00"}],
+        }, format='json', **headers)
+
+    def test_retry_replays_response(self):
+        """Test a retried checkout returns the first response without ordering again"""
+        first = self.order('checkout-1')
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        retry = self.order('checkout-1')
+        self.assertEqual(retry.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(json.loads(retry.content), first.json())
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(Job.objects.count(), 1)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.quantity_in_stock, 8)
+
+    def test_requests_without_key_are_not_deduplicated(self):
+        """Test requests without the header behave as before"""
+        self.assertEqual(self.order().status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.order().status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Order.objects.count(), 2)
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+    def test_key_reused_for_different_request(self):
+        """Test a key sent with a different body is rejected"""
+        self.assertEqual(self.order('checkout-1').status_code, status.HTTP_201_CREATED)
+        response = self.order('checkout-1', quantity=3)
+        self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_key_in_progress(self):
+        """Test a retry while the first request is still running gets 409"""
+        IdempotencyKey.objects.create(
+            key='checkout-1', fingerprint='x', locked_until=timezone.now() + timedelta(minutes=1),
+            expires_at=timezone.now() + timedelta(days=1),
+        )
+        response = self.order('checkout-1')
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertFalse(Order.objects.exists())
+
+    def test_abandoned_and_expired_keys_are_reused(self):
+        """Test keys whose request died or expired can be used again"""
+        now = timezone.now()
+        IdempotencyKey.objects.create(
+            key='abandoned', fingerprint='x', locked_until=now - timedelta(seconds=1),
+            expires_at=now + timedelta(days=1),
+        )
+        IdempotencyKey.objects.create(
+            key='expired', fingerprint='x', status_code=201, response_body='{}',
+            expires_at=now - timedelta(seconds=1),
+        )
+        self.assertEqual(self.order('abandoned').status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.order('expired').status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Order.objects.count(), 2)
+
+    def test_client_errors_are_replayed(self):
+        """Test a rejected order is replayed rather than run again"""
+        self.assertEqual(self.order('checkout-1', quantity=11).status_code, status.HTTP_400_BAD_REQUEST)
+        self.product.quantity_in_stock = 20
+        self.product.save()
+        response = self.order('checkout-1', quantity=11)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response['Idempotent-Replayed'], 'true')
+        self.assertFalse(Order.objects.exists())
+
+    def test_server_errors_are_not_stored(self):
+        """Test a request that failed with a server error runs again on retry"""
+        with mock.patch('app_backend.views.enqueue_invoice', side_effect=RuntimeError), \
+                self.assertLogs('app_backend.views', 'ERROR') as logs:
+            response = self.order('checkout-1')
+        self.assertIn('Order creation failed', logs.output[0])
+        self.assertEqual(response.status_code, status.HTTP_500_INTERNAL_SERVER_ERROR)
+        self.assertFalse(IdempotencyKey.objects.exists())
+        self.assertEqual(self.order('checkout-1').status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_retry_after_conflict_runs_again(self):
+        """Test a checkout that got a retryable 409 can be retried with the same key"""
+        def sold_elsewhere(queryset, quantities, held=None):
+            return 0
+
+        with mock.patch.object(ProductQuerySet, 'take_stock', sold_elsewhere):
+            self.assertEqual(self.order('checkout-1').status_code, status.HTTP_409_CONFLICT)
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+        response = self.order('checkout-1')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertNotIn('Idempotent-Replayed', response)
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(self.order('checkout-1')['Idempotent-Replayed'], 'true')
+
+    def test_refund_retry(self):
+        """Test a retried refund replays its success and restocks once"""
+        order = Order.objects.create(user=self.user, status='delivered', total_price=Decimal('20.00'))
+        OrderItem.objects.create(order=order, product=self.product, quantity=2, price_at_purchase=Decimal('10.00'))
+        for _ in range(2):
+            response = self.client.post(
+                f'/api/orders/{order.id}/refund/', {'user': self.user.id}, HTTP_IDEMPOTENCY_KEY='refund-1',
+            )
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.quantity_in_stock, 12)
+        self.assertEqual(OutboundEmail.objects.count(), 1)
+
+    def test_key_length(self):
+        """Test an oversized key is rejected"""
+        self.assertEqual(self.order('k' * 256).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Order.objects.exists())
+
+    def test_purge_command(self):
+        """Test purge_idempotency_keys deletes only expired keys"""
+        now = timezone.now()
+        for i, expires_at in enumerate([now - timedelta(hours=1), now - timedelta(seconds=1), now + timedelta(hours=1)]):
+            IdempotencyKey.objects.create(key=f'key-{i}', fingerprint='x', status_code=200, expires_at=expires_at)
+        out = StringIO()
+        call_command('purge_idempotency_keys', '--batch-size', '1', stdout=out)
+        self.assertIn('Purged 2', out.getvalue())
+        self.assertEqual(list(IdempotencyKey.objects.values_list('key', flat=True)), ['key-2'])
+
+
 class OrderAPITest(APITestCase):
     def setUp(self):
         self.user = User.objects.create_user(
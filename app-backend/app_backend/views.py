@@ -1,12 +1,10 @@
-from io import BytesIO
-from reportlab.pdfgen import canvas
-from django.core.mail import EmailMessage, send_mail
-from django.core.files.base import ContentFile
 from django.shortcuts import render, get_object_or_404, redirect
-from django.http import HttpResponse, FileResponse
-from django.db.models import Q, Avg, Sum, Count
+from django.http import HttpResponse, FileResponse, Http404, StreamingHttpResponse
+from django.db.models import Q, Avg, Sum, Count, Max, F, Prefetch, Value
+from django.db.models.functions import Coalesce, NullIf
 from django.contrib.auth.decorators import login_required
 from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
 from django.conf import settings
 from django.dispatch import receiver
 from django.contrib.auth.signals import user_logged_in
@@ -18,52 +16,336 @@ from rest_framework import status
 from rest_framework.views import APIView
 from rest_framework.generics import ListAPIView, RetrieveAPIView
 from .permissions import IsStaff
-from django.db import models
-import smtplib
+from .pagination import KeysetPagination, SearchPagination, OrderHistoryPagination, InvalidCursor
+from .search import search_product_ids
+from .cache import cache_catalog_response, catalog_cache_key, cached_for_catalog
+from .filters import ProductFilters, parse_bool
+from .streaming import wants_stream, streaming_json_response, serializer_chunk_renderer
+from .documents import render_documents, render_document, PrerenderedResponse
+from .media import serve_file, PRIVATE_CACHE_CONTROL
+from .tasks import enqueue_invoice
+from .invoices import ensure_invoice, InvoiceBusy
+from .invoice_export import export_order_ids, iter_invoices, parse_export_filters, stream_invoice_zip
+from .outbox import queue_email
+from .order_status import TRANSITIONS, transition_orders
+from .reservations import InsufficientStock, claim_holds, hold_stock, release_user_holds
+from .ledger import record_movements, stock_as_of
+from .idempotency import idempotent
+from django.core.cache import cache
+from django.db import models, transaction
 from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import condition
 from .models import (
     Product,  Order, OrderItem, Rating,
     Comment,    
-    Category,   )
+    Category,   StockMovement, refresh_product_caches)
 from django.contrib.auth.models import User
 from .serializers import (
-    OrderSerializer,  
+    OrderHistorySerializer, ProductSnapshotSerializer,
     ProductSerializer,   
     CategorySerializer,   UserCreateSerializer,
     UserSerializer, UserUpdateSerializer,RatingSerializer,CommentSerializer
 )
 from django.utils.crypto import get_random_string
-from datetime import timedelta
+from datetime import datetime, timedelta
 import os
-from decimal import Decimal
-import smtplib
+import posixpath
+import hashlib
+import json
+import logging
+from decimal import Decimal, InvalidOperation
 from dotenv import load_dotenv
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # --- Home View ---
 def home(request):
     return HttpResponse("Welcome to the backend API. Everything is running!")
 
+# --- Conditional GET (ETag / Last-Modified) ---
+def conditional_state(compute, catalog=False):
+    """
+    Build the etag_func/last_modified_func pair for django's condition()
+    decorator. compute(request, *args, **kwargs) returns (version, last_modified)
+    for whatever the view would render and is only called once per request.
+    With catalog=True the result is also cached under the catalog version, so
+    warm requests are answered without touching the database.
+    """
+    def validators(request, *args, **kwargs):
+        version, last_modified = compute(request, *args, **kwargs)
+        if version is None:
+            return None, None
+        variant = '|'.join([
+            request.get_host(),
+            request.get_full_path(),
+            request.META.get('HTTP_ACCEPT', ''),
+            version,
+        ])
+        return hashlib.sha1(variant.encode()).hexdigest(), last_modified
+
+    def state(request, *args, **kwargs):
+        if not hasattr(request, '_conditional_state'):
+            if catalog:
+                request._conditional_state = cache.get_or_set(
+                    catalog_cache_key(request) + ':validators',
+                    lambda: validators(request, *args, **kwargs),
+                    getattr(settings, 'CATALOG_CACHE_TIMEOUT', 300),
+                )
+            else:
+                request._conditional_state = validators(request, *args, **kwargs)
+        return request._conditional_state
+
+    return {
+        'etag_func': lambda request, *args, **kwargs: state(request, *args, **kwargs)[0],
+        'last_modified_func': lambda request, *args, **kwargs: state(request, *args, **kwargs)[1],
+    }
+
+def _latest(*timestamps):
+    return max((t for t in timestamps if t is not None), default=None)
+
+def _fits_id_column(pk):
+    # Larger ids overflow the database's integer columns
+    return 0 <= pk < 2 ** 63
+
+def product_list_state(request):
+    products = Product.objects.aggregate(count=Count('id'), last=Max('updated_at'))
+    categories = Category.objects.aggregate(count=Count('id'), last=Max('updated_at'))
+    version = f"{products['count']}:{products['last']}:{categories['count']}:{categories['last']}"
+    return version, _latest(products['last'], categories['last'])
+
+def product_detail_state(request, id):
+    if not _fits_id_column(id):
+        return None, None
+    row = Product.objects.filter(id=id).values_list('updated_at', 'category__updated_at').first()
+    if row is None:
+        return None, None
+    return f'{row[0]}:{row[1]}', _latest(*row)
+
+def category_list_state(request):
+    categories = Category.objects.aggregate(count=Count('id'), last=Max('updated_at'))
+    return f"{categories['count']}:{categories['last']}", categories['last']
+
+def product_comments_state(request, product_id):
+    # No validators for ids the database can't hold, the view answers those
+    if not _fits_id_column(product_id):
+        return None, None
+    comments = Comment.objects.filter(product_id=product_id, approved=True).aggregate(
+        count=Count('id'), last=Max('updated_at')
+    )
+    product_updated = Product.objects.filter(id=product_id).values_list('updated_at', flat=True).first()
+    version = f"{comments['count']}:{comments['last']}:{product_updated}"
+    return version, _latest(comments['last'], product_updated)
+
+def document_kind(request, fields):
+    """
+    Which stored ProductDocument body (see documents.py) can answer this
+    request as is, or None when it has to go through the serializer.
+    """
+    if request.accepted_renderer.format != 'json':
+        return None
+    if fields is None:
+        return 'full'
+    if fields == ProductSerializer.SUMMARY_FIELDS:
+        return 'summary'
+    return None
+
+def product_queryset(request, fields, columns=()):
+    """
+    Queryset to load products for rendering with the given serializer
+    fields, and the stored document kind to render them from (if any).
+    """
+    kind = document_kind(request, fields)
+    if kind:
+        return Product.objects.with_document(kind, columns), kind
+    if fields is None:
+        return Product.objects.catalog(), None
+    return Product.objects.catalog(ProductSerializer.columns_for(fields) + list(columns)), None
+
+def stream_products(request, fields):
+    queryset, kind = product_queryset(request, fields)
+    if kind:
+        render_chunk = lambda products: render_documents(request, products, kind)
+    else:
+        render_chunk = serializer_chunk_renderer(
+            ProductSerializer, fields=fields, context={'request': request}
+        )
+    return streaming_json_response(queryset.order_by('id'), render_chunk)
+
+def product_list_response(request, products, fields, kind):
+    if kind:
+        return PrerenderedResponse(render_documents(request, products, kind))
+    serializer = ProductSerializer(products, many=True, fields=fields, context={'request': request})
+    return Response(serializer.data)
+
+@condition(**conditional_state(product_list_state, catalog=True))
+@cache_catalog_response
 @api_view(['GET'])
 @permission_classes([AllowAny])
 def get_all_products(request):
     """
-    Get all products.
+    Get all products, one page at a time.
+
+    Query params:
+        sort: id (default), price, -price, title, -title or newest
+        page_size: number of products per page (capped by PRODUCT_MAX_PAGE_SIZE)
+        cursor: value of the X-Next-Cursor header from the previous page
+        fields: comma separated product fields, or 'all' for the full
+                representation (default: ProductSerializer.SUMMARY_FIELDS)
+        stream: true to stream the whole catalog, unpaginated, for exports
     """
-    products = Product.objects.all()
-    serializer = ProductSerializer(products, many=True, context={'request': request})
-    return Response(serializer.data)
+    try:
+        fields = ProductSerializer.parse_fields(
+            request.query_params.get('fields'),
+            default=ProductSerializer.SUMMARY_FIELDS,
+        )
+        if wants_stream(request):
+            return stream_products(request, fields)
+        paginator = KeysetPagination(request)
+        queryset, kind = product_queryset(request, fields, [paginator.sort_field])
+        products = paginator.paginate_queryset(queryset)
+    except (ValueError, InvalidCursor) as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    return paginator.add_headers(product_list_response(request, products, fields, kind))
 
+@condition(**conditional_state(product_list_state, catalog=True))
+@cache_catalog_response
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def list_products(request):
+    """
+    Filtered product listing.
+
+    Query params:
+        ids: comma separated product ids to fetch in one go; see get_products_by_ids
+        category, min_price, max_price, in_stock, warranty: see ProductFilters
+        facets: true to wrap the page as {"results": [...], "facets": {...}}
+                with product counts for each filter value
+        sort, page_size, cursor, fields: as for /api/products/all/
+    """
+    if 'ids' in request.query_params:
+        return get_products_by_ids(request)
+    try:
+        filters = ProductFilters(request.query_params)
+        fields = ProductSerializer.parse_fields(
+            request.query_params.get('fields'),
+            default=ProductSerializer.SUMMARY_FIELDS,
+        )
+        with_facets = parse_bool('facets', request.query_params.get('facets', 'false'))
+        paginator = KeysetPagination(request)
+        queryset, kind = product_queryset(request, fields, [paginator.sort_field])
+        products = paginator.paginate_queryset(filters.apply(queryset))
+    except (ValueError, InvalidCursor) as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    response = product_list_response(request, products, fields, kind)
+    if with_facets:
+        facets = cached_for_catalog('facets:' + filters.cache_key(), filters.facet_counts)
+        response = Response({'results': response.data, 'facets': facets})
+    return paginator.add_headers(response)
+
+def get_products_by_ids(request):
+    """
+    Fetch many products at once for the cart, wishlist and order pages:
+    GET /api/products/?ids=3,1,2 returns {"results": [...], "missing": [...]}
+    with results in the requested order and any unknown ids under missing.
+    """
+    try:
+        ids = list(dict.fromkeys(
+            int(pk) for pk in request.query_params['ids'].split(',') if pk.strip()
+        ))
+        # Larger ids overflow the database's integer columns
+        if any(not 0 <= pk < 2 ** 63 for pk in ids):
+            raise ValueError
+    except ValueError:
+        return Response(
+            {'error': "'ids' must be a comma separated list of product ids"},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    try:
+        fields = ProductSerializer.parse_fields(
+            request.query_params.get('fields'),
+            default=ProductSerializer.SUMMARY_FIELDS,
+        )
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    limit = getattr(settings, 'PRODUCT_MAX_PAGE_SIZE', 200)
+    if len(ids) > limit:
+        return Response(
+            {'error': f'At most {limit} ids can be requested at once'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    queryset, kind = product_queryset(request, fields)
+    found = queryset.in_bulk(ids)
+    products = [found[pk] for pk in ids if pk in found]
+    missing = [pk for pk in ids if pk not in found]
+    if kind:
+        body = render_documents(request, products, kind)
+        return PrerenderedResponse(
+            b'{"results":' + body + b',"missing":' + json.dumps(missing).encode() + b'}'
+        )
+    serializer = ProductSerializer(products, many=True, fields=fields, context={'request': request})
+    return Response({'results': serializer.data, 'missing': missing})
+
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def search_products(request):
+    """
+    Full-text search over product title, model, description and category name.
+    Every word of the query is matched as a prefix and results are ranked by
+    relevance (bm25).
+
+    Query params:
+        q (or query): the search text
+        category, min_price, max_price, in_stock, warranty: as for
+            /api/products/ (see filters.ProductFilters)
+        page_size, cursor, fields: as for /api/products/all/
+    """
+    query = request.query_params.get('q') or request.query_params.get('query') or ''
+    try:
+        fields = ProductSerializer.parse_fields(
+            request.query_params.get('fields'),
+            default=ProductSerializer.SUMMARY_FIELDS,
+        )
+        filters = ProductFilters(request.query_params)
+        matching = filters.apply(Product.objects.all()) if filters.q() else None
+        paginator = SearchPagination(request)
+        ids = paginator.paginate_search(
+            lambda after, limit: search_product_ids(query, after=after, limit=limit, products=matching)
+        )
+    except (ValueError, InvalidCursor) as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    queryset, kind = product_queryset(request, fields)
+    found = queryset.in_bulk(ids)
+    products = [found[pk] for pk in ids if pk in found]
+    return paginator.add_headers(product_list_response(request, products, fields, kind))
+
+@condition(**conditional_state(product_detail_state, catalog=True))
+@cache_catalog_response
 @api_view(['GET'])
 @permission_classes([AllowAny])
 def get_product_detail(request, id):
     """
     Get details for a specific product by ID.
+    Supports the same ?fields= selector as the product list.
     """
     try:
-        product = Product.objects.get(id=id)
-        serializer = ProductSerializer(product, context={'request': request})
+        fields = ProductSerializer.parse_fields(request.query_params.get('fields'))
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    kind = document_kind(request, fields)
+    columns = ProductSerializer.columns_for(fields) if fields is not None else None
+    try:
+        if not _fits_id_column(id):
+            raise Product.DoesNotExist
+        if kind:
+            product = Product.objects.with_document(kind).get(id=id)
+            body = render_document(request, product, kind)
+            return PrerenderedResponse(body)
+        product = Product.objects.catalog(columns).get(id=id)
+        serializer = ProductSerializer(product, fields=fields, context={'request': request})
         return Response(serializer.data)
     except Product.DoesNotExist:
         return Response(
@@ -72,6 +354,8 @@ def get_product_detail(request, id):
         )
 
 
+@condition(**conditional_state(category_list_state, catalog=True))
+@cache_catalog_response
 @api_view(['GET'])
 @permission_classes([AllowAny])
 def get_categories(request):
@@ -82,139 +366,16 @@ def get_categories(request):
     serializer = CategorySerializer(categories, many=True)
     return Response(serializer.data)
 
-# --- PDF Generation and Email Sending ---
-def generate_invoice_pdf(order):
-    buffer = BytesIO()
-    p = canvas.Canvas(buffer, pagesize=(595, 842))  # A4 size
-    
-    # Add logo and header
-    p.setFont("Helvetica-Bold", 16)
-    p.drawString(50, 800, "CS308 Store")
-    p.setFont("Helvetica", 10)
-    p.drawString(50, 780, "Invoice")
-    
-    # Add invoice information
-    p.setFont("Helvetica-Bold", 12)
-    p.drawString(400, 800, f"Invoice #{order.id}")
-    p.setFont("Helvetica", 10)
-    p.drawString(400, 780, f"Date: {order.created_at.strftime('%Y-%m-%d')}")
-    p.drawString(400, 765, f"Order Status: {order.get_status_display()}")
-    
-    # Add customer information
-    p.setFont("Helvetica-Bold", 12)
-    p.drawString(50, 730, "Bill To:")
-    p.setFont("Helvetica", 10)
-    p.drawString(50, 715, f"{order.user.first_name} {order.user.last_name}")
-    p.drawString(50, 700, f"Username: {order.user.username}")
-    p.drawString(50, 685, f"Email: {order.user.email}")
-    
-    
-    # Add table headers
-    p.setFont("Helvetica-Bold", 10)
-    p.drawString(50, 630, "Item")
-    p.drawString(300, 630, "Quantity")
-    p.drawString(370, 630, "Unit Price")
-    p.drawString(450, 630, "Total")
-    
-    # Add horizontal line
-    p.line(50, 620, 550, 620)
-    
-    # Add table data
-    y = 600
-    total = 0
-    p.setFont("Helvetica", 10)
-    
-    for item in order.items.all():
-        if y < 100:  # Start a new page if we run out of space
-            p.showPage()
-            p.setFont("Helvetica-Bold", 10)
-            p.drawString(50, 800, "Item")
-            p.drawString(300, 800, "Quantity")
-            p.drawString(370, 800, "Unit Price")
-            p.drawString(450, 800, "Total")
-            p.line(50, 790, 550, 790)
-            p.setFont("Helvetica", 10)
-            y = 770
-        
-        item_total = item.price_at_purchase * item.quantity
-        total += item_total
-        
-        p.drawString(50, y, item.product.title)
-        p.drawString(300, y, str(item.quantity))
-        p.drawString(370, y, f"${item.price_at_purchase:.2f}")
-        p.drawString(450, y, f"${item_total:.2f}")
-        
-        y -= 20
-    
-    # Add totals
-    p.line(50, y - 10, 550, y - 10)
-    p.drawString(350, y - 30, "Subtotal:")
-    p.drawString(450, y - 30, f"${total:.2f}")
-    
-    # Calculate tax (8%)
-    tax = total * Decimal('0.08')
-    p.drawString(350, y - 50, "Tax (8%):")
-    p.drawString(450, y - 50, f"${tax:.2f}")
-    
-    # Shipping - simplified, using fixed amount
-    shipping = Decimal('5.99')
-    p.drawString(350, y - 70, "Shipping:")
-    p.drawString(450, y - 70, f"${shipping:.2f}")
-    
-    # Final total
-    p.line(350, y - 80, 550, y - 80)
-    p.setFont("Helvetica-Bold", 12)
-    p.drawString(350, y - 100, "Total:")
-    p.drawString(450, y - 100, f"${order.total_price:.2f}")
-    
-    # Add footer
-    p.setFont("Helvetica", 8)
-    p.drawString(50, 50, "Thank you for your purchase!")
-    p.drawString(50, 35, "If you have any questions, please contact customer support.")
-    
-    p.showPage()
-    p.save()
-    buffer.seek(0)
-    return buffer
-import smtplib
-from django.core.mail import EmailMessage
-
-def send_invoice_email(pdf, order):
-    pdf.seek(0)
-    email = EmailMessage(
-        subject=f"Invoice for Order #{order.id}",
-        body="Please find your invoice attached.",
-        from_email="postmaster@sandbox0769910aa82f4c699d5b1ff8211a21a1.mailgun.org",
-        to=["batuhan.baykalhhh@gmail.com"],
-    )
-    email.attach(
-        f"invoice_order_{order.id}.pdf",
-        pdf.read(),
-        "application/pdf"
+def serve_invoice(request, order):
+    # Sent from the stored file, so the front proxy can take over the transfer
+    return serve_file(
+        request,
+        order.invoice_pdf.name,
+        cache_control=PRIVATE_CACHE_CONTROL,
+        attachment_name=f"invoice_order_{order.id}.pdf",
+        content_type='application/pdf',
     )
 
-    # This gives you an email.message.Message instance
-    std_msg = email.message()  
-
-    with smtplib.SMTP("smtp.mailgun.org", 2525) as server:
-        server.set_debuglevel(1)
-        server.ehlo()
-        server.starttls()
-        server.ehlo()
-        server.login(
-            "postmaster@sandbox0769910aa82f4c699d5b1ff8211a21a1.mailgun.org",
-            os.getenv("mailgun")
-        )
-        # Send the *standard* message, not the Django wrapper
-        server.send_message(std_msg)
-
-    print(f"Email sent successfully for order {order.id}")
-    return True
-
-
-
-    # Send email via ProtonMail SMTP
-
 @api_view(['GET'])
 @permission_classes([AllowAny])
 def download_invoice(request, order_id):
@@ -247,33 +408,91 @@ def download_invoice(request, order_id):
             pass
             
         # Get the order, ensuring it belongs to the requesting user
-        order = get_object_or_404(Order, id=order_id, user=user)
+        order = get_object_or_404(Order.objects.select_related('user'), id=order_id, user=user)
         
-        # Check if invoice already exists
-        if order.invoice_pdf and order.invoice_pdf.name:
-            # Return existing invoice if it exists
-            response = HttpResponse(order.invoice_pdf.open(), content_type='application/pdf')
-            response['Content-Disposition'] = f'attachment; filename="invoice_order_{order.id}.pdf"'
+        # Reuses the stored PDF unless the order changed since it was rendered
+        try:
+            ensure_invoice(order)
+        except InvoiceBusy as e:
+            response = Response({'error': str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+            response['Retry-After'] = '5'
             return response
-        
-        # Generate new invoice
-        buffer = generate_invoice_pdf(order)
-        
-        # Save invoice to model for future use
-        order.invoice_pdf.save(f"invoice_order_{order.id}.pdf", ContentFile(buffer.read()))
-        buffer.seek(0)  # Reset buffer position after reading
-        
-        # Return the PDF as a response
-        response = HttpResponse(buffer, content_type='application/pdf')
-        response['Content-Disposition'] = f'attachment; filename="invoice_order_{order.id}.pdf"'
-        return response
+        return serve_invoice(request, order)
         
     except Exception as e:
         return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+@api_view(['GET'])
+@permission_classes([IsStaff])
+def export_invoices(request):
+    """
+    Stream a ZIP of the invoices of every matching order, for reconciliation.
+
+    Query params:
+        from / to: first and last order date, YYYY-MM-DD (inclusive)
+        status: comma separated order statuses
+    """
+    try:
+        filters = parse_export_filters(request.query_params)
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    # Rendered in this process: forking a pool from a web worker would copy
+    # its database connections and threads. The export_invoices command
+    # renders in parallel for large exports.
+    order_ids = export_order_ids(filters)
+    response = StreamingHttpResponse(stream_invoice_zip(iter_invoices(order_ids)), content_type='application/zip')
+    period = f"{request.query_params.get('from') or 'start'}_{request.query_params.get('to') or 'now'}"
+    response['Content-Disposition'] = f'attachment; filename="invoices_{period}.zip"'
+    return response
+
+@api_view(['GET'])
+@permission_classes([IsStaff])
+def product_stock(request, product_id):
+    """
+    A product's stock from the movement ledger, now or as of ?at= (an ISO
+    date or datetime), with the movements in the ?from= .. at range.
+    """
+    product = get_object_or_404(Product.objects.only('id', 'quantity_in_stock'), pk=product_id)
+    try:
+        at = parse_ledger_time(request.query_params.get('at')) or timezone.now()
+        start = parse_ledger_time(request.query_params.get('from'))
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    data = {
+        'product': product.id,
+        'at': at,
+        'quantity': stock_as_of(product.id, at),
+        'quantity_in_stock': product.quantity_in_stock,
+    }
+    if start is not None:
+        data['movements'] = list(
+            StockMovement.objects.filter(product=product, created_at__gt=start, created_at__lte=at)
+            .order_by('created_at', 'id')
+            .values('id', 'change', 'reason', 'order_id', 'created_at')
+        )
+    return Response(data)
+
+
+def parse_ledger_time(value):
+    """Parse an ISO date (start of that day) or datetime; None if empty."""
+    if not value:
+        return None
+    parsed = parse_datetime(value)
+    if parsed is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(f"'{value}' is not an ISO date or datetime")
+        parsed = datetime.combine(day, datetime.min.time())
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
 # --- Order Cancellation and Refund ---
 @api_view(['POST'])
 @permission_classes([AllowAny])
+@idempotent
 def cancel_order(request, order_id):
     # Get user ID from request data
     user_id = request.data.get('user')
@@ -303,6 +522,7 @@ def cancel_order(request, order_id):
 
 @api_view(['POST'])
 @permission_classes([AllowAny])
+@idempotent
 def refund_order(request, order_id):
     # Get user ID from request data
     user_id = request.data.get('user')
@@ -326,28 +546,171 @@ def refund_order(request, order_id):
             {'error': 'Order cannot be refunded.'},
             status=status.HTTP_400_BAD_REQUEST
         )
-    
-    refunded_amount = 0
-    for item in order.items.all():
-        item.product.quantity_in_stock += item.quantity
-        item.product.save()
-        # Use discounted price if available, otherwise fall back to price_at_purchase
-        refund_price = item.discounted_price if item.discounted_price else item.price_at_purchase
-        refunded_amount += refund_price * item.quantity
 
-    order.status = 'refunded'
-    order.save()
+    # One transaction with a fixed number of queries, however many items
+    # the order has
+    with transaction.atomic():
+        # Conditional on the status, so a second refund of the same order
+        # (e.g. a double click) can't restock it twice
+        if not Order.objects.filter(pk=order.pk, status='delivered').update(status='refunded'):
+            return Response(
+                {'error': 'Order cannot be refunded.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
 
-    send_mail(
-        'Refund Approved',
-        f'Your order #{order.id} has been refunded. Refunded Amount: ${refunded_amount:.2f}.',
-        settings.DEFAULT_FROM_EMAIL if hasattr(settings, 'DEFAULT_FROM_EMAIL') else 'noreply@example.com',
-        [order.user.email]
-    )
+        items = order.items.all()
+        quantities = dict(
+            items.values('product_id').annotate(total=Sum('quantity')).values_list('product_id', 'total')
+        )
+        Product.objects.restock(quantities)
+        record_movements(quantities, 'refund', order)
+        refresh_product_caches(list(quantities))
+
+        # Use discounted price if available, otherwise fall back to price_at_purchase
+        refund_price = Coalesce(NullIf('discounted_price', Value(0)), 'price_at_purchase')
+        refunded_amount = items.aggregate(
+            total=Sum(refund_price * F('quantity'), output_field=models.DecimalField(max_digits=12, decimal_places=2))
+        )['total'] or 0
+
+        queue_email(
+            'Refund Approved',
+            f'Your order #{order.id} has been refunded. Refunded Amount: ${refunded_amount:.2f}.',
+            [user.email]
+        )
     return Response({'message': 'Order refunded successfully'})
 
 @api_view(['POST'])
+@permission_classes([IsStaff])
+def transition_order_status(request):
+    """
+    Move a batch of orders to a new status, for the deliveries dashboard.
+    Expected format:
+    {
+        "order_ids": [1, 2, 3],
+        "status": "in_transit"
+    }
+    Orders the state machine doesn't allow to move are reported per id and
+    left as they are.
+    """
+    order_ids = request.data.get('order_ids')
+    to_status = request.data.get('status')
+    maximum = getattr(settings, 'ORDER_STATUS_BATCH_MAX', 500)
+    if not isinstance(order_ids, list) or not order_ids:
+        return Response(
+            {'error': 'order_ids must be a non-empty list'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    if len(order_ids) > maximum:
+        return Response(
+            {'error': f'At most {maximum} orders can be updated at once'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    try:
+        order_ids = [int(order_id) for order_id in order_ids]
+        # Larger ids overflow the database's integer columns
+        if any(not 0 <= order_id < 2 ** 63 for order_id in order_ids):
+            raise ValueError
+    except (TypeError, ValueError):
+        return Response(
+            {'error': 'order_ids must be numeric'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    if not isinstance(to_status, str) or to_status not in TRANSITIONS:
+        return Response(
+            {'error': f"status must be one of: {', '.join(TRANSITIONS)}"},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    results = transition_orders(order_ids, to_status)
+
+    return Response({
+        'status': to_status,
+        'updated': sum(1 for error in results.values() if error is None),
+        'results': [
+            {'id': order_id, 'success': True} if error is None
+            else {'id': order_id, 'success': False, 'error': error}
+            for order_id, error in results.items()
+        ],
+    })
+
+@api_view(['POST', 'DELETE'])
 @permission_classes([AllowAny])
+def reservations_api(request):
+    """
+    POST: Hold stock for a cart entering checkout, replacing the user's
+    previous holds. Expected format:
+    {
+        "user": user_id,
+        "items": [{"product": product_id, "quantity": quantity}, ...]
+    }
+    DELETE: Release the user's holds (?user=user_id)
+    """
+    user_id = request.data.get('user') or request.query_params.get('user')
+    if not user_id:
+        return Response(
+            {'error': 'User ID is required'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    try:
+        user = User.objects.get(id=user_id)
+    except (User.DoesNotExist, ValueError):
+        return Response(
+            {'error': f'User with ID {user_id} not found'},
+            status=status.HTTP_404_NOT_FOUND
+        )
+
+    if request.method == 'DELETE':
+        return Response({'released': release_user_holds(user)})
+
+    items = request.data.get('items')
+    if not isinstance(items, list) or not items:
+        return Response(
+            {'error': 'Items are required'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    quantities = {}
+    for item in items:
+        try:
+            product_id = int(item.get('product'))
+            quantity = int(item.get('quantity', 0))
+        except (AttributeError, TypeError, ValueError):
+            return Response(
+                {'error': 'Each item needs a numeric product and quantity'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if product_id < 1 or not _fits_id_column(product_id):
+            return Response(
+                {'error': f'Product with ID {product_id} not found'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if quantity < 1:
+            return Response(
+                {'error': f'Quantity for product {product_id} must be at least 1'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        quantities[product_id] = quantities.get(product_id, 0) + quantity
+        # Larger quantities overflow the database's integer columns
+        if quantities[product_id] >= 2 ** 63:
+            return Response(
+                {'error': f'Quantity for product {product_id} is too large'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+    try:
+        expires_at = hold_stock(user, quantities)
+    except InsufficientStock as e:
+        return Response({'error': str(e)}, status=status.HTTP_409_CONFLICT)
+    return Response({
+        'expires_at': expires_at,
+        'items': [
+            {'product': product_id, 'quantity': quantity}
+            for product_id, quantity in quantities.items()
+        ],
+    }, status=status.HTTP_201_CREATED)
+
+@api_view(['POST'])
+@permission_classes([AllowAny])
+@idempotent
 def create_order(request):
     """
     Create a new order with items.
@@ -367,7 +730,7 @@ def create_order(request):
     }
     """
     try:
-        print("Received order creation request:", request.data)
+        logger.debug("Received order creation request: %s", request.data)
         
         # Get user from request data
         user_id = request.data.get('user')
@@ -395,92 +758,121 @@ def create_order(request):
         
         # Get order items
         order_items = request.data.get('order_items', [])
+        if not isinstance(order_items, list):
+            return Response(
+                {'error': 'Order items must be a list'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         if not order_items or len(order_items) == 0:
             return Response(
                 {'error': 'Order items are required'},
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # Get total price or calculate it
-        total_price = request.data.get('total_price', 0)
-        if not total_price:
-            # Calculate total if not provided
-            total_price = 0
-            for item in order_items:
-                price = float(item.get('price_at_purchase', 0))
-                quantity = int(item.get('quantity', 0))
-                total_price += price * quantity
-        
-        # Check stock availability for all items before creating the order
+        # Validate the lines; several lines may name the same product
+        lines = []
+        quantities = {}
         for item in order_items:
-            product_id = item.get('product')
-            quantity = int(item.get('quantity', 0))
-            
             try:
-                product = Product.objects.get(id=product_id)
-                if quantity > product.quantity_in_stock:
-                    return Response(
-                        {'error': f'Not enough stock for {product.title}. Available: {product.quantity_in_stock}, Requested: {quantity}'},
-                        status=status.HTTP_400_BAD_REQUEST
-                    )
-            except Product.DoesNotExist:
+                product_id = int(item.get('product'))
+                quantity = int(item.get('quantity', 0))
+            except (AttributeError, TypeError, ValueError):
+                return Response(
+                    {'error': 'Each order item needs a numeric product and quantity'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            if not _fits_id_column(product_id):
                 return Response(
                     {'error': f'Product with ID {product_id} not found'},
                     status=status.HTTP_400_BAD_REQUEST
                 )
+            if quantity < 1:
+                return Response(
+                    {'error': f'Quantity for product {product_id} must be at least 1'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            price_at_purchase = item.get('price_at_purchase')
+            if price_at_purchase is not None:
+                try:
+                    price_at_purchase = Decimal(str(price_at_purchase))
+                except InvalidOperation:
+                    price_at_purchase = None
+                if price_at_purchase is None or not price_at_purchase.is_finite():
+                    return Response(
+                        {'error': f'Price for product {product_id} must be a number'},
+                        status=status.HTTP_400_BAD_REQUEST
+                    )
+            lines.append((product_id, quantity, price_at_purchase))
+            quantities[product_id] = quantities.get(product_id, 0) + quantity
         
-        # Create the order
-        order = Order.objects.create(
-            user=user,
-            total_price=total_price,
-            status='processing'
-        )
-        
-        print(f"Created order: {order.id}")
+        # Get total price or calculate it
+        total_price = request.data.get('total_price', 0)
+        if not total_price:
+            # Calculate total if not provided
+            total_price = sum(
+                (price or 0) * quantity for _, quantity, price in lines
+            )
         
-        # Create order items and reduce stock
-        for item in order_items:
-            product_id = item.get('product')
-            quantity = int(item.get('quantity', 0))
-            price_at_purchase = item.get('price_at_purchase')
-            
-            # Convert price string to Decimal if needed
-            if isinstance(price_at_purchase, str):
-                price_at_purchase = Decimal(price_at_purchase)
-            
-            product = Product.objects.get(id=product_id)
+        # Everything below is one transaction with a fixed number of queries,
+        # however many items the cart has.
+        with transaction.atomic():
+            # The buyer's reservations from checkout become part of the sale;
+            # what others have reserved isn't available to them
+            held = claim_holds(user, list(quantities))
+            # Lock the products so concurrent checkouts queue up behind us
+            products = (
+                Product.objects.select_for_update()
+                .only('id', 'title', 'price', 'quantity_in_stock', 'reserved_quantity')
+                .in_bulk(list(quantities))
+            )
+            for product_id, quantity in quantities.items():
+                product = products.get(product_id)
+                if product is None:
+                    transaction.set_rollback(True)
+                    return Response(
+                        {'error': f'Product with ID {product_id} not found'},
+                        status=status.HTTP_400_BAD_REQUEST
+                    )
+                available = product.available_quantity + held.get(product_id, 0)
+                if quantity > available:
+                    transaction.set_rollback(True)
+                    return Response(
+                        {'error': f'Not enough stock for {product.title}. Available: {available}, Requested: {quantity}'},
+                        status=status.HTTP_400_BAD_REQUEST
+                    )
             
-            # Create order item
-            order_item = OrderItem.objects.create(
-                order=order,
-                product=product,
-                quantity=quantity,
-                price_at_purchase=price_at_purchase
+            # Create the order
+            order = Order.objects.create(
+                user=user,
+                total_price=total_price,
+                status='processing'
             )
             
-            # Reduce product stock
-            product.quantity_in_stock -= quantity
-            product.save()
+            OrderItem.objects.bulk_create([
+                OrderItem(
+                    order=order,
+                    product_id=product_id,
+                    quantity=quantity,
+                    price_at_purchase=products[product_id].price if price is None else price,
+                )
+                for product_id, quantity, price in lines
+            ])
             
-            print(f"Added item: {product.title} x{quantity} to order {order.id}")
-            print(f"Updated stock for product {product.id} to {product.quantity_in_stock}")
-        
+            # The WHERE clause re-checks stock, so databases without row
+            # locks (SQLite) still can't oversell
+            if Product.objects.take_stock(quantities, held) != len(quantities):
+                transaction.set_rollback(True)
+                return Response(
+                    {'error': 'Not enough stock left for one or more items, please try again'},
+                    status=status.HTTP_409_CONFLICT
+                )
+            record_movements({product_id: -quantity for product_id, quantity in quantities.items()}, 'sale', order)
+            refresh_product_caches(list(quantities))
+            # The invoice is rendered and emailed by the run_jobs worker; the
+            # job commits with the order, so neither exists without the other
+            enqueue_invoice(order)
         
-        # Try to send invoice email
-        try:
-            pdf = generate_invoice_pdf(order)
-            order.invoice_pdf.save(f'invoice_order_{order.id}.pdf', ContentFile(pdf.read()))
-            # Save PDF to media folder
-            media_path = os.path.join('media', 'invoices')
-            os.makedirs(media_path, exist_ok=True)
-            
-            file_path = os.path.join(media_path, f'invoice_order_{order.id}.pdf')
-            with open(file_path, 'wb') as f:
-                f.write(pdf.read())
-            send_invoice_email(pdf,order)
-            print(f"Invoice email sent for order {order.id}")
-        except Exception as email_error:
-            print(f"Failed to send invoice email: {str(email_error)}")
+        logger.debug("Created order %s with %s items", order.id, len(lines))
         
         # Return order details
         return Response({
@@ -494,7 +886,7 @@ def create_order(request):
         }, status=status.HTTP_201_CREATED)
         
     except Exception as e:
-        print(f"Order creation error: {str(e)}")
+        logger.exception("Order creation failed")
         return Response(
             {'error': str(e)},
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
@@ -520,12 +912,33 @@ def order_history(request):
                 status=status.HTTP_404_NOT_FOUND
             )
             
-        orders = Order.objects.filter(user=user).prefetch_related(
-            'items__product'
-        ).order_by('-created_at')
-        
-        serializer = OrderSerializer(orders, many=True)
-        return Response(serializer.data)
+        # Line items are opt-in: list screens that only show the orders
+        # don't pay for them
+        include = {value.strip() for value in request.query_params.get('include', '').split(',')}
+        include_items = 'items' in include
+
+        orders = Order.objects.filter(user=user).only(
+            'id', 'user_id', 'created_at', 'status', 'total_price', 'invoice_pdf'
+        )
+        if include_items:
+            # One query for the lines of the whole page, products joined in
+            orders = orders.prefetch_related(Prefetch(
+                'items',
+                queryset=OrderItem.objects.select_related('product').only(
+                    'id', 'order_id', 'quantity', 'price_at_purchase',
+                    *[f'product__{column}' for column in ProductSnapshotSerializer.COLUMNS],
+                ).order_by('id'),
+            ))
+
+        paginator = OrderHistoryPagination(request)
+        try:
+            page = paginator.paginate_queryset(orders)
+        except InvalidCursor as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        serializer = OrderHistorySerializer(
+            page, many=True, include_items=include_items, context={'request': request}
+        )
+        return paginator.add_headers(Response(serializer.data))
     except Exception as e:
         return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
@@ -623,12 +1036,10 @@ def forgot_password(request):
 
         # Send reset email
         reset_url = f"{request.build_absolute_uri('/')}reset-password?token={token}"
-        send_mail(
+        queue_email(
             'Password Reset Request',
             f'Click the following link to reset your password: {reset_url}',
-            settings.DEFAULT_FROM_EMAIL,
             [email],
-            fail_silently=False,
         )
 
         return Response({
@@ -869,22 +1280,22 @@ def check_auth(request):
 
 
 # Media files serving view
-def serve_media_file(request, filename):
+def serve_media_file(request, path):
     """
-    Custom view to serve media files directly
+    Serve a public file from MEDIA_ROOT (product images and their variants)
+    the way MEDIA_SERVE_MODE says. Invoices are per user and only go out
+    through download_invoice.
     """
-    # Clean the filename to prevent directory traversal attacks
-    clean_filename = os.path.basename(filename)
-    
-    # Build the full path to the file in the media directory
-    file_path = os.path.join(settings.MEDIA_ROOT, 'products', clean_filename)
-    
-    # Check if the file exists
-    if not os.path.exists(file_path):
+    if request.method not in ('GET', 'HEAD'):
+        return HttpResponse(status=405)
+    # Check the path that will be opened: safe_join collapses ./ and ../
+    path = posixpath.normpath(path)
+    if path.split('/', 1)[0] == 'invoices':
+        return HttpResponse("File not found", status=404)
+    try:
+        return serve_file(request, path)
+    except Http404:
         return HttpResponse("File not found", status=404)
-    
-    # Serve the file directly
-    return FileResponse(open(file_path, 'rb'))
 
 @api_view(['GET', 'POST'])
 @permission_classes([AllowAny])
@@ -899,11 +1310,17 @@ def ratings_api(request):
         user_id = request.query_params.get('user')
         
         # Apply filters if provided
-        ratings = Rating.objects.all()
+        ratings = Rating.objects.select_related('user', 'product__category')
         if product_id:
             ratings = ratings.filter(product_id=product_id)
         if user_id:
             ratings = ratings.filter(user_id=user_id)
+
+        # ?stream=true streams every rating as it is read, for exports
+        if wants_stream(request):
+            return streaming_json_response(
+                ratings.order_by('id'), serializer_chunk_renderer(RatingSerializer)
+            )
             
         serializer = RatingSerializer(ratings, many=True)
         return Response(serializer.data)
@@ -964,6 +1381,7 @@ def ratings_api(request):
                 # Update existing rating
                 existing_rating.score = rating_value
                 existing_rating.save()
+                product.refresh_from_db(fields=Product.RATING_SUMMARY_FIELDS)
                 message = 'Rating updated successfully'
             else:
                 # Create new rating
@@ -1003,11 +1421,17 @@ def comments_api(request):
         user_id = request.query_params.get('user')
         
         # Apply filters if provided
-        comments = Comment.objects.all()
+        comments = Comment.objects.select_related('user', 'product__category')
         if product_id:
             comments = comments.filter(product_id=product_id)
         if user_id:
             comments = comments.filter(user_id=user_id)
+
+        # ?stream=true streams every comment as it is read, for exports
+        if wants_stream(request):
+            return streaming_json_response(
+                comments, serializer_chunk_renderer(CommentSerializer)
+            )
             
         serializer = CommentSerializer(comments, many=True)
         return Response(serializer.data)
@@ -1092,12 +1516,16 @@ def comments_api(request):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
+@condition(**conditional_state(product_comments_state))
 @api_view(['GET'])
 @permission_classes([AllowAny])
 def get_product_comments(request, product_id):
     """
     Get all approved comments for a specific product.
     """
+    # Like any other unknown product, one whose id can't exist has none
+    if not _fits_id_column(product_id):
+        return Response([])
     try:
         # Get only approved comments for the specified product
         comments = Comment.objects.filter(
@@ -1,6 +1,10 @@
 import os
 from pathlib import Path
 
+from dotenv import load_dotenv
+
+load_dotenv()
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 # The parent.parent moves two levels up: (config -> app-backend)
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -75,6 +79,21 @@ DATABASES = {
     }
 }
 
+# Cache - local memory by default so no external service is needed. For a
+# cache shared between worker processes, switch to the file based backend:
+#   'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+#   'LOCATION': BASE_DIR / 'cache',
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'cs308-store',
+        'OPTIONS': {'MAX_ENTRIES': 5000},
+    }
+}
+
+# Seconds a rendered catalog response stays cached (see app_backend.cache)
+CATALOG_CACHE_TIMEOUT = 300
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -105,6 +124,14 @@ STATIC_URL = '/static/'
 MEDIA_URL = '/media/products/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media/products')
 
+# How media files and invoices are sent (see app_backend.media): 'direct'
+# streams them from Django, 'x-accel-redirect' (nginx) and 'x-sendfile'
+# (Apache, lighttpd) hand the transfer to the front proxy.
+MEDIA_SERVE_MODE = os.environ.get('MEDIA_SERVE_MODE', 'direct')
+# nginx location serving MEDIA_ROOT, marked `internal`, for x-accel-redirect:
+#   location /protected-media/ { internal; alias /path/to/media/products/; }
+MEDIA_ACCEL_PREFIX = '/protected-media/'
+
 # Default primary key field type
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
@@ -124,6 +151,22 @@ CORS_ALLOW_HEADERS = [
     'user-agent',
     'x-csrftoken',
     'x-requested-with',
+    'if-none-match',
+    'if-modified-since',
+    'range',
+    'if-range',
+    'idempotency-key',
+]
+
+# Let the frontend read the pagination and cache validator headers
+CORS_EXPOSE_HEADERS = [
+    'link',
+    'x-next-cursor',
+    'etag',
+    'last-modified',
+    'content-range',
+    'accept-ranges',
+    'idempotent-replayed',
 ]
 
 # CSRF settings
@@ -155,3 +198,44 @@ REST_FRAMEWORK = {
         'rest_framework.authentication.BasicAuthentication',
     ],
 }
+
+# Product catalog pagination (see app_backend.pagination.KeysetPagination)
+PRODUCT_PAGE_SIZE = 50
+PRODUCT_MAX_PAGE_SIZE = 200
+ORDER_HISTORY_PAGE_SIZE = 20
+ORDER_HISTORY_MAX_PAGE_SIZE = 100
+ORDER_STATUS_BATCH_MAX = 500
+
+# Checkout stock holds, see app_backend/reservations.py
+RESERVATION_TTL = 600  # seconds
+RESERVATION_SWEEP_BATCH = 500
+
+# Stock movement ledger, see app_backend/ledger.py
+STOCK_SNAPSHOT_LAG = 60  # seconds of movements left out of snapshots
+
+# Idempotency-Key handling, see app_backend/idempotency.py
+IDEMPOTENCY_KEY_TTL = 24 * 60 * 60  # seconds a response is replayed for
+IDEMPOTENCY_LOCK_TIMEOUT = 60  # seconds before an unfinished request's key can be reused
+
+# Rows per database round trip when streaming unpaginated lists (?stream=true)
+STREAM_CHUNK_SIZE = 500
+
+# Background jobs (see app_backend.jobs, run with `python manage.py run_jobs`)
+JOB_RETRY_DELAY = 30  # seconds before the first retry, doubled on every attempt
+JOB_LOCK_TIMEOUT = 600  # seconds after which a running job is assumed dead and requeued
+
+# Outgoing mail. Messages are queued in the outbox (app_backend.outbox) and
+# sent by `python manage.py send_outbox` over one reused connection.
+EMAIL_BACKEND = os.environ.get('EMAIL_BACKEND', 'django.core.mail.backends.smtp.EmailBackend')
+EMAIL_HOST = 'smtp.mailgun.org'
+EMAIL_PORT = 2525
+EMAIL_USE_TLS = True
+EMAIL_HOST_USER = 'postmaster@sandbox0769910aa82f4c699d5b1ff8211a21a1.mailgun.org'
+EMAIL_HOST_PASSWORD = os.environ.get('mailgun', '')
+DEFAULT_FROM_EMAIL = EMAIL_HOST_USER
+# Seconds before an SMTP connection or command gives up
+EMAIL_TIMEOUT = 30
+
+OUTBOX_BATCH_SIZE = 50  # messages sent per batch
+OUTBOX_MAX_ATTEMPTS = 5  # failed sends before a message is marked dead
+OUTBOX_RETRY_DELAY = 60  # seconds before the first retry, doubled on every attempt
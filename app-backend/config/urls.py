@@ -1,8 +1,9 @@
+import re
+
 from django.contrib import admin
-from django.urls import path
+from django.urls import path, re_path
 from app_backend import views
 from django.conf import settings
-from django.conf.urls.static import static
 from django.views.decorators.csrf import csrf_exempt
 
 urlpatterns = [
@@ -11,20 +12,27 @@ urlpatterns = [
     
     # API endpoints
     # Products
+    path('api/products/', views.list_products, name='api_list_products'),
     path('api/products/all/', views.get_all_products, name='api_get_all_products'),
+    path('api/products/search/', views.search_products, name='api_search_products'),
     path('api/products/<int:id>/', views.get_product_detail, name='api_product_detail'),
     path('api/products/<int:product_id>/comments/', views.get_product_comments, name='api_product_comments'),
+    path('api/products/<int:product_id>/stock/', views.product_stock, name='api_product_stock'),
 
     # Filters
     path('api/categories/', views.get_categories, name='api_categories'),
+    path('api/search/', views.search_products, name='api_search'),
 
     
     # Orders
     path('api/orders/', views.create_order, name='api_create_order'),
+    path('api/reservations/', views.reservations_api, name='api_reservations'),
     path('api/orders/history/', views.order_history, name='api_order_history'),
+    path('api/orders/status/', views.transition_order_status, name='api_transition_order_status'),
     path('api/orders/<int:order_id>/cancel/', views.cancel_order, name='api_cancel_order'),
     path('api/orders/<int:order_id>/refund/', views.refund_order, name='api_refund_order'),
     path('api/orders/<int:order_id>/invoice/', views.download_invoice, name='api_download_invoice'),
+    path('api/invoices/export/', views.export_invoices, name='api_export_invoices'),
     
     # Auth
     path('api/auth/login/', csrf_exempt(views.login_api), name='api_login'),
@@ -41,6 +49,11 @@ urlpatterns = [
     path('api/comments/', views.comments_api, name='api_comments'),
 ]
 
-# Serve media files in development
-if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+# Media files, sent directly or handed to the front proxy (see MEDIA_SERVE_MODE)
+urlpatterns += [
+    re_path(
+        r'^%s(?P<path>.*)$' % re.escape(settings.MEDIA_URL.lstrip('/')),
+        views.serve_media_file,
+        name='media',
+    ),
+]
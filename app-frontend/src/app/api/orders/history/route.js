@@ -5,13 +5,19 @@ export async function GET(request) {
     // Get user ID from request query parameters
     const { searchParams } = new URL(request.url);
     const userId = searchParams.get('userId');
+    const cursor = searchParams.get('cursor');
     
     if (!userId) {
       return NextResponse.json({ error: 'User ID is required' }, { status: 400 });
     }
 
-    // Call the backend with user ID in the query params
-    const response = await fetch(`${process.env.NEXT_PUBLIC_API_URL}/api/orders/history/?user=${userId}`, {
+    // Call the backend with user ID in the query params; the orders page
+    // shows line items, so ask for them
+    const query = new URLSearchParams({ user: userId, include: 'items' });
+    if (cursor) {
+      query.set('cursor', cursor);
+    }
+    const response = await fetch(`${process.env.NEXT_PUBLIC_API_URL}/api/orders/history/?${query}`, {
       method: 'GET',
       headers: {
         'Content-Type': 'application/json',
@@ -38,7 +44,11 @@ export async function GET(request) {
       return NextResponse.json({ orders: [] });
     }
     
-    return NextResponse.json(data);
+    // Pass the next page's cursor on to the orders page
+    const nextCursor = response.headers.get('X-Next-Cursor');
+    return NextResponse.json(data, {
+      headers: nextCursor ? { 'X-Next-Cursor': nextCursor } : {},
+    });
   } catch (error) {
     console.error('Order history error:', error.message);
     return NextResponse.json({ error: error.message }, { status: 500 });
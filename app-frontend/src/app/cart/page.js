@@ -2,6 +2,7 @@
 import React, { useState, useEffect } from "react";
 import Link from "next/link";
 import CartItem from "./CartItem";
+import { refreshCart } from "../../lib/cart";
 
 export default function CartPage() {
     const [cart, setCart] = useState([]);
@@ -12,6 +13,11 @@ export default function CartPage() {
         const storedCart = JSON.parse(localStorage.getItem("cart")) || [];
         setCart(storedCart);
         setLoading(false);
+
+        // Current prices and stock for every line, in one request
+        refreshCart(storedCart)
+            .then(setCart)
+            .catch(error => console.error("Error refreshing cart:", error));
     }, []);
 
     // Update quantity function
@@ -1,7 +1,8 @@
 "use client";
-import { useState, useEffect } from "react";
+import { useState, useEffect, useRef } from "react";
 import { useRouter } from "next/navigation";
 import Link from "next/link";
+import { refreshCart } from "../../lib/cart";
 
 export default function CheckoutPage() {
     const router = useRouter();
@@ -15,6 +16,8 @@ export default function CheckoutPage() {
     const [address, setAddress] = useState("");
     const [submitting, setSubmitting] = useState(false);
     const [errorMessage, setErrorMessage] = useState("");
+    // Sent as Idempotency-Key, so resubmitting after a network error can't order twice
+    const orderAttemptKey = useRef(null);
 
     useEffect(() => {
         // Check if user is logged in
@@ -22,12 +25,45 @@ export default function CheckoutPage() {
         setIsLoggedIn(!!user);
     
 
-        // Load cart from localStorage
+        // Load cart from localStorage, with current prices and stock
         const storedCart = JSON.parse(localStorage.getItem("cart")) || [];
         setCart(storedCart);
         setLoading(false);
+        const parsedUser = JSON.parse(user || "{}");
+        refreshCart(storedCart)
+            .catch(error => {
+                console.error("Error refreshing cart:", error);
+                return storedCart;
+            })
+            .then(items => {
+                setCart(items);
+                // Hold the cart's stock while the customer checks out
+                if (parsedUser.id && items.length > 0) {
+                    reserveStock(parsedUser.id, items);
+                }
+            });
     }, []);
 
+    const reserveStock = async (userId, items) => {
+        try {
+            const response = await fetch(`${process.env.NEXT_PUBLIC_API_URL}/api/reservations/`, {
+                method: "POST",
+                headers: { "Content-Type": "application/json" },
+                body: JSON.stringify({
+                    user: userId,
+                    items: items.map(item => ({ product: item.id, quantity: item.quantity })),
+                }),
+            });
+            if (response.status === 409) {
+                const data = await response.json();
+                setErrorMessage(data.error || "Some items in your cart are no longer available");
+            }
+        } catch (error) {
+            // Checkout still works without a hold, it just isn't guaranteed
+            console.error("Error reserving stock:", error);
+        }
+    };
+
     const handleCheckout = async (e) => {
         if (e) e.preventDefault();
         
@@ -62,16 +98,25 @@ export default function CheckoutPage() {
 
             console.log('Sending order data:', orderData);
             
+            // Kept until the server answers, a new attempt gets a new key
+            if (!orderAttemptKey.current) {
+                orderAttemptKey.current = crypto.randomUUID();
+            }
+
             // Direct request to the backend with user ID in the body
             try {
                 const response = await fetch(`${process.env.NEXT_PUBLIC_API_URL}/api/orders/`, {
                     method: "POST",
                     headers: {
                         "Content-Type": "application/json",
+                        "Idempotency-Key": orderAttemptKey.current,
                     },
                     body: JSON.stringify(orderData),
                 });
                 
+                if (response.status !== 409) {
+                    orderAttemptKey.current = null;
+                }
                 console.log('API response status:', response.status);
                 
                 const data = await response.json();
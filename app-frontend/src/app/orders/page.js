@@ -8,6 +8,8 @@ export default function OrderHistory() {
   const [isLoggedIn, setIsLoggedIn] = useState(false);
   const [userId, setUserId] = useState(null);
   const [error, setError] = useState(null);
+  const [nextCursor, setNextCursor] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [debugInfo, setDebugInfo] = useState(null);
   const [ratings, setRatings] = useState({});
   const [reviews, setReviews] = useState({});
@@ -163,12 +165,17 @@ export default function OrderHistory() {
     }
   };
 
-  const fetchOrders = async (userId) => {
+  const fetchOrders = async (userId, cursor = null) => {
     try {
       console.log(`Fetching orders for user ID: ${userId}`);
       
       // Use the new API endpoint with userId as query parameter
-      const response = await fetch(`/api/orders/history?userId=${userId}`);
+      // History comes a page at a time; cursor asks for the page after it
+      const query = new URLSearchParams({ userId });
+      if (cursor) {
+        query.set('cursor', cursor);
+      }
+      const response = await fetch(`/api/orders/history?${query}`);
       console.log("Order history API response status:", response.status);
       
       const data = await response.json();
@@ -177,7 +184,8 @@ export default function OrderHistory() {
       // Make sure data is an array before setting it
       if (Array.isArray(data)) {
         console.log(`Setting ${data.length} orders`);
-        setOrders(data);
+        setOrders(previous => cursor ? [...previous, ...data] : data);
+        setNextCursor(response.headers.get('X-Next-Cursor'));
       } else if (data && Array.isArray(data.orders)) { 
         // Some APIs wrap the orders in an object
         console.log(`Setting ${data.orders.length} orders from data.orders`);
@@ -193,9 +201,15 @@ export default function OrderHistory() {
       setOrders([]);
     } finally {
       setLoading(false);
+      setLoadingMore(false);
     }
   };
 
+  const loadMoreOrders = () => {
+    setLoadingMore(true);
+    fetchOrders(userId, nextCursor);
+  };
+
   const getStatusColor = (status) => {
     switch (status) {
       case 'processing':
@@ -538,6 +552,16 @@ export default function OrderHistory() {
               )}
             </div>
           ))}
+          {nextCursor && (
+            <button
+              type="button"
+              onClick={loadMoreOrders}
+              disabled={loadingMore}
+              className="w-full py-2 text-sm font-medium rounded-md border hover:bg-gray-50 disabled:opacity-50"
+            >
+              {loadingMore ? 'Loading...' : 'Load more orders'}
+            </button>
+          )}
         </div>
       )}
       
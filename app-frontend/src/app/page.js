@@ -212,7 +212,7 @@ export default function HomePage() {
                 title={product.title}
                 price={product.price}
                 image={product.image}
-                image_url={product.image_url}
+                image_url={product.images?.card?.url || product.image_url}
                 stock={product.stock || product.quantity_in_stock}
                 rating={product.rating}
                 totalRating={product.total_ratings}
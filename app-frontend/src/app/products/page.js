@@ -8,6 +8,9 @@ import { api } from "../../lib/api";
 
 const ITEMS_PER_PAGE = 12; // Changed to 12 for better grid layout
 
+// The list summary plus description, which the search box matches against
+const PRODUCT_FIELDS = 'id,title,price,stock,is_available,category,rating,total_ratings,image_url,images,description';
+
 const FilterSidebar = ({ onFilterChange = () => {} }) => {
   // State for data
   const [categories, setCategories] = useState([]);
@@ -38,7 +41,7 @@ const FilterSidebar = ({ onFilterChange = () => {} }) => {
         // Parallel data fetching for better performance
         const [categoriesData, productsData] = await Promise.all([
           api.categories.list(),
-          api.products.list()
+          api.products.list('', '', PRODUCT_FIELDS)
         ]);
         
         setCategories(categoriesData || []);
@@ -379,7 +382,7 @@ const FilterSidebar = ({ onFilterChange = () => {} }) => {
                 title={product.title}
                 price={product.price}
                 image={product.image}
-                image_url={product.image_url}
+                image_url={product.images?.card?.url || product.image_url}
                 stock={product.stock}
                 rating={product.rating}
                 totalRating={product.total_ratings}
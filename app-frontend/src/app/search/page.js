@@ -11,20 +11,15 @@ export default function SearchPage() {
     const [products, setProducts] = useState([]);
     const [loading, setLoading] = useState(true);
     const [error, setError] = useState('');
+    // Results are ranked by relevance and paged with a cursor
     const [filters, setFilters] = useState({
-        query: searchParams.get('q') || '',
+        q: searchParams.get('q') || '',
         min_price: searchParams.get('min_price') || '',
         max_price: searchParams.get('max_price') || '',
-        category: searchParams.get('category') || '',
-        sort: searchParams.get('sort') || 'relevance',
-        page: parseInt(searchParams.get('page')) || 1
-    });
-    const [pagination, setPagination] = useState({
-        total: 0,
-        page: 1,
-        page_size: 10,
-        total_pages: 1
+        category: searchParams.get('category') || ''
     });
+    const [nextCursor, setNextCursor] = useState(null);
+    const [loadingMore, setLoadingMore] = useState(false);
 
     useEffect(() => {
         const fetchResults = async () => {
@@ -32,11 +27,12 @@ export default function SearchPage() {
                 setLoading(true);
                 const data = await api.search.products(filters);
                 setProducts(data.products);
-                setPagination(data.pagination);
+                setNextCursor(data.nextCursor);
                 setError('');
             } catch (err) {
                 setError(err.message);
                 setProducts([]);
+                setNextCursor(null);
             } finally {
                 setLoading(false);
             }
@@ -47,15 +43,20 @@ export default function SearchPage() {
 
     const handleFilterChange = (e) => {
         const { name, value } = e.target;
-        setFilters(prev => ({
-            ...prev,
-            [name]: value,
-            page: 1 // Reset to first page when filters change
-        }));
+        setFilters(prev => ({ ...prev, [name]: value }));
     };
 
-    const handlePageChange = (newPage) => {
-        setFilters(prev => ({ ...prev, page: newPage }));
+    const loadMore = async () => {
+        try {
+            setLoadingMore(true);
+            const data = await api.search.products(filters, nextCursor);
+            setProducts(prev => [...prev, ...data.products]);
+            setNextCursor(data.nextCursor);
+        } catch (err) {
+            setError(err.message);
+        } finally {
+            setLoadingMore(false);
+        }
     };
 
     return (
@@ -63,8 +64,8 @@ export default function SearchPage() {
             <div className={styles.filters}>
                 <input
                     type="text"
-                    name="query"
-                    value={filters.query}
+                    name="q"
+                    value={filters.q}
                     onChange={handleFilterChange}
                     placeholder="Search products..."
                     className={styles.searchInput}
@@ -85,18 +86,6 @@ export default function SearchPage() {
                     placeholder="Max price"
                     className={styles.priceInput}
                 />
-                <select
-                    name="sort"
-                    value={filters.sort}
-                    onChange={handleFilterChange}
-                    className={styles.sortSelect}
-                >
-                    <option value="relevance">Relevance</option>
-                    <option value="price_low">Price: Low to High</option>
-                    <option value="price_high">Price: High to Low</option>
-                    <option value="popularity">Popularity</option>
-                    <option value="newest">Newest</option>
-                </select>
             </div>
 
             {loading ? (
@@ -112,28 +101,28 @@ export default function SearchPage() {
                             <div key={product.id} className={styles.productCard}>
                                 <Link href={`/products/${product.id}`}>
                                     <img 
-                                        src={product.image_url} 
-                                        alt={product.name}
+                                        src={product.images?.card?.url || product.image_url} 
+                                        alt={product.title}
                                         className={styles.productImage}
                                     />
-                                    <h3 className={styles.productName}>{product.name}</h3>
+                                    <h3 className={styles.productName}>{product.title}</h3>
                                     <p className={styles.productPrice}>${product.price}</p>
                                 </Link>
                             </div>
                         ))}
                     </div>
 
-                    <div className={styles.pagination}>
-                        {Array.from({ length: pagination.total_pages }, (_, i) => i + 1).map(page => (
+                    {nextCursor && (
+                        <div className={styles.pagination}>
                             <button
-                                key={page}
-                                onClick={() => handlePageChange(page)}
-                                className={`${styles.pageButton} ${filters.page === page ? styles.active : ''}`}
+                                onClick={loadMore}
+                                disabled={loadingMore}
+                                className={styles.pageButton}
                             >
-                                {page}
+                                {loadingMore ? 'Loading...' : 'Load more'}
                             </button>
-                        ))}
-                    </div>
+                        </div>
+                    )}
                 </>
             )}
         </div>
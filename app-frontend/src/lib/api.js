@@ -32,12 +32,28 @@ const handleResponse = async (response, requestInfo) => {
 
 export const api = {
   products: {
-    list: async (query = '', sort = '') => {
+    list: async (query = '', sort = '', fields = '') => {
       const url = new URL(`${API_URL}/api/products/all/`);
       if (query) url.searchParams.append('q', query);
       if (sort) url.searchParams.append('sort', sort);
-      
-      const requestInfo = logRequest('GET', url.toString());
+      // Defaults to the compact summary, which has no description
+      if (fields) url.searchParams.append('fields', fields);
+
+      // The catalog is paginated, follow X-Next-Cursor until the last page
+      const products = [];
+      while (true) {
+        const requestInfo = logRequest('GET', url.toString());
+        const response = await fetch(url);
+        const cursor = response.headers.get('X-Next-Cursor');
+        products.push(...await handleResponse(response, requestInfo));
+        if (!cursor) return products;
+        url.searchParams.set('cursor', cursor);
+      }
+    },
+    
+    byIds: async (ids) => {
+      const url = `${API_URL}/api/products/?ids=${ids.join(',')}`;
+      const requestInfo = logRequest('GET', url);
       const response = await fetch(url);
       return handleResponse(response, requestInfo);
     },
@@ -92,7 +108,7 @@ export const api = {
 
   orders: {
     history: async () => {
-      const url = `${API_URL}/api/orders/history/`;
+      const url = `${API_URL}/api/orders/history/?include=items`;
       const requestInfo = logRequest('GET', url);
       const response = await fetch(url, {
         credentials: 'include',
@@ -302,15 +318,18 @@ export const api = {
   },
 
   search: {
-    products: async (params) => {
+    products: async (params, cursor = null) => {
       const queryParams = new URLSearchParams();
       for (const [key, value] of Object.entries(params)) {
         if (value) queryParams.append(key, value);
       }
+      if (cursor) queryParams.append('cursor', cursor);
       const url = `${API_URL}/api/search/?${queryParams.toString()}`;
       const requestInfo = logRequest('GET', url);
       const response = await fetch(url);
-      return handleResponse(response, requestInfo);
+      // The body is a plain list, the next page is announced in X-Next-Cursor
+      const nextCursor = response.headers.get('X-Next-Cursor');
+      return { products: await handleResponse(response, requestInfo), nextCursor };
     },
   },
 
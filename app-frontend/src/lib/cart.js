@@ -0,0 +1,15 @@
+import { api } from './api';
+
+// Cart lines are product snapshots saved in localStorage when they were
+// added. Bring them up to date with the catalog in one request: current
+// price and stock, and lines whose product no longer exists dropped.
+export const refreshCart = async (items) => {
+  if (items.length === 0) return items;
+  const { results } = await api.products.byIds(items.map(item => item.id));
+  const current = new Map(results.map(product => [product.id, product]));
+  const refreshed = items
+    .filter(item => current.has(item.id))
+    .map(item => ({ ...item, ...current.get(item.id), quantity: item.quantity }));
+  localStorage.setItem("cart", JSON.stringify(refreshed));
+  return refreshed;
+};